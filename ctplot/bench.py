@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+#    benchmarks of reading, binning and rendering plots
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# A table of random rows is written to a temporary directory, a few typical
+# plots of it are computed, saved as PNG (SVG and PDF deferred) and exported,
+# as the server does. The time of each phase (see timing.py) is the minimum
+# over all repetitions, the results are cached after the first one, so
+# reading and binning are timed in the first repetition only. The figure
+# draws per plot are counted by wrapping Figure.draw.
+#
+# The tick benchmark times ticks.wilk_ext() for random data ranges, once
+# searching (memo cleared) and once memoized, as the locators call it again
+# on every draw.
+
+import os, sys, json, shutil, logging, time
+from tempfile import mkdtemp
+from os.path import join
+from collections import OrderedDict
+import numpy as np
+import tables
+import matplotlib
+matplotlib.use('Agg')  # headless backend
+from matplotlib.figure import Figure
+import plot, timing, ticks
+from utils import LRU
+
+log = logging.getLogger('bench')
+
+plots = OrderedDict([
+    ('h1', {'m0':'h1', 'x0':'x'}),
+    ('h2', {'m0':'h2', 'x0':'x', 'y0':'y'}),
+    ('p', {'m0':'p', 'x0':'x', 'y0':'y', 'x0b':'30'}),
+    ('xy', {'m0':'xy', 'x0':'time', 'y0':'y'}),
+    ('xyz', {'m0':'xy', 'x0':'x', 'y0':'y', 'z0':'z', 'o0linestyle':'none', 'o0marker':'.'}),
+])
+
+
+def make_table(filename, rows, seed = 0):
+    'write the table /bench with the columns time, x, y and z of random rows to filename'
+    rs = np.random.RandomState(seed)
+    a = np.zeros(rows, dtype = [('time', 'f8'), ('x', 'f8'), ('y', 'f8'), ('z', 'f8')])
+    a['time'] = np.arange(rows) * 60.
+    a['x'] = rs.normal(size = rows)
+    a['y'] = a['x'] + rs.normal(size = rows)
+    a['z'] = rs.uniform(size = rows)
+    h5 = tables.openFile(filename, 'w')
+    with h5:
+        t = h5.createTable('/', 'bench', a, 'benchmark table')
+        t.attrs.units = json.dumps(['s', '', '', ''])
+
+
+
+class counting(object):
+    'context counting the calls of Figure.draw in count'
+
+    def __enter__(self):
+        self.count = 0
+        self.draw = Figure.draw
+
+        def draw(fig, renderer):
+            self.count += 1
+            return self.draw(fig, renderer)
+
+        Figure.draw = draw
+        return self
+
+    def __exit__(self, *args):
+        Figure.draw = self.draw
+
+
+
+def render(config, name, settings, filename):
+    'create the plot like the server does, return its timing.request'
+    with timing.request(name) as t:
+        p = plot.Plot(config, **settings)
+        p.save(filename, ('png',), ('svg', 'pdf'))
+        for ext in ('svg', 'pdf'):
+            plot.export(filename, ext)
+    return t
+
+
+def run(rows = 100000, repeat = 3, names = None):
+    '''return dict plot name --> dict with the wall time of the plot and of
+       each phase and the figure draws per plot'''
+    d = mkdtemp(prefix = 'ctplot-bench-')
+    try:
+        make_table(join(d, 'bench.h5'), rows)
+        config = {'datadir':d, 'cachedir':'', 'resultdir':None}
+        results = OrderedDict()
+        for name in names or plots.keys():
+            settings = dict(plots[name], s0 = 'bench.h5:/bench')
+            r = results[name] = {'wall':None, 'phases':{}, 'draws':None}
+            for k in xrange(repeat):
+                with counting() as c:
+                    t = render(config, name, settings, join(d, '{}{}'.format(name, k)))
+                r['draws'] = c.count
+                r['wall'] = min(r['wall'], t.wall) if r['wall'] is not None else t.wall
+                for ph, (wall, cpu, n) in t.phases.iteritems():
+                    r['phases'][ph] = min(r['phases'].get(ph, wall), wall)
+        return results
+    finally:
+        shutil.rmtree(d, ignore_errors = True)
+
+
+def run_ticks(cases = 200, repeat = 3, seed = 0):
+    '''return dict with the seconds per wilk_ext() call searching and
+       memoized, the minimum over repeat runs of cases random ranges'''
+    rs = np.random.RandomState(seed)
+    scale = 10. ** rs.randint(-3, 7, cases)
+    dmin = rs.uniform(-1, 1, cases) * scale
+    dmax = dmin + rs.uniform(0.01, 2, cases) * scale
+    m = rs.uniform(3, 10, cases)
+    ranges = zip(dmin, dmax, m)
+
+    def timed():
+        t = time.time()
+        for a, b, n in ranges:
+            ticks.wilk_ext(a, b, n)
+        return (time.time() - t) / cases
+
+    result = {'search':None, 'memo':None}
+    for k in xrange(repeat):
+        ticks._memo = LRU(cases)
+        for kind in ('search', 'memo'):  # the first run fills the memo
+            t = timed()
+            result[kind] = min(result[kind], t) if result[kind] is not None else t
+    return result
+
+
+def report(results, out = sys.stdout):
+    'print the results of run() as table'
+    phases = []
+    for r in results.values():
+        phases.extend([ph for ph in r['phases'] if ph not in phases])
+    out.write('{:8} {:>6} {:>9}'.format('plot', 'draws', 'wall') + ''.join([' {:>12}'.format(ph[:12]) for ph in phases]) + '\n')
+    for name, r in results.iteritems():
+        out.write('{:8} {:6d} {:9.4f}'.format(name, r['draws'], r['wall']))
+        out.write(''.join([' {:12.4f}'.format(r['phases'][ph]) if ph in r['phases'] else ' {:>12}'.format('-') for ph in phases]) + '\n')
+
+
+def main():
+    from argparse import ArgumentParser
+    import ctplot
+
+    parser = ArgumentParser(description = 'benchmark computing and rendering plots', epilog = ctplot.__epilog__)
+    parser.add_argument('-V', '--version', action = 'version', version = '%(prog)s {} build {}'.format(ctplot.__version__, ctplot.__build_date__))
+    parser.add_argument('-r', '--rows', type = int, default = 100000, help = 'rows of the benchmark table (default: 100000)')
+    parser.add_argument('-n', '--repeat', type = int, default = 3, help = 'repetitions of each plot (default: 3)')
+    parser.add_argument('-j', '--json', action = 'store_true', help = 'print the results as JSON')
+    parser.add_argument('-t', '--ticks', action = 'store_true', help = 'benchmark the tick search instead of plots')
+    parser.add_argument('plots', nargs = '*', help = 'plots to benchmark: {} (default: all)'.format(', '.join(plots.keys())))
+    opts = parser.parse_args()
+    unknown = [n for n in opts.plots if n not in plots]
+    if unknown:
+        parser.error('unknown plots: ' + ', '.join(unknown))
+
+    logging.getLogger().setLevel(logging.WARNING)
+    if opts.ticks:
+        results = run_ticks(repeat = opts.repeat)
+    else:
+        results = run(opts.rows, opts.repeat, opts.plots)
+    if opts.json:
+        print json.dumps(results, indent = 2)
+    elif opts.ticks:
+        for kind in ('search', 'memo'):
+            print '{:8} {:9.1f} us per call'.format(kind, 1e6 * results[kind])
+    else:
+        report(results)
+
+
+if __name__ == '__main__':
+    main()
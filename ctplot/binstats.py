@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+#    statistics of binned data and profiles
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# All functions work on whole arrays in one pass, without loops over bins.
+# Bin contents act as weights of the bin centers. Profiles take optional
+# weights of the points, without them every point has weight 1.
+
+import numpy as np
+
+
+def profile(x, y, edges, weights = None):
+    '''return count, mean and standard deviation of y in the bins [l, u) of x
+       between edges (x equal to the last edge is outside, as are nan), the
+       mean and std are weighted by weights if given and nan in empty bins'''
+    n = len(edges) - 1
+    k = np.digitize(x, edges) - 1
+    inside = (0 <= k) & (k < n)
+    k, y = k[inside], np.asarray(y, dtype = float)[inside]
+    w = np.asarray(weights, dtype = float)[inside] if weights is not None else None
+
+    count = np.bincount(k, minlength = n)
+    sw = np.bincount(k, weights = w, minlength = n) if w is not None else count
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        mean = np.bincount(k, weights = y * w if w is not None else y, minlength = n) / sw
+        d2 = (y - mean[k]) ** 2  # two passes, E[y^2] - E[y]^2 cancels
+        var = np.bincount(k, weights = d2 * w if w is not None else d2, minlength = n) / sw
+    return count, mean, np.sqrt(var)
+
+
+def moments(centers, contents):
+    '''return dict with N, mean, std, skew, kurtos and excess of the
+       distribution with contents at centers'''
+    N = np.sum(contents)
+    mean = np.dot(contents, centers) / N
+    d = centers - mean
+    std = np.sqrt(np.dot(contents, d ** 2) / N)
+    kurtosis = np.dot(contents, (d / std) ** 4) / N
+    return {'N':N, 'mean':mean, 'std':std, 'skew':np.dot(contents, (d / std) ** 3) / N,
+            'kurtos':kurtosis, 'excess':kurtosis - 3}
+
+
+def moments2d(contents, xcenters, ycenters):
+    '''return dict with N, mean and std (arrays of x and y) and cov of the
+       distribution with contents (indexed [y, x]) at xcenters, ycenters'''
+    N = contents.sum()
+    px, py = contents.sum(axis = 0), contents.sum(axis = 1)
+    mean = np.array([np.dot(px, xcenters), np.dot(py, ycenters)]) / N
+    dx, dy = xcenters - mean[0], ycenters - mean[1]
+    std = np.sqrt(np.array([np.dot(px, dx ** 2), np.dot(py, dy ** 2)]) / N)
+    return {'N':N, 'mean':mean, 'std':std, 'cov':np.dot(dy, np.dot(contents, dx)) / N}
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+#    canonical form of plot settings
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Settings that produce the same plot should have the same canonical form,
+# it is what the plot cache hashes and what the plot is created from.
+
+import ast, tokenize, logging
+from StringIO import StringIO
+
+log = logging.getLogger('canonical')
+
+
+# per graph settings, # is replaced by the graph number
+graph_keys = ['x#', 'y#', 'z#', 'c#', 'm#', 's#', 'n#', 'tw#', 'rw#', 'rs#', 'rc#', 'sf#', 'sb#',
+              'ff#', 'fp#', 'fl#', 'x#a', 'y#a', 'z#a', 'x#b', 'y#b']
+graph_defaults = {'rs#':'1', 'rc#':'1', 'sf#':'1', 'sb#':'nmsc'}
+
+# global settings
+global_keys = ['t', 'f', 'w', 'h', 'g', 'l'] + \
+    [a + b + c for a in 'xyz' for b in 'rsl' for c in ('', 'tw')]
+global_defaults = {'f':'10', 'w':'25', 'l':'best', 'xs':'linear', 'ys':'linear', 'zs':'linear',
+                   'xstw':'linear', 'ystw':'linear'}
+
+expressions = ['x#', 'y#', 'z#', 'c#', 'rw#', 'rc#', 'ff#', 'x#a', 'y#a', 'z#a']
+numbers = ['rs#', 'sf#', 'f', 'w', 'h']
+numberlists = ['fp#', 'x#b', 'y#b', 'xr', 'yr', 'zr', 'xrtw', 'yrtw', 'zrtw']
+
+
+def _tokens(expr):
+    return [t[1] for t in tokenize.generate_tokens(StringIO(expr).readline)
+            if t[0] not in (tokenize.NEWLINE, tokenize.NL, tokenize.ENDMARKER)]
+
+
+def _isword(c):
+    return c.isalnum() or c == '_'
+
+
+def normalize_expression(expr):
+    '''remove the whitespace from expr that is not needed to separate tokens,
+       expr is returned stripped only if it is not a valid expression'''
+    expr = expr.strip()
+    try:
+        tree = ast.dump(ast.parse(expr, mode = 'eval'))
+        norm = ''
+        for t in _tokens(expr):
+            if norm and _isword(norm[-1]) and _isword(t[0]):
+                norm += ' '
+            norm += t
+        # make sure the expression did not change
+        if ast.dump(ast.parse(norm, mode = 'eval')) == tree:
+            return norm
+    except Exception:
+        pass
+    return expr
+
+
+def normalize_number(value):
+    try:
+        return repr(float(value))
+    except ValueError:
+        return value
+
+
+def normalize_value(k, value):
+    '''normalize value of setting k, k is given with # instead of the graph number,
+       empty values and lists of empty values are returned as empty string'''
+    value = value.strip() if value else ''
+    if k in expressions:
+        return normalize_expression(value)
+    if k in numbers:
+        return normalize_number(value) if value else value
+    if k in numberlists:
+        if not value.replace(',', '').strip():
+            return ''
+        return ','.join([normalize_number(v.strip()) if v.strip() else '' for v in value.split(',')])
+    return value
+
+
+def normalize(settings):
+    '''return the canonical form of settings: empty and default values are
+       dropped, expressions and numbers are normalized and the graphs that are
+       actually drawn are numbered consecutively, keeping their order'''
+    canonical = {}
+
+    graphs = [str(n) for n in xrange(10) if normalize_value('m#', settings.get('m' + str(n)))
+                                        and normalize_value('s#', settings.get('s' + str(n)))]
+    for N, n in enumerate(graphs):
+        values = {}
+        for k in graph_keys:
+            v = normalize_value(k, settings.get(k.replace('#', n)))
+            if v and v != normalize_value(k, graph_defaults.get(k)):
+                values[k] = v
+
+        # averaging settings only matter if averaging, fit settings only if fitting
+        if 'rw#' not in values:
+            for k in ['rs#', 'rc#']: values.pop(k, None)
+        if 'ff#' not in values:
+            for k in ['fp#', 'fl#']: values.pop(k, None)
+        if values['m#'] not in ('h1', 'h2'):
+            values.pop('sb#', None)
+
+        for k, v in values.iteritems():
+            canonical[k.replace('#', str(N))] = v
+
+        # plot options, numbers are converted to float by Plot.opts anyway
+        prefix = 'o' + n
+        for k, v in settings.iteritems():
+            if k.startswith(prefix) and len(k) > len(prefix) and v and v.strip():
+                canonical['o' + str(N) + k[len(prefix):]] = normalize_number(v.strip())
+
+    for k in global_keys:
+        v = normalize_value(k, settings.get(k))
+        if v and v != normalize_value(k, global_defaults.get(k)):
+            canonical[k] = v
+
+    log.debug('canonical settings %s', canonical)
+    return canonical
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#    catalog of the HDF5 tables available for plotting
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import os, json, logging, tables
+from os import path
+from collections import OrderedDict, namedtuple
+from threading import Thread, Lock
+from time import sleep
+from locket import lock_file
+from utils import hdf5_lock
+import metrics, timing
+
+log = logging.getLogger('catalog')
+
+
+TableSpecs = namedtuple('TableSpecs', ('title', 'colnames', 'units', 'rows'))
+
+def scan_file(f):
+    'return dict table path --> TableSpecs of all tables in HDF5 file f'
+    tabs = OrderedDict()
+    with timing.waiting(hdf5_lock):
+        h5 = tables.openFile(f, 'r')
+        timing.count_open(f)
+        try:
+            for n in h5.walkNodes(classname = 'Table'):
+                tabs[n._v_pathname] = TableSpecs(n._v_title, n.colnames, json.loads(n.attrs.units), int(n.nrows))
+        finally:
+            h5.close()
+    return tabs
+
+
+def find_files(d):
+    'return dict relative filename --> filename of all HDF5 files below d'
+    files = {}
+    for p, dd, f in os.walk(d):
+        for ff in f:
+            if ff.lower().endswith('.h5'):
+                fn = path.join(p, ff)
+                files[path.relpath(fn, d).replace('\\', '/')] = fn
+    return files
+
+
+
+class Catalog(object):
+    '''Persistent catalog of the tables in the HDF5 files below datadir.
+
+       The catalog is stored as JSON in filename, keyed by the path of the
+       HDF5 file relative to datadir, along with its mtime and size. refresh()
+       only reopens files that were added or changed. Several processes may
+       share the same catalog file, update() picks up their changes.'''
+
+    def __init__(self, datadir, filename):
+        self.datadir = datadir
+        self.filename = filename
+        self.files = {}  # relative filename --> {'mtime', 'size', 'tables'}
+        self.tables = OrderedDict()  # table id --> TableSpecs
+        self.stamp = None  # (mtime, size) of the catalog file when it was read
+        self.lock = Lock()
+
+
+    def _stat(self):
+        try:
+            st = os.stat(self.filename)
+            return st.st_mtime, st.st_size
+        except OSError:
+            return None
+
+
+    def _index(self):
+        tabs = OrderedDict()
+        for f in sorted(self.files.keys()):
+            for t, specs in self.files[f]['tables']:
+                tabs[f + ':' + t] = TableSpecs(*specs)
+        self.tables = tabs
+
+
+    def load(self):
+        'read the catalog file if it changed since it was last read, return False if there is none'
+        stamp = self._stat()
+        if stamp is None:
+            return False
+        if stamp != self.stamp:
+            with self.lock:
+                with open(self.filename) as f:
+                    self.files = json.load(f)
+                self.stamp = stamp
+                self._index()
+            log.debug('loaded catalog %s, %d tables', self.filename, len(self.tables))
+        return True
+
+
+    def update(self):
+        'make sure the catalog is up to date with the catalog file, create it if missing'
+        if not self.load():
+            self.refresh()
+
+
+    def refresh(self):
+        'rescan added, changed and removed files, return the number of rescanned files'
+        with lock_file(self.filename + '.lock'):
+            self.load()
+            files = {}
+            rescanned = 0
+            for rel, fn in find_files(self.datadir).iteritems():
+                st = os.stat(fn)
+                entry = self.files.get(rel)
+                if entry is None or entry['mtime'] != st.st_mtime or entry['size'] != st.st_size:
+                    log.debug('scanning %s', fn)
+                    rescanned += 1
+                    try:
+                        tabs = [[t, list(s)] for t, s in scan_file(fn).iteritems()]
+                    except Exception:
+                        log.exception('failed reading %s', fn)
+                        tabs = []
+                    entry = {'mtime':st.st_mtime, 'size':st.st_size, 'tables':tabs}
+                files[rel] = entry
+
+            # unchanged files are hits, rescanned ones misses, removed ones evictions
+            removed = len(set(self.files) - set(files))
+            metrics.cache.add(len(files) - rescanned, 'catalog', 'hit')
+            metrics.cache.add(rescanned, 'catalog', 'miss')
+            metrics.cache.add(removed, 'catalog', 'eviction')
+            if rescanned or removed or self.stamp is None:
+                tmp = '{}.{}.tmp'.format(self.filename, os.getpid())
+                with open(tmp, 'w') as f:
+                    json.dump(files, f)
+                os.rename(tmp, self.filename)  # atomic, readers see old or new catalog
+                with self.lock:
+                    self.files = files
+                    self.stamp = self._stat()
+                    self._index()
+                log.info('catalog %s: %d files rescanned, %d tables', self.filename, rescanned, len(self.tables))
+
+        return rescanned
+
+
+    def watch(self, interval):
+        'refresh the catalog every interval seconds in a background thread'
+        def run():
+            while True:
+                sleep(interval)
+                try:
+                    self.refresh()
+                except Exception:
+                    log.exception('refreshing catalog failed')
+
+        t = Thread(target = run)
+        t.daemon = True
+        t.start()
+        return t
+
+
+    def get(self, table_id):
+        'return TableSpecs of table_id or None'
+        return self.tables.get(table_id)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+#    export of the binned data of a plot as JSON, CSV or .npy
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# The data is taken from Plot.results after Plot.compute(), nothing is drawn.
+# JSON holds everything: bin edges, contents, errors, stats and fit results of
+# all graphs. CSV and .npy hold the bin table, one row per bin (per point for
+# xy and map) and graph, the columns depend on the diagram type. Plots of
+# several types have the columns of all of them, nan where a graph has none.
+
+import json, logging
+from StringIO import StringIO
+import numpy as np
+
+log = logging.getLogger('dataexport')
+
+formats = {'json':'application/json', 'csv':'text/csv', 'npy':'application/octet-stream'}
+
+
+def _plain(v):
+    '''convert numpy arrays and scalars in v to lists and numbers, nan and
+       inf to None (they are not valid JSON)'''
+    if isinstance(v, np.ndarray):
+        return _plain(v.tolist())
+    if isinstance(v, np.generic):
+        return _plain(v.item())
+    if isinstance(v, dict):
+        return dict([(k, _plain(x)) for k, x in v.iteritems()])
+    if isinstance(v, (list, tuple)):
+        return [_plain(x) for x in v]
+    if isinstance(v, float) and not np.isfinite(v):
+        return None
+    return v
+
+
+def fit(p, i):
+    'return the fit result of graph i of plot p (without the function object) or None'
+    x, y, yerr = p.fit_data(i, p.results[i])
+    if x is None:
+        return None
+    f = p.fit_result(i, x, y, yerr)
+    if f is None:
+        return None
+    c = f['covariance']
+    return {'function':f['function'], 'parameters':f['parameters'],
+            'errors':np.sqrt(np.diag(c)) if c is not None else None,
+            'covariance':c, 'chi2':f['chi2'], 'n':f['n'], 'status':f['status'].strip(' ()')}
+
+
+def graph(p, i):
+    'return dict with the settings, binned data, stats and fit of graph i of plot p'
+    r = p.results[i]
+    g = {'graph':i, 'mode':p.m[i], 'source':p.s[i], 'name':p.n[i],
+         'units':r['units']}
+    for v in ['x', 'y', 'z', 'c']:
+        g[v] = getattr(p, v)[i]
+    for k, v in r.iteritems():
+        if k not in ('units', 'sketches'):
+            g[k] = v
+    g['fit'] = fit(p, i)
+    return _plain(g)
+
+
+columns = {'h1':('xlow', 'xhigh', 'content', 'error'),
+           'h2':('xlow', 'xhigh', 'ylow', 'yhigh', 'content'),
+           'p':('xlow', 'xhigh', 'mean', 'std'),
+           'xy':('x', 'y', 'z'),
+           'map':('x', 'y', 'z')}
+
+
+def names(p):
+    'return the columns of the bin tables of all graphs of plot p, in order'
+    n = []
+    for i in p.graphs():
+        n += [c for c in columns[p.m[i]] if c not in n]
+    return n
+
+
+def table(p, i, names = None):
+    '''return the columns of the bin table of graph i of plot p, or the
+       columns names of it, nan where graph i has none'''
+    if names is not None:
+        cols = dict(zip(columns[p.m[i]], table(p, i)))
+        k = len(cols.values()[0])
+        return [cols[n] if n in cols else np.zeros(k) * np.nan for n in names]
+    r = p.results[i]
+    m = p.m[i]
+    if m == 'h1':
+        e = r['edges']
+        return e[:-1], e[1:], r['contents'], r['errors']
+    if m == 'h2':
+        xe, ye = r['xedges'], r['yedges']
+        # contents are indexed [y, x]
+        xlow, ylow = np.meshgrid(xe[:-1], ye[:-1])
+        xhigh, yhigh = np.meshgrid(xe[1:], ye[1:])
+        return xlow.ravel(), xhigh.ravel(), ylow.ravel(), yhigh.ravel(), np.ravel(r['contents'])
+    if m == 'p':
+        e = r['edges']
+        return e[:-1], e[1:], r['means'], r['stds']
+    y = r['y']
+    x = r['x'] if r['x'] is not None else np.arange(len(y))
+    z = r['z'] if r['z'] is not None else np.zeros(len(y)) * np.nan
+    return x, y, z
+
+
+def to_json(p):
+    return json.dumps({'graphs':[graph(p, i) for i in p.graphs()]}, allow_nan = False)
+
+
+def to_csv(p, chunksize = 10000):
+    'yield the bin tables of all graphs as CSV in chunks of chunksize rows'
+    n = names(p)
+    yield ','.join(['graph'] + n) + '\n'
+    for i in p.graphs():
+        cols = table(p, i, n)
+        for a in xrange(0, len(cols[0]), chunksize):
+            f = StringIO()
+            chunk = np.column_stack([np.repeat(i, len(cols[0][a:a + chunksize]))] + [c[a:a + chunksize] for c in cols])
+            np.savetxt(f, chunk, delimiter = ',', fmt = ['%d'] + ['%.10g'] * len(cols))
+            yield f.getvalue()
+
+
+def to_npy(p):
+    'return the bin tables of all graphs as structured array in the .npy format'
+    graphs, cols = p.graphs(), names(p)
+    tables = [table(p, i, cols) for i in graphs]
+    a = np.zeros(sum([len(t[0]) for t in tables]), dtype = [('graph', 'i4')] + [(c, 'f8') for c in cols])
+    n = 0
+    for i, t in zip(graphs, tables):
+        k = len(t[0])
+        a['graph'][n:n + k] = i
+        for c, v in zip(cols, t):
+            a[c][n:n + k] = v
+        n += k
+    f = StringIO()
+    np.save(f, a)
+    return f.getvalue()
+
+
+def export(p, fmt):
+    'return content type and iterable of the body of the data of plot p in format fmt'
+    if fmt not in formats:
+        raise ValueError('unknown data format {}'.format(fmt))
+    if fmt == 'json':
+        body = [to_json(p)]
+    elif fmt == 'csv':
+        body = to_csv(p)
+    else:
+        body = [to_npy(p)]
+    return formats[fmt], body
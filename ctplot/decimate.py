@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+#    reduce data points to what is visible at the resolution of the figure
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# All functions return the sorted indices of the points to keep. Points that
+# are not finite are always kept, they break lines.
+#
+# minmax: the x range is split into n pixel columns, of each column the first,
+#   last, lowest and highest point are kept (M4), a line through them covers
+#   the same pixels as the line through all points. x must be sorted.
+# lttb: largest triangle three buckets, keeps n points that best preserve the
+#   shape of the line, smoother than minmax but may miss single spikes.
+# pixels: keeps one point per pixel (the last one, it is drawn on top) for
+#   markers, for lines only consecutive points in the same pixel are dropped.
+#
+# raster() aggregates points instead of choosing some, it returns images of
+# the count, mean and max of z per pixel, to be drawn as one raster image.
+
+import logging
+import numpy as np
+
+log = logging.getLogger('decimate')
+
+
+def _bins(v, n, lim = None):
+    'return pixel index in [0, n) of each value of v, lim is the visible range'
+    finite = v[np.isfinite(v)]
+    lo, hi = lim if lim else (finite.min(), finite.max()) if len(finite) else (0, 1)
+    span = float(hi - lo) or 1.0
+    b = np.nan_to_num((v - lo) * (n / span))
+    return np.clip(b, -1, n).astype(int)  # points outside share the columns next to the range
+
+
+def minmax(x, y, n, xlim = None):
+    'return indices of the first, last, min and max point in each of n columns, x must be sorted'
+    col = _bins(x, n, xlim)
+    starts = np.flatnonzero(np.r_[True, col[1:] != col[:-1]])
+    ends = np.r_[starts[1:], len(col)] - 1
+
+    finite = np.isfinite(y)
+    segment = np.cumsum(np.r_[False, col[1:] != col[:-1]])  # segment of each point
+    lo = np.minimum.reduceat(np.where(finite, y, np.inf), starts)
+    hi = np.maximum.reduceat(np.where(finite, y, -np.inf), starts)
+    # first point of each segment reaching its min/max
+    ismin = np.flatnonzero(finite & (y == lo[segment]))
+    ismax = np.flatnonzero(finite & (y == hi[segment]))
+    imin = ismin[np.unique(segment[ismin], return_index = True)[1]]
+    imax = ismax[np.unique(segment[ismax], return_index = True)[1]]
+
+    return np.unique(np.concatenate([starts, ends, imin, imax, np.flatnonzero(~finite)]))
+
+
+def lttb(x, y, n):
+    'return indices of n points chosen by largest triangle three buckets, not finite points are dropped'
+    idx = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    N = len(idx)
+    if N <= n or n < 3:
+        return idx
+    x, y = x[idx], y[idx]
+
+    # n - 2 buckets between the first and the last point
+    edges = np.linspace(1, N - 1, n - 1).astype(int)
+    sel = np.empty(n, dtype = int)
+    sel[0], sel[-1] = 0, N - 1
+    a = 0
+    for i in xrange(n - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        nlo, nhi = hi, (edges[i + 2] if i + 2 < len(edges) else N)
+        ax, ay = x[nlo:max(nhi, nlo + 1)].mean(), y[nlo:max(nhi, nlo + 1)].mean()
+        area = np.abs((x[a] - ax) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (ay - y[a]))
+        a = lo + np.argmax(area)
+        sel[i + 1] = a
+    return idx[np.unique(sel)]
+
+
+def pixels(x, y, nx, ny, xlim = None, ylim = None, line = False):
+    '''return indices of the points differing in their pixel, for lines from
+       the previous point, otherwise from all later points'''
+    key = _bins(x, nx, xlim) * (ny + 2) + _bins(y, ny, ylim)
+    nonfinite = np.flatnonzero(~(np.isfinite(x) & np.isfinite(y)))
+    if line:
+        keep = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    else:
+        last = len(key) - 1 - np.unique(key[::-1], return_index = True)[1]
+        keep = np.sort(last)
+    return np.union1d(keep, nonfinite)
+
+
+def decimate(x, y, nx, ny, method = 'minmax', line = True, xlim = None, ylim = None, markers = False):
+    '''return indices of the points of x, y to draw on nx times ny pixels, None
+       if there are not more points than pixels, see above for the methods,
+       minmax and lttb are only used for lines with sorted x, lines with
+       markers keep the points of the line and one point per pixel'''
+    if len(x) <= 4 * nx:
+        return None
+    ordered = line and np.all(x[1:] >= x[:-1])
+    if ordered and method == 'lttb':
+        idx = lttb(x, y, 2 * nx)
+    elif ordered:
+        idx = minmax(x, y, nx, xlim)
+    else:
+        idx = pixels(x, y, nx, ny, xlim, ylim, line)
+    if line and markers:
+        idx = np.union1d(idx, pixels(x, y, nx, ny, xlim, ylim, False))
+    log.debug('decimated %d to %d points', len(x), len(idx))
+    return idx
+
+
+def _edges(v, n, lim):
+    lo, hi = lim if lim else (v.min(), v.max()) if len(v) else (0, 1)
+    if not hi > lo:
+        hi = lo + 1
+    return np.linspace(lo, hi, n + 1)
+
+
+def raster(x, y, z, nx, ny, xlim = None, ylim = None):
+    '''return the edges of nx times ny pixels and the count, mean and max of z
+       of the points in each pixel, the images are indexed [y, x], mean and
+       max are nan in empty pixels, points outside xlim, ylim are dropped'''
+    m = np.isfinite(x) & np.isfinite(y) & np.isfinite(z)
+    x, y, z = x[m], y[m], z[m]
+    xe, ye = _edges(x, nx, xlim), _edges(y, ny, ylim)
+    m = (xe[0] <= x) & (x <= xe[-1]) & (ye[0] <= y) & (y <= ye[-1])
+    x, y, z = x[m], y[m], z[m]
+
+    ix = np.minimum(((x - xe[0]) * (nx / (xe[-1] - xe[0]))).astype(int), nx - 1)
+    iy = np.minimum(((y - ye[0]) * (ny / (ye[-1] - ye[0]))).astype(int), ny - 1)
+    k = iy * nx + ix
+
+    count = np.bincount(k, minlength = nx * ny)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        mean = np.bincount(k, weights = z, minlength = nx * ny) / count
+    mx = np.empty(nx * ny) * np.nan
+    if len(k):
+        # sorted by pixel each pixel is a contiguous slice of z
+        o = np.argsort(k, kind = 'mergesort')
+        ks, zs = k[o], z[o]
+        starts = np.flatnonzero(np.r_[True, ks[1:] != ks[:-1]])
+        mx[ks[starts]] = np.maximum.reduceat(zs, starts)
+    shape = (ny, nx)
+    return xe, ye, count.reshape(shape), mean.reshape(shape), mx.reshape(shape)
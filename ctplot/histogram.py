@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#    histograms counted in chunks by a pool of threads
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# The counts are the same as those of np.histogram and np.histogram2d with
+# explicit edges: bin i holds edges[i] <= x < edges[i + 1], the last bin also
+# holds x equal to the last edge, nan and values outside are not counted.
+#
+# For equal bins the bin index is computed from the value and corrected by
+# one bin where rounding put a value next to an edge into the wrong bin (as
+# np.histogram does), values still outside their bin and all values of
+# unequal bins are searched in the edges. Arrays of more
+# than chunksize values are split into chunks, counted in a pool of threads
+# (numpy releases the GIL for most of the work) and the counts are added.
+
+import logging
+import numpy as np
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+
+log = logging.getLogger('histogram')
+
+chunksize = 2 ** 20  # values per chunk
+threads = min(4, cpu_count())
+
+_pool = None
+_pool_lock = Lock()
+
+
+def pool():
+    'return the thread pool shared by all histograms of the process'
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(threads)
+        return _pool
+
+
+def is_uniform(edges):
+    'return whether the bins between edges have equal widths, relative to their width'
+    w = np.diff(edges)
+    return len(w) > 0 and np.allclose(w, w[0], rtol = 1e-6, atol = 0)
+
+
+def bin_indices(v, edges, uniform = None):
+    '''return the index of the bin between edges of each value of v, -1 if
+       the value is not counted, uniform tells whether the bins are equal
+       (default: check the edges)'''
+    n = len(edges) - 1
+    lo, hi = edges[0], edges[-1]
+    if uniform is None:
+        uniform = is_uniform(edges)
+
+    k = np.empty(len(v), dtype = np.intp)
+    k.fill(-1)
+    keep = (lo <= v) & (v <= hi)
+    x = v[keep]
+    if uniform and hi > lo:
+        i = ((x - lo) * (n / float(hi - lo))).astype(np.intp)
+        np.clip(i, 0, n - 1, out = i)
+        # correct rounding errors
+        i[x < edges[i]] -= 1
+        i[(x >= edges[i + 1]) & (i != n - 1)] += 1
+        # values still outside their bin are searched
+        wrong = (x < edges[i]) | ((x >= edges[i + 1]) & (i != n - 1))
+        if wrong.any():
+            i[wrong] = np.minimum(np.searchsorted(edges, x[wrong], side = 'right') - 1, n - 1)
+    else:
+        i = np.searchsorted(edges, x, side = 'right') - 1
+        i[i == n] = n - 1  # last edge belongs to the last bin
+    k[keep] = i
+    return k
+
+
+def _chunked(count, length, size):
+    '''return the sum of count(a, b) over the chunks [a, b) of length values,
+       count returns an array of size counts'''
+    chunks = [(a, min(length, a + chunksize)) for a in xrange(0, length, chunksize)]
+    if len(chunks) > 1 and threads > 1:
+        parts = pool().map(lambda c: count(*c), chunks)
+    else:
+        parts = [count(a, b) for a, b in chunks]
+    total = np.zeros(size, dtype = np.intp)
+    for p in parts:
+        total += p
+    return total
+
+
+def histogram(x, edges):
+    'return the counts of x in the bins between edges, as np.histogram(x, edges)[0]'
+    x, edges = np.asarray(x), np.asarray(edges, dtype = float)
+    n = len(edges) - 1
+    uniform = is_uniform(edges)
+
+    def count(a, b):
+        k = bin_indices(x[a:b], edges, uniform)
+        return np.bincount(k[k >= 0], minlength = n)
+
+    return _chunked(count, len(x), n)
+
+
+def histogram2d(x, y, xedges, yedges):
+    '''return the counts of the points x, y in the bins between xedges and
+       yedges, indexed [x, y], as np.histogram2d(x, y, [xedges, yedges])[0]'''
+    x, y = np.asarray(x), np.asarray(y)
+    xedges, yedges = np.asarray(xedges, dtype = float), np.asarray(yedges, dtype = float)
+    nx, ny = len(xedges) - 1, len(yedges) - 1
+    xuniform, yuniform = is_uniform(xedges), is_uniform(yedges)
+
+    def count(a, b):
+        kx = bin_indices(x[a:b], xedges, xuniform)
+        ky = bin_indices(y[a:b], yedges, yuniform)
+        inside = (kx >= 0) & (ky >= 0)
+        return np.bincount(kx[inside] * ny + ky[inside], minlength = nx * ny)
+
+    return _chunked(count, len(x), nx * ny).reshape(nx, ny)
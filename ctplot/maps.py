@@ -21,16 +21,165 @@ import matplotlib.pyplot as plt
 import dateutil.parser as dp
 import ticks
 import mpl_toolkits.basemap as bm
-import sys
+import sys, os, copy, logging
+import cPickle as pickle
+from glob import glob
+from functools import wraps
+from threading import current_thread, local
+from utils import LRU, digest
+import metrics
+
+log = logging.getLogger('maps')
+
+# Basemap makes its images the current image of pyplot, which fails for axes
+# not created by pyplot, maps are drawn on the axes passed to drawmap()
+bm.plt = None
+
+
+class _Stdout(object):
+    '''stands in for sys.stdout, writes of the threads drawing a map go to
+       stderr (Basemap prints warnings, which must not end up in a CGI
+       response), other threads write to stdout'''
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.drawing = local()
+
+    def __getattr__(self, name):
+        return getattr(sys.__stderr__ if getattr(self.drawing, 'map', False) else self.stdout, name)
+
+    def __setattr__(self, name, value):
+        if name in ('stdout', 'drawing'):
+            object.__setattr__(self, name, value)
+        else:  # softspace of print
+            setattr(sys.__stderr__ if getattr(self.drawing, 'map', False) else self.stdout, name, value)
+
+if not isinstance(sys.stdout, _Stdout):
+    sys.stdout = _Stdout(sys.stdout)
+_stdout = sys.stdout
+
+
+def _to_stderr(f):
+    'decorator sending what the calling thread prints to stderr while f runs'
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        drawing = getattr(_stdout.drawing, 'map', False)
+        _stdout.drawing.map = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            _stdout.drawing.map = drawing
+    return wrapper
+
+# Creating a Basemap reads and projects the coastlines, warping the blue
+# marble image to the map projects a large image. Both are cached in memory
+# and, if a cache directory is given, pickled to disk. The Basemaps are cached
+# without axes, drawmap() draws on a shallow copy. The extent of the map is
+# rounded, so that maps of nearly the same data share the cached Basemap. The
+# pickles are removed, least recently used first, when they take more than
+# cachesize bytes.
+_basemaps = LRU(16)  # key --> Basemap
+_backgrounds = LRU(256 * 2 ** 20, lambda image: image.nbytes)  # key --> projected image
+
+cachesize = 512 * 2 ** 20  # default
+
+
+def _prune(cachedir, maxsize):
+    '''remove the least recently used basemap and background pickles in
+       cachedir until they take at most maxsize bytes'''
+    files = []
+    for fn in glob(os.path.join(cachedir, 'basemap*.pickle')) + glob(os.path.join(cachedir, 'background*.pickle')):
+        try:
+            st = os.stat(fn)
+            files.append((st.st_mtime, st.st_size, fn))
+        except OSError:
+            pass  # removed by another process
+    total = sum([size for mtime, size, fn in files])
+    for mtime, size, fn in sorted(files):
+        if total <= maxsize:
+            break
+        try:
+            os.remove(fn)
+            log.debug('removed %s', fn)
+        except OSError:
+            pass
+        total -= size
+
+
+def _cached(memory, name, key, make, cachedir = None, maxsize = None):
+    '''return the object under key in memory, else read from the pickle in
+       cachedir, else made by make() and kept in both, the pickles in
+       cachedir take at most maxsize (default cachesize) bytes'''
+    obj = memory.get(key)
+    filename = os.path.join(cachedir, '{}{}.pickle'.format(name, key)) if cachedir else None
+    if obj is None and filename:
+        try:
+            with open(filename, 'rb') as f:
+                obj = pickle.load(f)
+            log.debug('%s %s read from disk', name, key)
+            memory.put(key, obj)
+            os.utime(filename, None)  # recently used
+        except Exception:
+            obj = None
+    metrics.cache.inc(name, 'miss' if obj is None else 'hit')
+    if obj is None:
+        obj = make()
+        evicted = memory.put(key, obj)
+        if evicted:
+            metrics.cache.add(evicted, name, 'eviction')
+        if filename:
+            tmp = '{}.{}.{}.tmp'.format(filename, os.getpid(), current_thread().ident)
+            try:
+                with open(tmp, 'wb') as f:
+                    pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+                os.rename(tmp, filename)
+                _prune(cachedir, cachesize if maxsize is None else maxsize)
+            except Exception:
+                log.exception('failed writing %s', filename)
+    return obj
+
+
+def rounded(lo, hi, lim = None):
+    '''return lo, hi rounded outwards to a tenth of the order of magnitude of
+       their difference, within lim'''
+    if not hi > lo:
+        return lo, hi
+    step = 10. ** np.floor(np.log10(hi - lo)) / 10
+    lo, hi = np.floor(lo / step) * step, np.ceil(hi / step) * step
+    if lim:
+        lo, hi = max(lim[0], lo), min(lim[1], hi)
+    return float(lo), float(hi)
+
+
+def basemap(projection, ax = None, cachedir = None, cachesize = None, **options):
+    'return a copy of the cached Basemap of projection and options drawing on ax'
+    key = digest(projection, options)
+    m = copy.copy(_cached(_basemaps, 'basemap', key, lambda: bm.Basemap(projection = projection, **options), cachedir, cachesize))
+    m.ax = ax
+    m.cachekey = key
+    return m
+
+
+def draw_bluemarble(m, scale = 0.5, cachedir = None, cachesize = None):
+    'draw the blue marble image on the map m from basemap(), return the image'
+    drawn = []
+
+    def project():
+        drawn.append(m.bluemarble(scale = scale))
+        return drawn[0].get_array()
+
+    image = _cached(_backgrounds, 'background', digest(m.cachekey, 'bluemarble', scale), project, cachedir, cachesize)
+    return drawn[0] if drawn else m.imshow(image)
+
 
+@_to_stderr
 def drawmap(lat = None, lon = None, margin = 0.05, width = 1e6, height = None, boundarylat = 40,
          projection = 'cyl', drawcoastline = 1, drawcountries = 0, drawgrid = 1, drawspecgrid = 1, bluemarble = 0, nightshade = None,
+         ax = None, fontsize = None, cachedir = None, cachesize = None,
          places = [('Neumayer-St.'    , -70.6666      , -8.2666),
                    ('Amundsen-Scott-St.'   , -90.     , 0.),
                    ('DESY Zeuthen'  , 52.346142    , 13.633432)]):
 
-    sys.stdout = sys.__stderr__
-
     minlat, maxlat = np.nanmin(lat), np.nanmax(lat)
     lat0 = (minlat + maxlat) / 2
     minlat, maxlat = minlat - margin * (maxlat - minlat), maxlat + margin * (maxlat - minlat)
@@ -41,6 +190,12 @@ def drawmap(lat = None, lon = None, margin = 0.05, width = 1e6, height = None, b
     minlon, maxlon = minlon - margin * (maxlon - minlon), maxlon + margin * (maxlon - minlon)
     #minlon, maxlon = max(-90,minlon), min(90,maxlon)
 
+    if projection in ('cyl', 'merc'):  # share cached maps
+        minlat, maxlat = rounded(minlat, maxlat, (-90, 90))
+        minlon, maxlon = rounded(minlon, maxlon)
+    else:
+        lat0, lon0 = round(lat0, 1), round(lon0, 1)
+
     if projection in ('ortho', 'robin'):
         map_options = { 'lat_0' : lat0, 'lon_0' : lon0, 'resolution':'l'}
         latlabels = [1, 0, 0, 0] # left, right, top, bottom
@@ -68,10 +223,14 @@ def drawmap(lat = None, lon = None, margin = 0.05, width = 1e6, height = None, b
 
     #print map_options
 
-    m = bm.Basemap(projection = projection, **map_options)
+    if ax is None:
+        ax = plt.gca()
+    font = {'fontsize':fontsize} if fontsize else {}
+
+    m = basemap(projection, ax, cachedir, cachesize, **map_options)
 
     if bluemarble:
-        m.bluemarble(scale = 0.5)
+        draw_bluemarble(m, scale = 0.5, cachedir = cachedir, cachesize = cachesize)
         #m.warpimage(image = 'c:/Program Files (x86)/Python27/Lib/site-packages/mpl_toolkits/basemap/data/etopo1.jpg', scale = 0.5)
         #m.warpimage(image = 'c:/Users/al/Downloads/bluemarble/Earthlights_2002-5400x2700.jpg', scale = 0.5)
     elif drawcoastline:
@@ -96,8 +255,8 @@ def drawmap(lat = None, lon = None, margin = 0.05, width = 1e6, height = None, b
             parallels, meridians = ticks.get_ticks(m.llcrnrlat, m.urcrnrlat, 6), ticks.get_ticks(m.llcrnrlon, m.urcrnrlon, 6)
 
         pmc = '0.6' if bluemarble else 'k'
-        m.drawparallels(parallels, labels = latlabels, linewidth = 0.5, color = pmc)
-        m.drawmeridians(meridians, labels = lonlabels, linewidth = 0.5, color = pmc)
+        m.drawparallels(parallels, labels = latlabels, linewidth = 0.5, color = pmc, **font)
+        m.drawmeridians(meridians, labels = lonlabels, linewidth = 0.5, color = pmc, **font)
 
     if drawspecgrid:
         ecl = 23.44 # ecliptic
@@ -111,9 +270,7 @@ def drawmap(lat = None, lon = None, margin = 0.05, width = 1e6, height = None, b
     for name, la, lo in places:
         x, y = m(lo, la)
         m.plot(x, y, 'rs', markersize = 4)
-        plt.annotate(name, (x, y), textcoords = 'offset points', xytext = (5, 2))
-
-    sys.stdout = sys.__stdout__
+        ax.annotate(name, (x, y), textcoords = 'offset points', xytext = (5, 2), **font)
 
     return m
 
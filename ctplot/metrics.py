@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+#    server metrics in the prometheus text format
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Metrics are kept in memory per process, updating them only takes a lock.
+# If start() was called, a background thread writes a snapshot of them to
+# dirname/metrics.<pid>.json every few seconds, exposition() sums the
+# snapshots of all processes. The counters and histograms of exited processes
+# are added to dirname/metrics.retired.json and their snapshots are removed,
+# gauges are only summed over running processes.
+
+import os, json, glob, logging
+from os.path import join
+from collections import OrderedDict
+from threading import Thread, Lock
+from time import sleep, time
+from locket import lock_file
+
+log = logging.getLogger('metrics')
+
+content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+_registry = OrderedDict()  # name --> metric
+
+
+class Metric(object):
+    kind = None
+
+    def __init__(self, name, help, labels = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}  # tuple of label values --> value
+        self.lock = Lock()
+        _registry[name] = self
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(k), v] for k, v in self.values.iteritems()]
+
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels):
+        self.add(1, *labels)
+
+    def add(self, amount, *labels):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+
+class Gauge(Metric):
+    '''gauge, its value is either set or, if func is given, the value
+       returned by func when the snapshot is taken'''
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels = (), func = None):
+        Metric.__init__(self, name, help, labels)
+        self.func = func
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def add(self, amount, *labels):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def snapshot(self):
+        if self.func:
+            return [[[], self.func()]]
+        return Metric.snapshot(self)
+
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels = (), buckets = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120)):
+        Metric.__init__(self, name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        with self.lock:
+            v = self.values.get(labels)
+            if v is None:
+                v = self.values[labels] = [0] * (len(self.buckets) + 2)  # buckets, sum, count
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    v[i] += 1
+            v[-2] += value
+            v[-1] += 1
+
+
+
+def snapshot():
+    return dict([(m.name, m.snapshot()) for m in _registry.values()])
+
+
+_dirname = None
+
+def flush():
+    'write the snapshot of this process to the metrics dir'
+    if not _dirname:
+        return
+    name = join(_dirname, 'metrics.{}.json'.format(os.getpid()))
+    tmp = name + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(snapshot(), f)
+    os.rename(tmp, name)
+
+
+def start(dirname, interval = 5):
+    'share the metrics of this process via dirname, written every interval seconds'
+    global _dirname
+    if _dirname == dirname:
+        return
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    _dirname = dirname
+
+    def run():
+        while True:
+            try:
+                flush()
+            except Exception:
+                log.exception('writing metrics failed')
+            sleep(interval)
+
+    t = Thread(target = run)
+    t.daemon = True
+    t.start()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except OSError:
+        return False
+
+
+def _format_labels(names, values, extra = ()):
+    pairs = zip(names, values) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(['{}="{}"'.format(k, unicode(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs]) + '}'
+
+
+def _sum(snapshots, gauges = True):
+    'return the sum of snapshots as dict name --> OrderedDict labels --> value'
+    totals = OrderedDict()
+    for m in _registry.values():
+        total = totals[m.name] = OrderedDict()
+        if m.kind == 'gauge' and not gauges:
+            continue
+        for snap in snapshots:
+            for labels, v in snap.get(m.name, []):
+                labels = tuple(labels)
+                if m.kind == 'histogram':
+                    t = total.setdefault(labels, [0] * len(v))
+                    for i, x in enumerate(v):
+                        t[i] += x
+                else:
+                    total[labels] = total.get(labels, 0) + v
+    return totals
+
+
+def _collect():
+    '''return the snapshots of the running processes as dict pid --> snapshot
+       and the retired snapshot, the snapshots of exited processes are added
+       to the latter and removed'''
+    snapshots = {os.getpid(): snapshot()}
+    retired = {}
+    if not _dirname:
+        return snapshots, retired
+    flush()
+    name = join(_dirname, 'metrics.retired.json')
+    with lock_file(name + '.lock'):
+        if os.path.isfile(name):
+            with open(name) as f:
+                retired = json.load(f)
+        dead = []
+        for fn in glob.glob(join(_dirname, 'metrics.*.json')):
+            try:
+                pid = int(fn.split('.')[-2])
+            except ValueError:
+                continue  # the retired snapshot
+            if pid in snapshots:
+                continue
+            try:
+                with open(fn) as f:
+                    snap = json.load(f)
+            except Exception:
+                log.exception('reading %s failed', fn)
+                continue
+            if _alive(pid):
+                snapshots[pid] = snap
+            else:
+                dead.append((fn, snap))
+
+        if dead:
+            totals = _sum([retired] + [snap for fn, snap in dead], gauges = False)
+            retired = dict([(n, [[list(k), v] for k, v in t.iteritems()]) for n, t in totals.iteritems()])
+            tmp = name + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(retired, f)
+            os.rename(tmp, name)
+            for fn, snap in dead:
+                os.remove(fn)
+            log.info('retired the metrics of %d exited processes', len(dead))
+
+    return snapshots, retired
+
+
+def exposition():
+    'return the metrics of all processes in the prometheus text format'
+    snapshots, retired = _collect()
+    totals = _sum(snapshots.values() + [retired])
+
+    lines = []
+    for m in _registry.values():
+        total = totals[m.name]
+        lines.append('# HELP {} {}'.format(m.name, m.help))
+        lines.append('# TYPE {} {}'.format(m.name, m.kind))
+        for labels, v in total.iteritems():
+            if m.kind == 'histogram':
+                for b, n in zip(m.buckets, v):
+                    lines.append('{}_bucket{} {}'.format(m.name, _format_labels(m.labels, labels, [('le', b)]), n))
+                lines.append('{}_bucket{} {}'.format(m.name, _format_labels(m.labels, labels, [('le', '+Inf')]), v[-1]))
+                lines.append('{}_sum{} {}'.format(m.name, _format_labels(m.labels, labels), v[-2]))
+                lines.append('{}_count{} {}'.format(m.name, _format_labels(m.labels, labels), v[-1]))
+            else:
+                lines.append('{}{} {}'.format(m.name, _format_labels(m.labels, labels), v))
+
+    lines.append('# HELP ctplot_processes number of running server processes')
+    lines.append('# TYPE ctplot_processes gauge')
+    lines.append('ctplot_processes {}'.format(len(snapshots)))
+    return '\n'.join(lines) + '\n'
+
+
+
+# metrics of the plot server
+requests = Counter('ctplot_requests_total', 'number of requests', ['action'])
+request_seconds = Histogram('ctplot_request_seconds', 'request duration in seconds', ['action'])
+in_progress = Gauge('ctplot_requests_in_progress', 'number of requests being handled')
+busy_seconds = Counter('ctplot_busy_seconds_total', 'total duration of all requests, divide its rate by ctplot_processes for the worker utilisation')
+bytes_served = Counter('ctplot_served_bytes_total', 'number of bytes served')
+cache = Counter('ctplot_cache_total', 'cache accesses by cache (plot, preview, result, averaged, catalog, tile, ticks, basemap, background) and result (hit, miss, eviction)', ['cache', 'result'])
+
+
+class request(object):
+    '''context measuring a request, set its action and bytes attributes, or
+       call start() and stop() where it does not fit into a with block'''
+    def __init__(self, action = ''):
+        self.action = action
+        self.bytes = 0
+        self.started = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        self.started = time()
+        in_progress.add(1)
+
+    def stop(self):
+        'count the request, only once'
+        if self.started is None:
+            return
+        t = time() - self.started
+        self.started = None
+        in_progress.add(-1)
+        requests.inc(self.action)
+        request_seconds.observe(t, self.action)
+        busy_seconds.add(t)
+        bytes_served.add(self.bytes)
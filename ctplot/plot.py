@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import os, sys, re, json, tables, ticks, time, logging
+import cPickle as pickle
 from tempfile import gettempdir
 from os import path
 from collections import OrderedDict, namedtuple
@@ -10,13 +11,25 @@ import numpy as np
 import numpy.ma as ma
 from scipy.optimize import curve_fit
 import matplotlib as mpl
-import matplotlib.pyplot as plt
-from utils import get_args_from, isseq, set_defaults, number_mathformat, number_format, hashargs, noop
+from matplotlib.figure import Figure
+from matplotlib.transforms import Bbox
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from utils import get_args_from, isseq, set_defaults, number_mathformat, number_format, digest, noop, hdf5_lock
 from itertools import product
 from locket import lock_file
 
 from i18n import _
 from safeeval import safeeval
+from catalog import TableSpecs, scan_file, find_files
+import resultcache
+import decimate
+import histogram
+import quantiles
+from histogram import is_uniform
+import binstats
+import metrics
+import timing
+from timing import phase
 
 logging.basicConfig(level = logging.DEBUG, format = '%(filename)s:%(funcName)s:%(lineno)d:%(message)s')
 
@@ -25,28 +38,20 @@ log = logging.getLogger('plot')
 # override eval by safe version
 eval = safeeval()
 
+# the same for all plots, changing rc while plots are drawn in other threads is not safe
+mpl.rc('font', **{'family':'sans-serif', 'sans-serif':['Dejavu Sans']})
+mpl.rc('lines', markeredgewidth = 0)
 
-TableSpecs = namedtuple('TableSpecs', ('title', 'colnames', 'units', 'rows'))
 
 def available_tables(d = os.path.dirname(__file__) + '/data'):
-    files = []
-    dirlen = len(d)
-    for p, d, f in os.walk(d):
-        for ff in f:
-            files.append(path.join(p, ff))
-    files = map(lambda f:f.replace('\\', '/'), files)
-    files = filter(lambda f:f.lower().endswith('.h5'), files)
-    files.sort()
-
+    'return dict table id --> TableSpecs of all tables in the HDF5 files below d'
     tabs = OrderedDict()
 
-    for f in files:
+    files = find_files(d)
+    for rel in sorted(files.keys()):
         try:
-            h5 = tables.openFile(f, 'r')
-            for n in h5.walkNodes(classname = 'Table'):
-                tab = f[dirlen+1:] + ':' + n._v_pathname
-                tabs[tab] = TableSpecs(n._v_title, n.colnames, json.loads(n.attrs.units), int(n.nrows))
-            h5.close()
+            for t, specs in scan_file(files[rel]).iteritems():
+                tabs[rel + ':' + t] = specs
         except:
             pass
 
@@ -68,10 +73,25 @@ def get_binning(bins, data):
     else:
         edges = np.array(bins)
 
+    centers, widths = get_centers_widths(edges)
+    return edges, centers, widths
+
+
+def get_centers_widths(edges):
     centers = (edges[1:] + edges[:-1]) / 2
     assert len(centers) == len(edges) - 1
     widths = np.diff(edges)
-    return edges, centers, widths
+    return centers, widths
+
+
+def sample_chunks(nrows, chunkrows, fraction, seed):
+    '''return sorted list of (start, stop) of randomly chosen chunks of
+       chunkrows rows, about fraction of nrows rows, seed makes the choice
+       reproducible'''
+    nchunks = (nrows + chunkrows - 1) // chunkrows
+    k = min(nchunks, max(1, int(round(fraction * nchunks))))
+    chosen = np.sort(np.random.RandomState(seed).permutation(nchunks)[:k])
+    return [(c * chunkrows, min(nrows, (c + 1) * chunkrows)) for c in chosen]
 
 
 def get_cumulative(bincontents, binerrors, cumulative = 0, binwidths = 1):
@@ -113,11 +133,11 @@ def get_step_points(bincontents, binedges):
     return x, y
 
 
-def adjust_limits(xy, data, limits = None, marl = 0.05, maru = 0.05):
+def adjust_limits(ax, xy, data, limits = None, marl = 0.05, maru = 0.05):
     assert xy in ('x', 'y')
-    lim = getattr(plt, xy + 'lim')
+    lim = getattr(ax, 'set_' + xy + 'lim')
     if limits is None:
-        limits = lim()
+        limits = getattr(ax, 'get_' + xy + 'lim')()
     mi, ma = limits
     data = data[np.isfinite(data)]
     mind = np.min(data)
@@ -125,6 +145,15 @@ def adjust_limits(xy, data, limits = None, marl = 0.05, maru = 0.05):
     span = maxd - mind
     lim(min(mi, min(data) - marl * span), max(ma, max(data) + maru * span))
 
+def percentiles(band):
+    '''return the lower and upper quantile of the band 'lo,hi' in percent, a
+       single number p gives p and 100 - p'''
+    p = sorted([float(v) for v in str(band).split(',')])
+    if len(p) == 1:
+        p = sorted([p[0], 100 - p[0]])
+    return p[0] / 100, p[-1] / 100
+
+
 def sproduct(a, b):
     for x, y in product(a, b):
         yield '{}{}'.format(x, y)
@@ -135,7 +164,10 @@ def sproduct(a, b):
 
 text_poss = map(np.array, [(1, -1), (-1, -1), (-1, 1), (1, 1), (0.5, -1), (-1, 0.5), (0.5, 1), (1, 0.5)])
 text_algn = [('left', 'top'), ('right', 'top'), ('right', 'bottom'), ('left', 'bottom'), ('center', 'top'), ('right', 'center'), ('center', 'bottom'), ('left', 'center')]
-stats_abrv = {'n':'N', 'u':'uflow', 'o':'oflow', 'm':'mean', 's':'std', 'p':'mode', 'e':'median', 'w':'skew', 'k':'kurtos', 'x':'excess', 'c':'cov'}
+stats_abrv = {'n':'N', 'u':'uflow', 'o':'oflow', 'm':'mean', 's':'std', 'p':'mode', 'e':'median', 'd':'exact median', 'w':'skew', 'k':'kurtos', 'x':'excess', 'c':'cov'}
+
+# settings the binned data of a graph depends on, all others only affect its style
+data_settings = ('m', 'sr', 'x', 'y', 'z', 'c', 'xa', 'ya', 'za', 'xb', 'yb')
 
 
 
@@ -186,6 +218,9 @@ class Plot(object):
             for v, w in product('xy', 'b'):
                 self._append(v + w, _get(kwargs, v + n + w))
 
+            # fraction of the rows to sample
+            self._append('sf', _get(kwargs, 'sf' + n))
+
             # plot options
             for k, v in kwargs.iteritems():
                 if k.startswith('o' + n) and v:
@@ -205,9 +240,12 @@ class Plot(object):
         for v in 'tfwhgl':
             setattr(self, v, _get(kwargs, v))
 
-        # source with rate averaging
+        # source with rate averaging and sampling
         for i, s in enumerate(self.s):
-            self._append('sr', '{}:{}:{}:{}'.format(path.join(config['datadir'], s), self.rw[i], self.rs[i], self.rc[i]) if s else None)
+            sr = '{}:{}:{}:{}'.format(path.join(config['datadir'], s), self.rw[i], self.rs[i], self.rc[i]) if s else None
+            if sr and self.sf[i] and float(self.sf[i]) < 1:
+                sr += ':' + self.sf[i]
+            self._append('sr', sr)
 
         self.legend = []
         self.textboxes = []
@@ -216,6 +254,11 @@ class Plot(object):
         self.progress = 0  # reaching from 0 to 1
 
         self.axes = OrderedDict()
+        self.fig = self.ax = None  # figure and current axes, created by plot()
+
+        self.results = None  # binned data, filled by compute()
+        self.sampled = {}  # source --> sampled fraction of the rows
+        self.dpi = None  # resolution the plot is saved with, None for the default
 
 
 
@@ -236,13 +279,28 @@ class Plot(object):
             return dtype(val)
 
 
-    def _prepare_data(self):
+    def _prepare_data(self, graphs):
+        expr_data, joined_cuts = self._data_request(graphs)
+
+        # loop over tables and fill data lists in expr_data
+        units = {}
+        sampled = {}
+        with timing.waiting(hdf5_lock):
+            self._get_data(expr_data, joined_cuts, units, sampled)
+        log.debug(units)
+
+        self._assign_data(graphs, expr_data, units, sampled)
+
+
+    def _data_request(self, graphs):
+        '''return dict source --> expression --> empty list to be filled by
+           _get_data() and the dict source --> OR of all cuts'''
         # create dict: source --> all expr for this source
         # prefilled with empty lists
         expr_data = {}
         joined_cuts = {}  # OR of all cuts
         for n, s in enumerate(self.sr):
-            if s:
+            if s and n in graphs:
                 if s not in expr_data:
                     expr_data[s] = {}  #  add dict for every unique source s (plot n)
                 for v in ['x', 'y', 'z', 'c', 'xa', 'ya', 'za']:
@@ -259,19 +317,15 @@ class Plot(object):
         for s in joined_cuts.keys():
             if '(None)' in joined_cuts[s]: del joined_cuts[s]
         log.debug('joined_cuts = {}'.format(joined_cuts))
+        return expr_data, joined_cuts
 
 
-
-        # loop over tables and fill data lists in expr_data
-        units = {}
-        self._get_data(expr_data, joined_cuts, units)
-        log.debug(units)
-
-
+    def _assign_data(self, graphs, expr_data, units, sampled):
+        self.sampled = sampled
         # assing data arrays to x/y/z/c-data fields
         for v in ['x', 'y', 'z', 'c', 'xa', 'ya', 'za']:
-            setattr(self, v + 'data', [(expr_data[self.sr[i]][x] if x and self.sr[i] else None) for i, x in enumerate(getattr(self, v))])
-            setattr(self, v + 'unit', [(units[self.sr[i]][x] if x and self.sr[i] else None) for i, x in enumerate(getattr(self, v))])
+            setattr(self, v + 'data', [(expr_data[self.sr[i]][x] if x and i in graphs else None) for i, x in enumerate(getattr(self, v))])
+            setattr(self, v + 'unit', [(units[self.sr[i]][x] if x and i in graphs else None) for i, x in enumerate(getattr(self, v))])
 
         log.debug('source={}'.format(self.s))
         log.debug('srcavg={}'.format(self.sr))
@@ -283,7 +337,7 @@ class Plot(object):
 
 
 
-    def _get_data(self, expr_data, filters, units = {}):
+    def _get_data(self, expr_data, filters, units = {}, sampled = {}):
         # evaluate expressions for each source
         for s, exprs in expr_data.iteritems():
             log.debug('processing source {}'.format(s))
@@ -294,11 +348,15 @@ class Plot(object):
             # source s has form 'filename:/path/to/table'
             # open HDF5 table
             ss = s.strip().split(':')
-            with tables.openFile(ss[0], 'r') as h5:
+            with phase('hdf5_open'):
+                h5 = tables.openFile(ss[0], 'r')
+                timing.count_open(ss[0])
+            with h5:
                 table = h5.getNode(ss[1])
                 window = float(eval(ss[2])) if ss[2] != 'None' else None
                 shift = float(ss[3]) if ss[3] != 'None' else 1
                 weight = ss[4] if ss[4] != 'None' else None
+                fraction = float(ss[5]) if len(ss) > 5 else 1
 
                 progr_factor = 1.0 / table.nrows / len(expr_data)
 
@@ -330,7 +388,8 @@ class Plot(object):
                 def average():
                     # look if there is data for this source in the cache
                     cachedir = self.config['cachedir'] or gettempdir()
-                    cachefile = os.path.join(cachedir, 'avg{}.h5'.format(hashargs(s)))
+                    st = os.stat(ss[0])  # new cachefile if the source changed
+                    cachefile = os.path.join(cachedir, 'avg{}.h5'.format(digest(':'.join(ss[:5]), st.st_mtime, st.st_size)))
                     cachefile = os.path.abspath(cachefile)
                     log.debug('cachefile %s', cachefile)
 
@@ -339,12 +398,15 @@ class Plot(object):
                         if not self.config['cachedir']:
                             raise  # always fail it cache is disabled
                         with tables.openFile(cachefile) as cacheh5:
+                            timing.count_open(cachefile)
                             cachetable = cacheh5.getNode('/data')
+                            metrics.cache.inc('averaged', 'hit')
                             progr_factor = 1.0 / cachetable.nrows / len(expr_data)
                             log.info('reading averaged data from cache')
                             for row in cachetable.iterrows():
                                 self.progress = progr_prev + row.nrow * progr_factor
                                 yield row
+                            timing.count_read(cachefile, cachetable, cachetable.nrows)
 
 
                     def average_computed():
@@ -355,6 +417,7 @@ class Plot(object):
                             log.exception('failed opening %s', cachefile)
                             raise RuntimeError('cache for {} in use or corrupt, try again in a few seconds'.format(s))
 
+                        metrics.cache.inc('averaged', 'miss')
                         with cacheh5:
                             # use tables col descriptor and append fields rate and count
                             log.debug('caching averaged data')
@@ -415,6 +478,8 @@ class Plot(object):
                                         wd = filter(lambda x: ta <= x[it] < tb, wd)
                                     append(row)
 
+                            timing.count_read(ss[0], table, table.nrows)
+
                         if not self.config['cachedir']:
                             log.debug('removing averaged data cachefile')
                             os.remove(cachefile)
@@ -442,41 +507,53 @@ class Plot(object):
                 def updateProgress(row, fac):
                     self.progress = progr_prev + row.nrow * fac
 
-                if window:
+                rows = table.nrows
+                if window:  # the averaged rows are not sampled
                     tableiter = average()
                     updateProgress = noop  # progress update is done inside average()
+                elif fraction < 1 and table.nrows:
+                    chunkrows = table.chunkshape[0] if table.chunkshape else 4096
+                    chunks = sample_chunks(table.nrows, chunkrows, fraction, int(digest(s)[:8], 16))
+                    rows = sum([b - a for a, b in chunks])
+                    sampled[s] = rows / float(table.nrows)
+                    log.info('sampling %d of %d rows', rows, table.nrows)
+                    tableiter = chain.from_iterable(table.iterrows(a, b) for a, b in chunks)
                 else:
                     tableiter = table.iterrows()
 
                 if s in filters:
                     tableiter = prefilter(tableiter, filters[s])
 
-                for row in tableiter:
-                    for expr, data in exprs.iteritems():
-                        data.append(expr(row))
-                    if row.nrow % 10000 == 0: updateProgress(row, progr_factor)
+                with phase('averaging' if window else 'extraction'):
+                    for row in tableiter:
+                        for expr, data in exprs.iteritems():
+                            data.append(expr(row))
+                        if row.nrow % 10000 == 0: updateProgress(row, progr_factor)
+
+                    # convert data lists to numpy arrays
+                    d = expr_data[s]
+                    for k in d.keys():
+                        d[k] = np.array(d[k])
 
-                # convert data lists to numpy arrays
-                d = expr_data[s]
-                for k in d.keys():
-                    d[k] = np.array(d[k])
+                kept = len(d.values()[0]) if d else 0
+                if window:  # rows read are counted by average()
+                    timing.count(ss[0], 'rows_kept', kept)
+                else:
+                    timing.count_read(ss[0], table, rows, kept)
 
         # done with getting data
         self.progress = 1
 
 
     __tick_density = 1.5
+    __small = 0.833  # relative size of small text, as matplotlib's 'small'
 
 
     def _configure_pre(self):
-        # configure plotlib
-        plt.clf()
-        plt.close('all')
+        # configure plotlib, every plot has its own figure and canvas,
+        # so plots can be drawn in several threads at the same time
         self.f = self._get('f', 10, float)
         if 'map' in self.m: self.f *= 0.8  # smaller font if plotting map
-        plt.rc('font', **{'family':'sans-serif', 'sans-serif':['Dejavu Sans'], 'size':self.f})
-        # plt.rc('axes', grid = True)
-        plt.rc('lines', markeredgewidth = 0)
         w = self._get('w', 25, float)
         h = self._get('h', w / np.sqrt(2), float)
         # convert cm to inches
@@ -484,45 +561,54 @@ class Plot(object):
         h = h / 2.54
         self.w = w
         self.h = h
-        plt.gcf().set_size_inches([w, h], forward = True);
+        self.fig = Figure(figsize = (w, h))
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot(111)
 #        f = 0.09
 #        if 'map' in self.m: f = 0.06 # more margin if plotting map
-#        plt.gca().set_position([f, f, 1 - 2 * f, 1 - 2 * f])
-#        plt.subplots_adjust(left = f, bottom = f, right = 1 - f, top = 1 - f, wspace = 0, hspace = 0)
-        ticks.set_extended_locator(self.__tick_density)
-        self.axes[''] = plt.gca()
+#        self.ax.set_position([f, f, 1 - 2 * f, 1 - 2 * f])
+#        self.fig.subplots_adjust(left = f, bottom = f, right = 1 - f, top = 1 - f, wspace = 0, hspace = 0)
+        ticks.set_extended_locator(self.__tick_density, ax = self.ax)
+        self.axes[''] = self.ax
+
+
+    def _configure_fonts(self):
+        'set the font size of all axes, ticks and colorbars, the rc font size is the same for all plots'
+        for ax in self.fig.axes:
+            ax.tick_params(which = 'both', labelsize = self.f)
+            for axis in (ax.xaxis, ax.yaxis):
+                axis.label.set_size(self.f)
+                axis.get_offset_text().set_size(self.f)
 
 
 
     def _configure_post(self):
-        plt.axes(self.axes[''])  # activate main axes
+        self.ax = self.axes['']  # activate main axes
 
         # title
-        if self.t: plt.title(self.t, fontsize = 1.4 * self.f)
+        if self.t: self.ax.set_title(self.t, fontsize = 1.4 * self.f)
 
         if 'map' in self.m: return
 
         # settings for main and twin axes
         for v, ax in self.axes.iteritems():
-            plt.axes(ax)
-
             # grid
-            plt.grid(which = 'major', axis = v or 'both', linestyle = '--' if v else '-', color = 'k', alpha = 0.4)
-            plt.grid(which = 'minor', axis = v or 'both', linestyle = '-.' if v else ':', color = 'k', alpha = 0.4)
+            ax.grid(which = 'major', axis = v or 'both', linestyle = '--' if v else '-', color = 'k', alpha = 0.4)
+            ax.grid(which = 'minor', axis = v or 'both', linestyle = '-.' if v else ':', color = 'k', alpha = 0.4)
 
             # set labels, scales and ranges
             for a in 'xy':
                 if v and a != v: continue  # on twins, set only axis
-                getattr(plt, '{}label'.format(a))(self.alabel(a, v))  # label
+                getattr(ax, 'set_{}label'.format(a))(self.alabel(a, v), fontsize = self.f)  # label
                 s = getattr(self, a + 's' + ('tw' if a == v else ''))
                 if s:  # scale
-                    getattr(plt, '{}scale'.format(a))(s)
+                    getattr(ax, 'set_{}scale'.format(a))(s)
                 r = getattr(self, a + 'r' + ('tw' if a == v else ''))
                 if r:  # range (limits)
                     rmin, rmax = r.split(',')
-                    rlim = getattr(plt, '{}lim'.format(a))
+                    rlim = getattr(ax, 'set_{}lim'.format(a))
                     # defaults
-                    rmind, rmaxd = rlim()
+                    rmind, rmaxd = getattr(ax, 'get_{}lim'.format(a))()
                     # set range
                     try:
                         rmin = rmind if rmin == '' else float(rmin)
@@ -534,16 +620,17 @@ class Plot(object):
                         pass
 
         # legend
-        plt.axes(self.axes.values()[-1])  # activate last added axes
+        self.ax = self.axes.values()[-1]  # activate last added axes
         if self.l != 'none' and 'map' not in self.m :
             lines = [v[0] for v in self.legend]
             labels = [v[1] for v in self.legend]
-            leg = plt.legend(lines, labels, loc = self.l or 'best', fancybox = True, numpoints = 1)
-            plt.setp(leg.get_texts(), fontsize = self.f)
+            leg = self.ax.legend(lines, labels, loc = self.l or 'best', fancybox = True, numpoints = 1)
+            for t in leg.get_texts():
+                t.set_fontsize(self.f)
             leg.get_frame().set_alpha(0.8)
 
         # get plot size to position textboxes
-        fig = plt.gcf()
+        fig = self.fig
         sx, sy = fig.get_size_inches() * fig.dpi
 
         # draw textboxes
@@ -566,8 +653,8 @@ class Plot(object):
 
         cy = sy
         for i, t in enumerate(self.textboxes):
-            label = plt.annotate(t, (cx, cy), xycoords = 'axes pixels',
-                family = 'monospace', size = 'small',
+            label = self.ax.annotate(t, (cx, cy), xycoords = 'axes pixels',
+                family = 'monospace', size = self.__small * self.f,
                 horizontalalignment = 'left', verticalalignment = 'top',
                 bbox = dict(facecolor = 'w', alpha = 0.8, boxstyle = "round,pad=0.5"),
                 annotation_clip = False)
@@ -581,8 +668,8 @@ class Plot(object):
         cx = cxw + cx + 50 if len(self.textboxes) else cx
         cy = sy
         for i, t in enumerate(self.fitboxes):
-            plt.annotate(t, (cx, cy), xycoords = 'axes pixels',
-                family = 'monospace', size = 'small',
+            self.ax.annotate(t, (cx, cy), xycoords = 'axes pixels',
+                family = 'monospace', size = self.__small * self.f,
                 horizontalalignment = 'left', verticalalignment = 'top',
                 bbox = dict(facecolor = 'w', alpha = 0.8, boxstyle = "round,pad=0.5"),
                 annotation_clip = False)
@@ -636,12 +723,15 @@ class Plot(object):
 
     def llabel(self, i):
         l = self.n[i]
-        if l: return l
-        l = ''
-        for v in 'xyzc':
-            w = getattr(self, v)[i]
-            if w: l += u':{}'.format(w)
-        return l[1:]
+        if not l:
+            l = ''
+            for v in 'xyzc':
+                w = getattr(self, v)[i]
+                if w: l += u':{}'.format(w)
+            l = l[1:]
+        if self.results and 'sample' in self.results.get(i, {}):  # approximate
+            l += u' (~{}% {})'.format(number_mathformat(100 * self.results[i]['sample'], 2), _('sample'))
+        return l
 
 
     def alabel(self, a, t = ''):
@@ -665,101 +755,247 @@ class Plot(object):
         return l[2:]
 
 
+    def graphs(self):
+        'indices of the graphs to be drawn'
+        return [i for i, m in enumerate(self.m) if m and self.s[i]]
+
+
+    def data_key(self, i):
+        'digest of the settings and the source version the binned data of graph i depends on'
+        try:
+            st = os.stat(self.sr[i].split(':')[0])
+            version = [st.st_mtime, st.st_size]
+        except OSError:
+            version = None
+        if self.bands(i):  # the sketches are only made for bands
+            return digest([getattr(self, v)[i] for v in data_settings], version, 'sketches')
+        return digest([getattr(self, v)[i] for v in data_settings], version)
+
+    def bands(self, i):
+        'whether graph i is a profile drawn with percentile bands'
+        return self.m[i] == 'p' and getattr(self, 'ostyle', 10 * [None])[i] == 'band'
+
+
+    def compute(self):
+        '''fill self.results with the binned data of all graphs, the data is
+           only read and binned for the graphs that are not cached'''
+        missing = self._cached_results()
+        if missing:
+            self._prepare_data(missing)
+            self._bin_missing(missing)
+        self._computed()
+
+
+    def _cached_results(self):
+        'fill self.results from the result cache, return the graphs not cached'
+        graphs = self.graphs()
+        self.keys = dict([(i, self.data_key(i)) for i in graphs])
+        self.results = {}
+        with phase('cache'):
+            for i in graphs:
+                r = resultcache.get(self.keys[i], self.config)
+                if r is not None:
+                    log.debug('using cached result for graph %d', i)
+                    self.results[i] = r
+        return [i for i in graphs if i not in self.results]
+
+
+    def _bin_missing(self, missing):
+        for i in missing:
+            with phase('binning'):
+                r = self._bin(i)
+            with phase('cache'):
+                resultcache.put(self.keys[i], r, self.config)
+            self.results[i] = r
+
+
+    def _computed(self):
+        self.progress = 1
+
+        # restore units of the cached graphs, used in axis labels
+        for v in ['x', 'y', 'z', 'c', 'xa', 'ya', 'za']:
+            setattr(self, v + 'unit', [(self.results[i]['units'][v] if i in self.results else None) for i in xrange(len(self.m))])
+
+
+    def _bin(self, i):
+        'return dict with the binned data of graph i'
+        m = self.m[i]
+        x, y, z = self.data(i)
+        f = self.sampled.get(self.sr[i], 1)  # sampled fraction of the rows
+        if m in ('xy', 'map'):
+            r = {'x':x, 'y':y, 'z':z}
+        elif m == 'h1':
+            r = self._bin_hist1d(i, x, f)
+        elif m == 'h2':
+            r = self._bin_hist2d(i, x, y, f)
+        elif m == 'p':
+            r = self._bin_profile(i, x, y)
+        else:
+            raise RuntimeError('unknow mode ' + m)
+        if f < 1:
+            r['sample'] = f
+        r['units'] = dict([(v, getattr(self, v + 'unit')[i]) for v in ['x', 'y', 'z', 'c', 'xa', 'ya', 'za']])
+        return r
+
+
     def plot(self):
-        self._prepare_data()
-        self._configure_pre()
-        for i, m in enumerate(self.m):
-            if m and self.s[i]:
+        if self.results is None:
+            self.compute()
+        with phase('drawing'):
+            self._configure_pre()
+            for i in self.graphs():
+                m = self.m[i]
+                r = self.results[i]
                 self.selectAxes(i)
                 if m == 'xy':
-                    self._xy(i)
+                    self._xy(i, r)
                 elif m == 'h1':
-                    self._hist1d(i)
+                    self._hist1d(i, r)
                 elif m == 'h2':
-                    self._hist2d(i)
+                    self._hist2d(i, r)
                 elif m == 'p':
-                    self._profile(i)
+                    self._profile(i, r)
                 elif m == 'map':
-                    self._map(i)
-                else:
-                    raise RuntimeError('unknow mode ' + m)
-        self._configure_post()
+                    self._map(i, r)
+            self._configure_post()
+            self._configure_fonts()
 
 
     def show(self):
         log.debug('showing plot in interactive mode')
         if not any(self.legend):
             self.plot()
+        import matplotlib.pyplot as plt
+        # show the figure in a window of pyplot
+        manager = plt.figure().canvas.manager
+        manager.canvas.figure = self.fig
+        self.fig.set_canvas(manager.canvas)
         plt.show()
 
 
-    def save(self, name = 'fig', extensions = ('png', 'pdf', 'svg')):
-        plt.ioff()
+    def save(self, name = 'fig', extensions = ('png', 'pdf', 'svg'), deferred = (), dpi = None):
+        '''save plot to name.ext for all extensions, the formats in deferred
+           are not rendered now, instead the figure is persisted to name.fig
+           and they are created on demand by export()'''
         if not any(self.legend):
+            self.dpi = dpi
             self.plot()
+        bbox = self.layout()
         names = []
         for ext in extensions:
             n = name + '.' + ext
             log.debug('saving plot to %s', n)
-            plt.savefig(n, bbox_inches = 'tight', pad_inches = 0.5 if 'map' in self.m else 0.1, transparent = False)
+            with phase('savefig_' + ext):
+                self.fig.savefig(n, dpi = dpi, bbox_inches = bbox, transparent = False)
             names.append(n)
 
-        return dict(zip(extensions, names))
+        if deferred:
+            try:
+                log.debug('persisting figure to %s.fig', name)
+                with phase('savefig_fig'), open(name + '.fig', 'wb') as f:
+                    pickle.dump((self.fig, bbox), f, pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                log.exception('persisting figure failed, saving %s now', deferred)
+                if path.isfile(name + '.fig'):
+                    os.remove(name + '.fig')
+                for ext in deferred:
+                    with phase('savefig_' + ext):
+                        self.fig.savefig(name + '.' + ext, bbox_inches = bbox, transparent = False)
+            names.extend([name + '.' + ext for ext in deferred])
+
+        return dict(zip(tuple(extensions) + tuple(deferred), names))
 
 
-    __twin = {'x':plt.twiny, 'y':plt.twinx}
+    def layout(self):
+        '''return the bounding box in inches of everything drawn, with padding,
+           saving with it as bbox_inches draws the figure once per format, with
+           bbox_inches = 'tight' matplotlib draws it twice to find the box'''
+        pad = 0.5 if 'map' in self.m else 0.1
+        with phase('layout'):
+            return self.fig.get_tightbbox(self.fig.canvas.get_renderer()).padded(pad)
+
+
+    __twin = {'x':'twiny', 'y':'twinx'}
 
     def selectAxes(self, i):
-        plt.axes(self.axes[''])  # activate main axes
+        self.ax = self.axes['']  # activate main axes
         v = self.tw[i]
         if v and v in 'xy':
-            if v in self.axes:
-                plt.axes(self.axes[v])  # activate twin x/y axes
-            else:
-                self.axes[v] = self.__twin[v]()  # create twin x/y axes
-                ticks.set_extended_locator(self.__tick_density)  # add tick locator
+            if v not in self.axes:
+                self.axes[v] = getattr(self.ax, self.__twin[v])()  # create twin x/y axes
+                ticks.set_extended_locator(self.__tick_density, ax = self.axes[v])  # add tick locator
+            self.ax = self.axes[v]  # activate twin x/y axes
             return
 
 
 
-    def fit(self, i, x, y, yerr = None):
+    def fit_result(self, i, x, y, yerr = None):
+        '''fit the function of graph i to x, y, return None if there is no
+           fit function or dict with the function, parameters, covariance,
+           chi2, number of points and status (empty if the fit succeeded)'''
         ff = self.ff[i]
-        if ff:
-            ff = ff.replace(' ', '')
-            log.info('fitting function {}'.format(ff))
-            fitfunc = eval('lambda x,*p:' + ff)
-            x, y = np.array(x), np.array(y)
-            m = np.logical_and(np.isfinite(x), np.isfinite(y))
-            if yerr is not None:
-                yerr = np.array(yerr)
-                m = np.logical_and(m, np.isfinite(yerr))
-                yerr = yerr[m]
-            x , y = x[m], y[m]
-
-            # gather fit parameters
-            p = tuple([float(fp) for fp in self.fp[i].split(',')])
-            try:
+        if not ff:
+            return None
+
+        ff = ff.replace(' ', '')
+        log.info('fitting function {}'.format(ff))
+        fitfunc = eval('lambda x,*p:' + ff)
+        x, y = np.array(x), np.array(y)
+        m = np.logical_and(np.isfinite(x), np.isfinite(y))
+        if yerr is not None:
+            yerr = np.array(yerr)
+            m = np.logical_and(m, np.isfinite(yerr))
+            yerr = yerr[m]
+        x , y = x[m], y[m]
+
+        # gather fit parameters
+        p = tuple([float(fp) for fp in self.fp[i].split(',')])
+        try:
+            with phase('fitting'):
                 p, c = curve_fit(fitfunc, x, y, p, yerr)
-                log.info('parameters = {}'.format(p))
-                log.info('covariance = {}'.format(c))
-                fit_status = ''
-            except Exception as e:
-                fit_status = ' (failed: {})'.format(e)
-                c = None
-                log.exception('fit failed')
+            log.info('parameters = {}'.format(p))
+            log.info('covariance = {}'.format(c))
+            fit_status = ''
+        except Exception as e:
+            fit_status = ' (failed: {})'.format(e)
+            c = None
+            log.exception('fit failed')
+
+        chi2 = fitfunc(x, *p) - y
+        if yerr is not None:
+            chi2 = chi2 / yerr
+        chi2 = (chi2 ** 2).sum()
+
+        return {'function':ff, 'func':fitfunc, 'parameters':p, 'covariance':c, 'chi2':chi2,
+                'n':len(x), 'status':fit_status, 'xmin':np.nanmin(x), 'xmax':np.nanmax(x)}
+
+
+    def fit_data(self, i, r):
+        'return x, y, yerr the function of graph i is fitted to'
+        m = self.m[i]
+        if m == 'xy':
+            return r['x'], r['y'], None
+        if m == 'h1':
+            bincenters, binwidths, bincontents, binerrors = self._hist1d_values(i, r)
+            return bincenters, bincontents, binerrors
+        if m == 'p':
+            o = get_args_from(self.opts(i), yerr = 0)
+            return get_centers_widths(r['edges'])[0], r['means'], r['stds'] if o.yerr else None
+        return None, None, None
+
+
+    def fit(self, i, x, y, yerr = None):
+        f = self.fit_result(i, x, y, yerr)
+        if f:
+            ff, fitfunc, p, c, N, fit_status = f['function'], f['func'], f['parameters'], f['covariance'], f['n'], f['status']
+            chi2 = f['chi2']
 
             # plot fit result
-            xfit = np.linspace(np.nanmin(x), np.nanmax(x), 1000)
+            xfit = np.linspace(f['xmin'], f['xmax'], 1000)
             yfit = fitfunc(xfit, *p)
             args = [xfit, yfit]
             if self.fl[i]: args.append(self.fl[i])
-            l, = plt.plot(*args)
-
-            N = len(x)
-            chi2 = fitfunc(x, *p) - y
-            if yerr is not None:
-                chi2 = chi2 / yerr
-            chi2 = (chi2 ** 2).sum()
+            l, = self.ax.plot(*args)
 
             # add textbox
             t = 'y=' + ff
@@ -779,10 +1015,118 @@ class Plot(object):
 
 
 
-    def _xy(self, i):
+    __oversample = 2  # decimate to half pixels, vector formats may be zoomed
+
+    def _pixel_axis(self, i, a, v):
+        '''return the values v on axis a of graph i in the scale of the axis
+           (log10 if log scale), the range set for the axis or None and
+           whether the axis is logarithmic'''
+        tw = 'tw' if self.tw[i] == a else ''
+        s, r = getattr(self, a + 's' + tw), getattr(self, a + 'r' + tw)
+        try:
+            lim = [float(b) for b in r.split(',')]
+        except (AttributeError, ValueError):
+            lim = None
+        if s == 'log':
+            with np.errstate(invalid = 'ignore', divide = 'ignore'):
+                v = np.log10(np.where(v > 0, v, np.nan))
+            lim = np.log10(lim) if lim and min(lim) > 0 else None
+        return v, lim, s == 'log'
+
+
+    def decimated(self, i, kwargs, x, y, z, projected = False):
+        '''return x, y, z of graph i reduced to the points visible at the size
+           and resolution of the figure (see decimate.py), pops the option
+           decimate from kwargs: 0 (off), 1 or minmax (default) or lttb'''
+        o = get_args_from(kwargs, decimate = 1)
+        method = {0:None, 1:'minmax'}.get(o.decimate, o.decimate)
+        if not method or y is None or len(y) == 0:
+            return x, y, z
+        if method not in ('minmax', 'lttb'):
+            log.warning('unknown decimation %s, using minmax', method)
+            method = 'minmax'
+
+        dpi = self.dpi or mpl.rcParams['savefig.dpi']
+        if not isinstance(dpi, (int, float)):  # 'figure' in newer matplotlib
+            dpi = mpl.rcParams['figure.dpi']
+        nx, ny = int(self.w * dpi * self.__oversample), int(self.h * dpi * self.__oversample)
+        if x is None:
+            x = np.arange(len(y))
+        if projected:  # map coordinates, the map sets the axes limits
+            ax = self.ax
+            xd, yd, xlim, ylim = x, y, ax.get_xlim(), ax.get_ylim()
+        else:
+            (xd, xlim, _), (yd, ylim, _) = self._pixel_axis(i, 'x', x), self._pixel_axis(i, 'y', y)
+        none = (None, 'none', 'None', '', ' ')
+        line = z is None and kwargs.get('linestyle', '-') not in none
+        markers = kwargs.get('marker') not in none
+
+        with phase('decimation'):
+            idx = decimate.decimate(xd, yd, nx, ny, method, line, xlim, ylim, markers)
+        if idx is None:
+            return x, y, z
+        return x[idx], y[idx], z[idx] if z is not None else None
+
+
+    __raster_points = 100000  # xy plots with z and more points are rasterized
+
+    def raster_mode(self, raster, r):
+        '''return how the points of the xy graph with results r are reduced to
+           pixels (count, mean or max of z) or None to draw them as markers,
+           raster is the option: auto (default), 0, 1 (mean), count, mean or max'''
+        if r['z'] is None or not raster:
+            return None
+        if raster == 'auto':
+            return 'mean' if len(r['z']) > self.__raster_points else None
+        if raster == 1:
+            return 'mean'
+        if raster in ('count', 'mean', 'max'):
+            return raster
+        log.warning('unknown raster %s, drawing markers', raster)
+        return None
+
+
+    def image(self, xedges, yedges, c, linear = True, **kwargs):
+        '''draw the image c (indexed [y, x]) on the cells between the edges, as
+           image if the cells are equal on screen, otherwise as mesh, rasterized
+           in vector formats'''
+        if linear and is_uniform(xedges) and is_uniform(yedges):
+            kwargs.pop('edgecolor', None)
+            pargs = set_defaults(kwargs, origin = 'lower', aspect = 'auto', interpolation = 'nearest')
+            return self.ax.imshow(c, extent = [xedges[0], xedges[-1], yedges[0], yedges[-1]], **pargs)
+        return self.ax.pcolormesh(xedges, yedges, c, rasterized = True, **kwargs)
+
+
+    def _raster_xy(self, i, x, y, z, mode, markersize, kwargs):
+        '''draw the points of xy graph i as image of mode (count, mean or max
+           of z) in pixels of the size of the markers, return the image, a
+           legend proxy and the image values'''
+        pargs = dict([(k, kwargs[k]) for k in ('cmap', 'alpha', 'zorder', 'vmin', 'vmax') if k in kwargs])
+        n = lambda inches: max(1, int(inches * 72 / max(markersize, 1)))
+        (xd, xlim, xlog), (yd, ylim, ylog) = self._pixel_axis(i, 'x', x), self._pixel_axis(i, 'y', y)
+        with phase('rasterizing'):
+            xe, ye, count, mean, mx = decimate.raster(xd, yd, z, n(self.w), n(self.h), xlim, ylim)
+        c = ma.array({'count':count, 'mean':mean, 'max':mx}[mode], mask = count == 0)
+        if xlog: xe = 10 ** xe
+        if ylog: ye = 10 ** ye
+        im = self.image(xe, ye, c, not xlog and not ylog, **pargs)
+
+        cmap = mpl.cm.get_cmap(pargs.get('cmap'))
+        l = mpl.lines.Line2D([], [], linestyle = 'none', marker = 's', markeredgewidth = 0, color = cmap(0.5))
+        return im, l, c.compressed()
+
+
+    def _xy(self, i, r):
         log.debug('xy plot of {}'.format([getattr(self, v)[i] for v in 'sxyzc']))
         kwargs = self.opts(i)
-        x, y, z = self.data(i)
+        raster = self.raster_mode(get_args_from(kwargs, raster = 'auto').raster, r)
+        if raster:
+            kwargs.pop('decimate', None)
+            x, y, z = r['x'], r['y'], r['z']
+            if x is None:
+                x = np.arange(len(y))
+        else:
+            x, y, z = self.decimated(i, kwargs, r['x'], r['y'], r['z'])
 
         if x is not None:
             args = (x, y)
@@ -790,50 +1134,59 @@ class Plot(object):
             args = (y,)
 
         if z is None:
-            l, = plt.plot(*args, **kwargs)
+            l, = self.ax.plot(*args, **kwargs)
         else:
             # linestyle must not be 'none' when plotting 3D
             if 'linestyle' in kwargs and kwargs['linestyle'] == 'none':
                 kwargs['linestyle'] = ':'
 
-            o = get_args_from(kwargs, markersize = 2, cbfrac = 0.04, cblabel = self.alabel('z'))
-            l = plt.scatter(x, y, c = z, s = o.markersize ** 2, edgecolor = 'none', **kwargs)
+            o = get_args_from(kwargs, markersize = 2, cbfrac = 0.04, cblabel = 'count' if raster == 'count' else self.alabel('z'))
+            if raster:
+                mappable, l, values = self._raster_xy(i, x, y, z, raster, o.markersize, kwargs)
+            else:
+                mappable = l = self.ax.scatter(x, y, c = z, s = o.markersize ** 2, edgecolor = 'none', **kwargs)
+                values = z
 
             m = 6.0
-            dmin, dmax = np.nanmin(z), np.nanmax(z)
-            cticks = ticks.get_ticks(dmin, dmax, m, only_inside = 1)
+            values = np.asarray(values, dtype = float)
+            values = values[np.isfinite(values)]
+            cticks = None  # no points inside the ranges, default ticks
+            if len(values):
+                cticks = ticks.get_ticks(values.min(), values.max(), m, only_inside = 1)
             formatter = mpl.ticker.FuncFormatter(func = lambda x, i:number_mathformat(x))
-            cb = plt.colorbar(fraction = o.cbfrac, pad = 0.01, aspect = 40, ticks = cticks, format = formatter)
+            cb = self.fig.colorbar(mappable, ax = self.ax, fraction = o.cbfrac, pad = 0.01, aspect = 40, ticks = cticks, format = formatter)
             cb.set_label(o.cblabel)
 
         self.legend.append((l, self.llabel(i)))
 
         # fit
-        self.fit(i, x, y)
-
-    def _hist1d(self, i):
-        self.plotted_lines = []
-        log.debug('1D histogram of {}'.format([getattr(self, v)[i] for v in 'sxyzc']))
-        kwargs = self.opts(i)
-        x, y, z = self.data(i)
-
-        o = get_args_from(kwargs, density = False, cumulative = 0)
-        o.update(get_args_from(kwargs, style = 'histline' if o.density else 'hist'))
-        err = 0  # o.style.startswith('s')
-        o.update(get_args_from(kwargs, xerr = err, yerr = err, capsize = 3 if err else 0))
+        self.fit(i, r['x'], r['y'])
 
+    def _bin_hist1d(self, i, x, fraction = 1):
         bins = self.bins(i, 'x')
         if  bins == 0:
             bins = int(1 + np.log2(len(x)))
         binedges, bincenters, binwidths = get_binning(bins, x)
 
-        bincontents, _d1 = np.histogram(x, binedges)
-        assert np.all(binedges == _d1)
+        bincontents = histogram.histogram(x, binedges)
         binerrors = np.sqrt(bincontents)
         binerrors[binerrors == 0] = 1
 
-        # statsbox
-        self.stats_fields1d(i, x, bincontents, binerrors, binedges)
+        if fraction < 1:  # estimate for all rows, the errors include the sampling error
+            bincontents, binerrors = bincontents / fraction, binerrors / fraction
+
+        stats = self.stats_fields1d(x, bincontents, binerrors, binedges)
+        if fraction < 1:
+            self.stats_sampled(stats, fraction)
+            stats['uflow'] /= fraction
+            stats['oflow'] /= fraction
+        return {'edges':binedges, 'contents':bincontents, 'errors':binerrors, 'stats':stats}
+
+    def _hist1d_values(self, i, r):
+        'return bin centers, widths, contents and errors, scaled according to the density and cumulative options'
+        o = get_args_from(self.opts(i), density = False, cumulative = 0)
+        bincontents, binerrors = r['contents'], r['errors']
+        bincenters, binwidths = get_centers_widths(r['edges'])
 
         if o.density:
             bincontents, binerrors = get_density(bincontents, binerrors, binwidths)
@@ -841,6 +1194,24 @@ class Plot(object):
         if o.cumulative:
             bincontents, binerrors = get_cumulative(bincontents, binerrors, o.cumulative, binwidths if o.density else 1)
 
+        return bincenters, binwidths, bincontents, binerrors
+
+    def _hist1d(self, i, r):
+        self.plotted_lines = []
+        log.debug('1D histogram of {}'.format([getattr(self, v)[i] for v in 'sxyzc']))
+        kwargs = self.opts(i)
+
+        o = get_args_from(kwargs, density = False, cumulative = 0)
+        o.update(get_args_from(kwargs, style = 'histline' if o.density else 'hist'))
+        err = 0  # o.style.startswith('s')
+        o.update(get_args_from(kwargs, xerr = err, yerr = err, capsize = 3 if err else 0))
+
+        binedges = r['edges']
+        bincenters, binwidths, bincontents, binerrors = self._hist1d_values(i, r)
+
+        # statsbox
+        self.statsbox(i, r['stats'])
+
         if 'line' in o.style:
             x = bincenters
             y = bincontents
@@ -848,14 +1219,14 @@ class Plot(object):
             x, y = get_step_points(bincontents, binedges)
 
         if 'fill' in o.style:
-            l, = plt.fill(x, y, **kwargs)
+            l, = self.ax.fill(x, y, **kwargs)
 
         elif 'hist' in o.style:
-            l, = plt.plot(x, y, **kwargs)
+            l, = self.ax.plot(x, y, **kwargs)
 
         elif 'scat' in o.style:
             pargs = set_defaults(kwargs, linestyle = '', marker = '.')
-            l, = plt.plot(bincenters, bincontents, **pargs)
+            l, = self.ax.plot(bincenters, bincontents, **pargs)
 
         else:
             raise ValueError('unknown style: ' + o.style)
@@ -864,24 +1235,17 @@ class Plot(object):
             pargs = set_defaults(kwargs, capsize = o.capsize, ecolor = 'k' if 'fill' in o.style else l.get_c())
             xerr = 0.5 * binwidths if o.xerr else None
             yerr = binerrors if o.yerr else None
-            plt.errorbar(bincenters, bincontents, yerr, xerr, fmt = None, **pargs)
+            self.ax.errorbar(bincenters, bincontents, yerr, xerr, fmt = None, **pargs)
 
 
-        adjust_limits('x', binedges)
-        adjust_limits('y', bincontents + binerrors, marl = 0)
+        adjust_limits(self.ax, 'x', binedges)
+        adjust_limits(self.ax, 'y', bincontents + binerrors, marl = 0)
 
         self.legend.append((l, self.llabel(i)))
 
         self.fit(i, bincenters, bincontents, binerrors)
 
-    def _hist2d(self, i):
-        log.debug('2D histogram of {}'.format([getattr(self, v)[i] for v in 'sxyzc']))
-        kwargs = self.opts(i)
-        x, y, z = self.data(i)
-        o = get_args_from(kwargs, style = 'color', density = False, log = False, cbfrac = 0.04, cblabel = 'bincontent', levels = 10)
-        filled = 'color' in o.style or ('fill' in o.style)
-        o.update(get_args_from(kwargs, hidezero = o.log or filled, colorbar = filled, clabels = not filled))
-
+    def _bin_hist2d(self, i, x, y, fraction = 1):
         # make binnings
         bins = self.bins(i, 'x')
         if  bins == 0:
@@ -893,13 +1257,30 @@ class Plot(object):
             bins = int(1 + np.log2(len(y)))
         yedges, ycenters, ywidths = get_binning(bins, y)
 
-        bincontents, _d1, _d2 = np.histogram2d(x, y, [xedges, yedges])
-        bincontents = np.transpose(bincontents)
-        assert np.all(_d1 == xedges)
-        assert np.all(_d2 == yedges)
+        bincontents = np.transpose(histogram.histogram2d(x, y, xedges, yedges))
+
+        if fraction < 1:
+            bincontents = bincontents / fraction
+
+        stats = self.stats_fields2d(bincontents, xcenters, ycenters)
+        if fraction < 1:
+            self.stats_sampled(stats, fraction)
+        return {'xedges':xedges, 'yedges':yedges, 'contents':bincontents, 'stats':stats}
+
+    def _hist2d(self, i, r):
+        log.debug('2D histogram of {}'.format([getattr(self, v)[i] for v in 'sxyzc']))
+        kwargs = self.opts(i)
+        o = get_args_from(kwargs, style = 'color', density = False, log = False, cbfrac = 0.04, cblabel = 'bincontent', levels = 10)
+        filled = 'color' in o.style or ('fill' in o.style)
+        o.update(get_args_from(kwargs, hidezero = o.log or filled, colorbar = filled, clabels = not filled))
+
+        xedges, yedges = r['xedges'], r['yedges']
+        xcenters, xwidths = get_centers_widths(xedges)
+        ycenters, ywidths = get_centers_widths(yedges)
+        bincontents = np.array(r['contents'], dtype = float)  # copy, cached result must not change
 
         # statsbox
-        self.stats_fields2d(i, bincontents, xcenters, ycenters)
+        self.statsbox(i, r['stats'])
 
         if o.density:
             bincontents = get_density2d(bincontents, xwidths, ywidths)
@@ -915,7 +1296,8 @@ class Plot(object):
 
         if 'color' in o.style:
             pargs = set_defaults(kwargs, cmap = 'jet', edgecolor = 'none')
-            plt.pcolor(xedges, yedges, ma.array(bincontents, mask = np.isnan(bincontents)), **kwargs)
+            mappable = self.image(xedges, yedges, ma.array(bincontents, mask = np.isnan(bincontents)),
+                       self.xs != 'log' and self.ys != 'log', **kwargs)
 
         elif 'box' in o.style:
             pargs = set_defaults(kwargs, color = (1, 1, 1, 0), marker = 's', edgecolor = 'k')
@@ -923,7 +1305,7 @@ class Plot(object):
             s = bincontents.reshape(n)
             s = s / np.nanmax(s) * (72. / 2. * self.w / max(len(xcenters), len(ycenters))) ** 2
             xcenters, ycenters = np.meshgrid(xcenters, ycenters)
-            plt.scatter(xcenters.reshape(n), ycenters.reshape(n), s = s, **pargs)
+            mappable = self.ax.scatter(xcenters.reshape(n), ycenters.reshape(n), s = s, **pargs)
 
         elif 'contour' in o.style:
             pargs = set_defaults(kwargs, cmap = 'jet')
@@ -931,11 +1313,12 @@ class Plot(object):
                 pargs['cmap'] = mpl.cm.get_cmap(pargs['cmap'])
 
             if filled:
-                cs = plt.contourf(xcenters, ycenters, bincontents, o.levels, **pargs)
+                cs = self.ax.contourf(xcenters, ycenters, bincontents, o.levels, **pargs)
             else:
-                cs = plt.contour(xcenters, ycenters, bincontents, o.levels, **pargs)
+                cs = self.ax.contour(xcenters, ycenters, bincontents, o.levels, **pargs)
                 if o.clabels:
-                    plt.clabel(cs, inline = 1)
+                    self.ax.clabel(cs, inline = 1, fontsize = self.f)
+            mappable = cs
 
         else:
             raise ValueError('unknown style ' + o.style)
@@ -950,52 +1333,65 @@ class Plot(object):
             else:
                 cticks = ticks.get_ticks(dmin, dmax, m, only_inside = 1)
 
-            cb = plt.colorbar(fraction = o.cbfrac, pad = 0.01, aspect = 40, ticks = cticks, format = formatter)
+            cb = self.fig.colorbar(mappable, ax = self.ax, fraction = o.cbfrac, pad = 0.01, aspect = 40, ticks = cticks, format = formatter)
             cb.set_label(o.cblabel)
 
 
-    def _profile(self, i):
-        log.debug('profile of {}'.format([getattr(self, v)[i] for v in 'sxyzc']))
-        kwargs = self.opts(i)
-        x, y, z = self.data(i)
-        o = get_args_from(kwargs, xerr = 0, yerr = 0)
-
+    def _bin_profile(self, i, x, y):
         # make x binning
         xedges, xcenters, xwidths = get_binning(self.bins(i, 'x'), x)
 
         # compute avg and std for each x bin
-        xx = xcenters
+        counts, yy, yerr = binstats.profile(x, y, xedges)
+        r = {'edges':xedges, 'means':yy, 'stds':yerr, 'counts':counts}
+        if self.bands(i):  # quantiles of y in each x bin
+            r['sketches'] = quantiles.binned(x, y, xedges)
+        return r
+
+    def _profile(self, i, r):
+        log.debug('profile of {}'.format([getattr(self, v)[i] for v in 'sxyzc']))
+        kwargs = self.opts(i)
+        o = get_args_from(kwargs, xerr = 0, yerr = 0, style = 'errorbar', band = '25,75')
+
+        xx, xwidths = get_centers_widths(r['edges'])
         xerr = 0.5 * xwidths if o.xerr else None
-        yy = []
-        yerr = []
-        for l, u in zip(xedges[:-1], xedges[1:]):
-            bindata = y[(l <= x) & (x < u)]
-            yy.append(np.mean(bindata))
-            yerr.append(np.std(bindata))
-        if not o.yerr:
-            yerr = None
-
-        pargs = set_defaults(kwargs, capsize = 3, marker = '.', linestyle = 'none')
-        l, _d, _d = plt.errorbar(xx, yy, yerr, xerr, **pargs)
+        yy = r['means']
+        yerr = r['stds'] if o.yerr else None
+
+        if o.style == 'band':  # median and a percentile band
+            lo, hi = percentiles(o.band)
+            q = np.array([s.quantile([lo, 0.5, hi]) for s in r['sketches']]).reshape(-1, 3)
+            yy, yerr = q[:, 1], None
+            pargs = set_defaults(kwargs, marker = '.', linestyle = '-')
+            l, = self.ax.plot(xx, yy, **pargs)
+            self.ax.fill_between(xx, q[:, 0], q[:, 2], color = l.get_color(), alpha = 0.3 * (l.get_alpha() or 1),
+                                 linewidth = 0, zorder = l.get_zorder() - 0.1)
+        else:
+            pargs = set_defaults(kwargs, capsize = 3, marker = '.', linestyle = 'none')
+            l, _d, _d = self.ax.errorbar(xx, yy, yerr, xerr, **pargs)
 
         self.legend.append((l, self.llabel(i)))
 
         self.fit(i, xx, yy, yerr)
 
 
-    def _map(self, i):
+    def _map(self, i, r):
         import maps
         log.debug('map of {}'.format([getattr(self, v)[i] for v in 'sxyzc']))
         kwargs = self.opts(i)
-        x, y, z = self.data(i)
+        x, y, z = r['x'], r['y'], r['z']
         o = get_args_from(kwargs, margin = 0.05, width = 10e6, height = None, boundarylat = 50, projection = 'cyl',
                           drawcoastline = 1, drawgrid = 1, drawspecgrid = 1, drawcountries = 0, bluemarble = 0, nightshade = None)
 
-        m = maps.drawmap(y, x, **o)
+        # nothing is cached on disk in debug mode
+        cachedir = None if self.config.get('debug') else self.config.get('cachedir')
+        m = maps.drawmap(y, x, ax = self.ax, fontsize = self.f, cachedir = cachedir,
+                         cachesize = self.config.get('mapcache_mb', 512) * 2 ** 20, **o)
         x, y = m(x, y)
+        x, y, z = self.decimated(i, kwargs, np.asarray(x), np.asarray(y), z, projected = True)
 
         if z is None:
-            l, = plt.plot(x, y, **kwargs)
+            l, = self.ax.plot(x, y, **kwargs)
         else:
             # linestyle must not be 'none' when plotting 3D
             if 'linestyle' in kwargs and kwargs['linestyle'] == 'none':
@@ -1003,28 +1399,25 @@ class Plot(object):
 
             o = get_args_from(kwargs, markersize = 6, cbfrac = 0.04, cblabel = self.alabel('z'))
             p = set_defaults(kwargs, zorder = 100)
-            l = plt.scatter(x, y, c = z, s = o.markersize ** 2, edgecolor = 'none', **p)
+            mappable = l = self.ax.scatter(x, y, c = z, s = o.markersize ** 2, edgecolor = 'none', **p)
 
             m = 6.0
             dmin, dmax = np.nanmin(z), np.nanmax(z)
             cticks = ticks.get_ticks(dmin, dmax, m, only_inside = 1)
             formatter = mpl.ticker.FuncFormatter(func = lambda x, i:number_mathformat(x))
-            cb = plt.colorbar(fraction = o.cbfrac, pad = 0.01, aspect = 40, ticks = cticks, format = formatter)
+            cb = self.fig.colorbar(mappable, ax = self.ax, fraction = o.cbfrac, pad = 0.01, aspect = 40, ticks = cticks, format = formatter)
             cb.set_label(o.cblabel)
 
         self.legend.append((l, self.llabel(i)))
 
 
-    def stats_fields1d(self, i, data, contents, errors, edges):
+    def stats_fields1d(self, data, contents, errors, edges):
         centers = (edges[1:] + edges[:-1]) / 2
         widths = np.diff(edges)
 
-        stats = {}
-        stats['N'] = N = np.sum(contents)
+        stats = binstats.moments(centers, contents)
         stats['uflow'] = np.sum(data < edges[0])
         stats['oflow'] = np.sum(edges[-1] < data)
-        stats['mean'] = mean = np.sum(centers * contents) / N
-        stats['std'] = std = np.sqrt(np.sum((centers - mean) ** 2 * contents) / N)
         stats['mode'] = centers[np.argmax(contents)]
         bc, be = get_density(contents, errors, widths)
         bc, be = get_cumulative(bc, be, 1, widths)
@@ -1032,38 +1425,27 @@ class Plot(object):
         stats['median'] = median = centers[median_i]
         if len(centers) % 2 == 0:  # even # of s
             stats['median'] = median = (median + centers[median_i - 1]) / 2
-        stats['skew'] = np.sum(((centers - mean) / std) ** 3 * contents) / N
-        stats['kurtos'] = kurtosis = np.sum(((centers - mean) / std) ** 4 * contents) / N
-        stats['excess'] = kurtosis - 3
+        inside = data[(edges[0] <= data) & (data <= edges[-1])]
+        stats['exact median'] = np.median(inside) if len(inside) else np.nan  # exact, of the values in the bins
         log.debug(stats)
+        return stats
 
-        text = '{:6} {}'.format('hist', self.llabel(i))
-        sb = self.sb[i]
-        if 'a' in sb: sb = 'nmscpewx'
-        if 'uflow' in stats and stats['uflow']: sb += 'u'
-        if 'oflow' in stats and stats['oflow']: sb += 'o'
-        for k in sb:
-            k = stats_abrv[k]
-            if k in stats:
-                text += '\n{:6} {}'.format(_(k), number_mathformat(stats[k]))
-        self.textboxes.append(text)
-
-    def stats_fields2d(self, i, contents, xcenters, ycenters):
-        stats = {}
-        stats['N'] = N = contents.sum()
-        stats['mean'] = mean = np.array([ (contents.sum(axis = 0) * xcenters).sum(),
-                         (contents.sum(axis = 1) * ycenters).sum()]) / N
-        stats['std'] = np.sqrt(np.array([(contents.sum(axis = 0) * (xcenters - mean[0]) ** 2).sum(),
-                                  (contents.sum(axis = 1) * (ycenters - mean[1]) ** 2).sum()]) / N)
-        cov = 0
-        for k, l in product(xrange(contents.shape[1]), xrange(contents.shape[0])):
-            cov += contents[l, k] * (xcenters[k] - mean[0]) * (ycenters[l] - mean[1])
-        stats['cov'] = cov / N
+    def stats_fields2d(self, contents, xcenters, ycenters):
+        stats = binstats.moments2d(contents, xcenters, ycenters)
         log.debug(stats)
+        return stats
 
+    def stats_sampled(self, stats, fraction):
+        '''add the sampled fraction and the error of N to stats, N was computed
+           from the scaled contents, so there were N * fraction rows sampled'''
+        stats['sample'] = fraction
+        stats['Nerr'] = np.sqrt(stats['N'] * fraction) / fraction
+
+    def statsbox(self, i, stats):
+        'add textbox showing the stats of graph i selected by the sb setting'
         text = '{:6} {}'.format('hist', self.llabel(i))
         sb = self.sb[i]
-        if 'a' in sb: sb = 'nmscpewx'
+        if 'a' in sb: sb = 'nmscpedwx'
         if 'uflow' in stats and stats['uflow']: sb += 'u'
         if 'oflow' in stats and stats['oflow']: sb += 'o'
         for k in sb:
@@ -1075,10 +1457,65 @@ class Plot(object):
                 except:
                     v = '({})'.format(','.join(map(number_mathformat, v)))
                 text += '\n{:6} {}'.format(_(k), v)
+        if 'sample' in stats:  # approximate
+            text += '\n{:6} {}%, N$\\pm${}'.format(_('sample'), number_mathformat(100 * stats['sample'], 3), number_mathformat(stats['Nerr']))
         self.textboxes.append(text)
 
 
 
+def compute_all(plots):
+    '''compute() all plots, the HDF5 tables used by several of them are only
+       read once, with the expressions and cuts of all plots'''
+    missing = [(p, p._cached_results()) for p in plots]
+    missing = [(p, graphs) for p, graphs in missing if graphs]
+
+    if missing:
+        expr_data = {}  # source --> expression --> data of all plots
+        joined_cuts = {}  # source --> OR of all cuts, None if one plot takes all rows
+        for p, graphs in missing:
+            ed, jc = p._data_request(graphs)
+            for s, exprs in ed.iteritems():
+                expr_data.setdefault(s, {}).update(exprs)
+                if s not in jc:
+                    joined_cuts[s] = None
+                elif joined_cuts.get(s, '') is not None:
+                    joined_cuts[s] = '{} or {}'.format(joined_cuts[s], jc[s]) if s in joined_cuts else jc[s]
+        joined_cuts = dict([(s, c) for s, c in joined_cuts.iteritems() if c is not None])
+        log.debug('reading %d sources for %d plots', len(expr_data), len(missing))
+
+        units = {}
+        sampled = {}
+        with timing.waiting(hdf5_lock):
+            missing[0][0]._get_data(expr_data, joined_cuts, units, sampled)
+
+        for p, graphs in missing:
+            p._assign_data(graphs, expr_data, units, sampled)
+            p._bin_missing(graphs)
+
+    for p in plots:
+        p._computed()
+
+
+
+def export(name, ext):
+    '''save name.ext from the figure persisted by Plot.save(deferred = ...),
+       does nothing if name.ext already exists'''
+    n = name + '.' + ext
+    with lock_file(n + '.lock'):
+        if not path.isfile(n):
+            with open(name + '.fig', 'rb') as f:
+                fig, bbox = pickle.load(f)
+            if isinstance(bbox, Bbox):
+                layout = {'bbox_inches':bbox}
+            else:  # persisted by older versions with the padding
+                layout = {'bbox_inches':'tight', 'pad_inches':bbox}
+            log.debug('saving deferred plot to %s', n)
+            FigureCanvasAgg(fig)
+            with phase('savefig_' + ext):
+                fig.savefig(n, transparent = False, **layout)
+    return n
+
+
 def display_progress(p):
     "display a progressbar on stdout by reading p.progress"
 
@@ -1113,6 +1550,7 @@ n#
 rw#
 rs#
 rc#
+sf#
 x#
 x#b
 o#xerr
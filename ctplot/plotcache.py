@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#    cache of created plots
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# A cache entry consists of the images plotXXX.png/svg/pdf and the metadata
+# record plotXXX.json. XXX is a digest over the settings and the mtime and size
+# of every HDF5 file the plot reads, so changed data never hits old entries.
+# The metadata record is written last, it marks the entry as complete.
+
+import os, re, json, logging
+from os.path import join, isfile
+from time import time
+from utils import digest
+
+log = logging.getLogger('plotcache')
+
+
+def source_versions(settings, datadir):
+    'return dict filename --> [mtime, size] of all HDF5 files referenced by settings'
+    sources = {}
+    for k, v in settings.iteritems():
+        if re.match('^s\\d+$', k) and v:
+            f = v.split(':')[0]
+            try:
+                st = os.stat(join(datadir, f))
+                sources[f] = [st.st_mtime, st.st_size]
+            except OSError:
+                sources[f] = None
+    return sources
+
+
+def entry(settings, datadir, plotdir, prefix = 'plot'):
+    '''return filename (w/o extension) and metadata of the cache entry for
+       settings, other kinds of images of the same settings use another prefix'''
+    sources = source_versions(settings, datadir)
+    name = join(plotdir, prefix + digest(settings, sources)).replace('\\', '/')
+    return name, {'settings':settings, 'sources':sources}
+
+
+def lookup(name, meta):
+    'return dict format --> filename if there is a valid entry, None otherwise'
+    try:
+        with open(name + '.json') as f:
+            stored = json.load(f)
+    except (IOError, ValueError):
+        return None
+
+    if stored['settings'] != meta['settings'] or stored['sources'] != meta['sources']:
+        log.warning('cache entry %s does not match its settings', name)
+        return None
+
+    return dict([(e, name + '.' + e) for e in stored['formats']])
+
+
+def store(name, meta, images):
+    'write the metadata record of the entry containing images'
+    record = dict(meta, formats = sorted(images.keys()), created = time())
+    tmp = '{}.json.{}.tmp'.format(name, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(record, f)
+    os.rename(tmp, name + '.json')
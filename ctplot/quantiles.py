@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#    mergeable quantile sketches
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# A Sketch (KLL, Karnin, Lang and Liberty 2016) keeps the values it is fed in
+# levels, a value in level h stands for 2**h values. When a level exceeds its
+# capacity it is sorted and every other value (starting at random) moves up
+# one level. The capacities shrink by 2/3 per level below the top one, so a
+# sketch holds less than 3k values however many it was fed, and the rank
+# error is about 1.7/k of the count. Sketches of parts of the data can be
+# merged. Until the first compaction the quantiles are exact.
+
+import logging
+import numpy as np
+
+log = logging.getLogger('quantiles')
+
+chunksize = 2 ** 16  # values fed at once
+
+
+class Sketch(object):
+    'quantile sketch of the finite values fed by update(), k sets the accuracy'
+
+    def __init__(self, k = 200, seed = 0):
+        self.k = k
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self.random = np.random.RandomState(seed)  # same data, same plot
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def nbytes(self):
+        return sum([l.nbytes for l in self.levels])
+
+    def capacity(self, h):
+        return max(2, int(np.ceil(self.k * (2 / 3.) ** (len(self.levels) - 1 - h))))
+
+    def update(self, values):
+        'add the finite values to the sketch, return the sketch'
+        v = np.asarray(values, dtype = float).ravel()
+        v = v[np.isfinite(v)]
+        for a in xrange(0, len(v), chunksize):
+            c = v[a:a + chunksize]
+            self.levels[0] = np.concatenate([self.levels[0], c])
+            self.n += len(c)
+            self._compress()
+        return self
+
+    def merge(self, other):
+        'add the values of the sketch other to this one, return this one'
+        for h, l in enumerate(other.levels):
+            if h < len(self.levels):
+                self.levels[h] = np.concatenate([self.levels[h], l])
+            else:
+                self.levels.append(l.copy())
+        self.n += other.n
+        self._compress()
+        return self
+
+    def _compress(self):
+        h = 0
+        while h < len(self.levels):
+            l = self.levels[h]
+            if len(l) > self.capacity(h):
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                l = np.sort(l)
+                odd = l[-1:] if len(l) % 2 else l[:0]  # stays
+                l = l[:len(l) - len(odd)]
+                self.levels[h] = odd
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], l[self.random.randint(2)::2]])
+            h += 1
+
+    def quantile(self, q):
+        '''return the q-quantile (0 <= q <= 1, scalar or array), interpolated
+           between the values as np.percentile does, nan if empty'''
+        if not self.n:
+            return np.nan * np.asarray(q, dtype = float)
+        v = np.concatenate(self.levels)
+        w = np.concatenate([np.ones(len(l)) * 2 ** h for h, l in enumerate(self.levels)])
+        o = np.argsort(v, kind = 'mergesort')
+        v, w = v[o], w[o]
+        c = np.cumsum(w)
+        # value i is at rank c - w, the first of the values it stands for
+        if len(v) == 1:
+            return v[0] * np.ones_like(np.asarray(q, dtype = float))
+        return np.interp(np.asarray(q, dtype = float) * (c[-1] - 1), c - w, v)
+
+
+def binned(x, y, edges, k = 200):
+    '''return list with a Sketch of y in each bin [l, u) of x between edges, x
+       equal to the last edge is outside, as in binstats.profile()'''
+    n = len(edges) - 1
+    b = np.digitize(x, edges) - 1
+    inside = (0 <= b) & (b < n)
+    b, y = b[inside], np.asarray(y, dtype = float)[inside]
+    o = np.argsort(b, kind = 'mergesort')  # the bins, not the values
+    bounds = np.searchsorted(b[o], np.arange(n + 1))
+    return [Sketch(k).update(y[o[bounds[j]:bounds[j + 1]]]) for j in xrange(n)]
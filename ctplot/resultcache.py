@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#    cache of binned plot data
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# The results (histogram contents, edges, profile means, stats, ...) of each
+# graph are cached under a key of the settings that affect the data, see
+# Plot.data_key(). Results are dicts of numpy arrays and plain values, they
+# are kept in an in-process LRU and, if config['resultdir'] is set, on disk.
+
+import os, logging
+import cPickle as pickle
+import numpy as np
+from os.path import join
+from utils import LRU
+import metrics
+
+log = logging.getLogger('resultcache')
+
+_memory = None
+
+def _nbytes(v):
+    'bytes of the arrays (and quantile sketches) in v'
+    if isinstance(v, (list, tuple)):
+        return sum([_nbytes(x) for x in v])
+    return getattr(v, 'nbytes', 0)
+
+
+def sizeof(result):
+    'approximate size of result in bytes'
+    return 1024 + sum([_nbytes(v) for v in result.values()])
+
+
+def memory(config):
+    global _memory
+    if _memory is None:
+        _memory = LRU(config.get('resultcache_mb', 256) * 2 ** 20, sizeof)
+    return _memory
+
+
+def _filename(key, config):
+    return join(config['resultdir'], 'res{}.pickle'.format(key))
+
+
+def get(key, config):
+    'return the cached result for key or None'
+    result = memory(config).get(key)
+    if result is None and config.get('resultdir'):
+        try:
+            with open(_filename(key, config), 'rb') as f:
+                result = pickle.load(f)
+            log.debug('result %s read from disk', key)
+            _remember(key, result, config)
+        except Exception:
+            result = None
+    metrics.cache.inc('result', 'miss' if result is None else 'hit')
+    return result
+
+
+def _remember(key, result, config):
+    evicted = memory(config).put(key, result)
+    if evicted:
+        metrics.cache.add(evicted, 'result', 'eviction')
+
+
+def put(key, result, config):
+    _remember(key, result, config)
+    if config.get('resultdir'):
+        name = _filename(key, config)
+        tmp = '{}.{}.tmp'.format(name, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, name)
+        except Exception:
+            log.exception('failed writing %s', name)
@@ -18,12 +18,20 @@
 
 # This is a TickLocator implementation for matplotlib according to
 # the extended Wilkinson’s Algorithm, see http://vis.stanford.edu/papers/tick-labels
+#
+# The scores of all candidate starts of a labeling are computed at once, the
+# score functions take arrays of lmin, lmax. The locators search again on
+# every draw, so the results of wilk_ext() are memoized.
 
 from matplotlib.ticker import Locator
 from matplotlib.axis import XAxis
 from matplotlib import pyplot
 import math
 import numpy
+from utils import LRU
+import metrics
+
+_memo = LRU(1024)  # (dmin, dmax, m, only_inside, Q, w) --> result of wilk_ext()
 
 
 def coverage(dmin, dmax, lmin, lmax):
@@ -38,8 +46,8 @@ def coverage_max(dmin, dmax, span):
 
 def density(k, m, dmin, dmax, lmin, lmax):
     r = (k - 1.) / (lmax - lmin)
-    rt = (m - 1.) / (max(lmax, dmax) - min(lmin, dmin))
-    return 2. - max(r / rt, rt / r)
+    rt = (m - 1.) / (numpy.maximum(lmax, dmax) - numpy.minimum(lmin, dmin))
+    return 2. - numpy.maximum(r / rt, rt / r)
 
 def density_max(k, m):
     if k >= m:
@@ -52,12 +60,7 @@ def simplicity(q, Q, j, lmin, lmax, lstep):
     eps = 1e-10
     n = len(Q)
     i = Q.index(q) + 1
-    v = 0
-    if ((lmin % lstep) < eps) or ((((lstep - lmin) % lstep) < eps) and (lmin <= 0) and (lmax >= 0)):
-        v = 1
-    else:
-        v = 0
-
+    v = ((lmin % lstep) < eps) | ((((lstep - lmin) % lstep) < eps) & (lmin <= 0) & (lmax >= 0))
     return (n - i) / (n - 1.0) + v - j
 
 def simplicity_max(q, Q, j):
@@ -75,7 +78,20 @@ def score(weights, simplicity, coverage, density, legibility):
 def wilk_ext(dmin, dmax, m, only_inside = 0,
              Q = [1, 5, 2, 2.5, 4, 3],
              w = [0.2, 0.25, 0.5, 0.05]):
+    '''return (lmin, lmax, lstep, j, q, k, score) of the best labeling of
+       dmin, dmax with about m ticks, memoized'''
+    key = (dmin, dmax, m, only_inside, tuple(Q), tuple(w))
+    result = _memo.get(key)
+    metrics.cache.inc('ticks', 'miss' if result is None else 'hit')
+    if result is None:
+        result = search(dmin, dmax, m, only_inside, Q, w)
+        _memo.put(key, result)
+    return result
 
+def search(dmin, dmax, m, only_inside = 0,
+           Q = [1, 5, 2, 2.5, 4, 3],
+           w = [0.2, 0.25, 0.5, 0.05]):
+    'search the labeling returned by wilk_ext()'
     if (dmin >= dmax) or (m < 1):
         return (dmin, dmax, dmax - dmin, 1, 0, 2, 0)
 
@@ -116,23 +132,27 @@ def wilk_ext(dmin, dmax, m, only_inside = 0,
                         z += 1
                         break
 
-                    for start in numpy.arange(min_start, max_start + 1):
-                        lmin = start * (step / j)
-                        lmax = lmin + step * (k - 1.0)
-                        lstep = step
-
-                        s = simplicity(q, Q, j, lmin, lmax, lstep)
-                        c = coverage(dmin, dmax, lmin, lmax)
-                        d = density(k, m, dmin, dmax, lmin, lmax)
-                        l = legibility(lmin, lmax, lstep)
-                        scr = score(w, s, c, d, l)
-
-                        if (scr > best_score) and \
-                           ((only_inside <= 0) or ((lmin >= dmin) and (lmax <= dmax))) and \
-                           ((only_inside >= 0) or ((lmin <= dmin) and (lmax >= dmax))):
-                            best_score = scr
-                            # print "s: %5.2f c: %5.2f d: %5.2f l: %5.2f" % (s,c,d,l)
-                            result = (lmin, lmax, lstep, j, q, k, scr)
+                    # all starts at once
+                    start = numpy.arange(min_start, max_start + 1)
+                    lmin = start * (step / j)
+                    lmax = lmin + step * (k - 1.0)
+                    lstep = step
+
+                    s = simplicity(q, Q, j, lmin, lmax, lstep)
+                    c = coverage(dmin, dmax, lmin, lmax)
+                    d = density(k, m, dmin, dmax, lmin, lmax)
+                    l = legibility(lmin, lmax, lstep)
+                    scr = score(w, s, c, d, l)
+
+                    better = scr > best_score
+                    if only_inside > 0:
+                        better &= (lmin >= dmin) & (lmax <= dmax)
+                    if only_inside < 0:
+                        better &= (lmin <= dmin) & (lmax >= dmax)
+                    if better.any():
+                        b = numpy.flatnonzero(better)[numpy.argmax(scr[better])]  # first of the best, as the loop did
+                        best_score = float(scr[b])
+                        result = (lmin[b], lmax[b], lstep, j, q, k, best_score)
 
                     z += 1
                 # end of z-while-loop
@@ -206,8 +226,8 @@ class ExtendedWilkinsonTickLocator(Locator):
 
         return get_ticks(vmin, vmax, nticks, only_inside = self.only_inside, Q = self.Q, w = self.w)
 
-def set_extended_locator(density = 1, per_inch = True, **kwargs):
-    'set the ExtendedWilkinsonTickLocator on current x- and y-axis'
-    ca = pyplot.gca()
+def set_extended_locator(density = 1, per_inch = True, ax = None, **kwargs):
+    'set the ExtendedWilkinsonTickLocator on x- and y-axis of ax (default: current axes)'
+    ca = ax or pyplot.gca()
     ca.xaxis.set_major_locator(ExtendedWilkinsonTickLocator(target_density = density, per_inch = per_inch, **kwargs))
     ca.yaxis.set_major_locator(ExtendedWilkinsonTickLocator(target_density = density, per_inch = per_inch, **kwargs))
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+#    min/max/mean tiles of time series for zooming on the client
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# The x range of a series is split into 2**level tiles at zoom level level,
+# a tile holds min, max, mean and count of y in each of its tilesize buckets.
+# The series is read like the xy plot of the same settings (using the averaged
+# cache if rw is set) and kept sorted by x in the result cache. Tiles are
+# cached as JSON in cachedir/tiles, keyed by the data key of the series.
+
+import os, json, logging
+import numpy as np
+from os.path import join
+from utils import digest
+import resultcache
+
+log = logging.getLogger('tiles')
+
+tilesize = 256  # buckets per tile
+maxlevel = 30
+
+# tile request fields --> plot settings of the series
+fields = {'s':'s0', 'x':'x0', 'y':'y0', 'c':'c0', 'rw':'rw0', 'rs':'rs0', 'rc':'rc0'}
+
+
+def settings(request):
+    'return the settings of the xy plot of the series requested by the dict request'
+    s = {'m0':'xy', 'x0':'time', 'plots':'1', 'experiment0':'tiles'}
+    for k, v in request.iteritems():
+        if k in fields and v:
+            s[fields[k]] = v
+    return s
+
+
+def series(p):
+    '''return the x, y of the computed xy plot p sorted by x, points that are not
+       finite are dropped'''
+    key = digest('tiles', p.data_key(0))
+    s = resultcache.get(key, p.config)
+    if s is None:
+        r = p.results[0]
+        x, y = r['x'], r['y']
+        if x is None:
+            x = np.arange(len(y), dtype = float)
+        m = np.isfinite(x) & np.isfinite(y)
+        x, y = x[m], y[m]
+        o = np.argsort(x, kind = 'mergesort')
+        s = {'x':x[o], 'y':y[o]}
+        resultcache.put(key, s, p.config)
+    return s['x'], s['y']
+
+
+def aggregate(x, y, a, b, n = tilesize):
+    '''return count, min, max and mean of y in n equal buckets of [a, b), x must
+       be sorted, empty buckets have nan as min, max and mean'''
+    lo, hi = np.searchsorted(x, [a, b])
+    xs, ys = x[lo:hi], y[lo:hi]
+    k = ((xs - a) * (n / (b - a))).astype(int)
+    np.clip(k, 0, n - 1, out = k)
+
+    count = np.bincount(k, minlength = n)
+    mean = np.bincount(k, weights = ys, minlength = n) / np.maximum(count, 1)
+    mn, mx = np.empty(n) * np.nan, np.empty(n) * np.nan
+    full = np.nonzero(count)[0]
+    if len(full):
+        # k is sorted, so each bucket is a contiguous slice of ys
+        starts = np.searchsorted(k, full)
+        mn[full] = np.minimum.reduceat(ys, starts)
+        mx[full] = np.maximum.reduceat(ys, starts)
+    mean[count == 0] = np.nan
+    return count, mn, mx, mean
+
+
+def _json(a):
+    return [None if not np.isfinite(v) else float(v) for v in a]
+
+
+def tile(p, level, index):
+    '''return dict with the extent of the series, the x range of the tile and
+       the bucket centers, count, min, max and mean of tile index at level'''
+    level, index = int(level), int(index)
+    if not 0 <= level <= maxlevel or not 0 <= index < 2 ** level:
+        raise ValueError('no tile {} at level {}'.format(index, level))
+
+    x, y = series(p)
+    if len(x) == 0:
+        raise ValueError('no data')
+    x0, x1 = float(x[0]), float(x[-1])
+    x1 = np.nextafter(x1, np.inf)  # last point belongs to the last tile
+    width = (x1 - x0) / 2 ** level
+    a, b = x0 + index * width, x0 + (index + 1) * width
+
+    count, mn, mx, mean = aggregate(x, y, a, b)
+    centers = a + (np.arange(tilesize) + 0.5) * (b - a) / tilesize
+    return {'extent':[x0, x1], 'level':level, 'tile':index, 'range':[a, b],
+            'x':_json(centers), 'count':count.tolist(), 'min':_json(mn),
+            'max':_json(mx), 'mean':_json(mean), 'units':p.results[0]['units']}
+
+
+def _filename(p, level, index, config):
+    return join(config['cachedir'], 'tiles', 'tile{}.json'.format(digest(p.data_key(0), int(level), int(index), tilesize)))
+
+
+def load(p, level, index, config):
+    'return the tile of plot p (not yet computed) from the disk cache or None'
+    if not config['cachedir']:
+        return None
+    try:
+        with open(_filename(p, level, index, config)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def store(p, level, index, t, config):
+    'write tile t of plot p to the disk cache'
+    if not config['cachedir']:
+        return
+    name = _filename(p, level, index, config)
+    if not os.path.isdir(os.path.dirname(name)):
+        os.makedirs(os.path.dirname(name))
+    tmp = '{}.{}.tmp'.format(name, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(t, f)
+    os.rename(tmp, name)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#    wall and cpu time of the phases of a request and its HDF5 reads
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Code that is part of a phase runs in `with phase('name'):`, its time is
+# added to the request() running in the same thread, if any. The time of
+# nested phases is not added to the enclosing phase, so the phases add up to
+# the time of the request. Python 2 has no per thread cpu clock, the cpu time
+# is that of the process and includes other threads busy at the same time.
+# HDF5 reads are counted per file by count_open() and count_read().
+
+import os, time, json, logging
+from threading import local
+from collections import OrderedDict
+import metrics
+
+log = logging.getLogger('timing')
+
+_local = local()
+
+phase_seconds = metrics.Histogram('ctplot_phase_seconds', 'wall time of request phases in seconds', ['phase'])
+phase_cpu_seconds = metrics.Counter('ctplot_phase_cpu_seconds_total', 'cpu time of request phases in seconds', ['phase'])
+hdf5 = metrics.Counter('ctplot_hdf5_total', 'HDF5 files opened, rows scanned and kept after cuts, bytes and chunks read', ['counter'])
+
+
+def _now():
+    t = os.times()
+    return time.time(), t[0] + t[1]
+
+
+def current():
+    'return the request timed in this thread or None'
+    return getattr(_local, 'request', None)
+
+
+
+class request(object):
+    '''context timing the phases of a request in this thread, when done the
+       breakdown is logged as one JSON line and added to the metrics'''
+
+    def __init__(self, name):
+        self.name = name
+        self.phases = OrderedDict()  # name --> [wall, cpu, count]
+        self.stack = []  # running phases
+        self.io = OrderedDict()  # filename --> OrderedDict counter --> value
+        self.wall = self.cpu = None
+
+    def __enter__(self):
+        self.outer = current()
+        _local.request = self
+        self.start = _now()
+        return self
+
+    def __exit__(self, *args):
+        _local.request = self.outer
+        wall, cpu = _now()
+        self.wall, self.cpu = wall - self.start[0], cpu - self.start[1]
+        for k, (w, c, n) in self.phases.iteritems():
+            phase_seconds.observe(w, k)
+            phase_cpu_seconds.add(c, k)
+        log.info('timing %s', json.dumps(self.report()))
+
+    def add(self, name, wall, cpu):
+        p = self.phases.setdefault(name, [0, 0, 0])
+        p[0] += wall
+        p[1] += cpu
+        p[2] += 1
+
+    def count(self, filename, counter, value):
+        c = self.io.setdefault(filename, OrderedDict())
+        c[counter] = c.get(counter, 0) + value
+
+    def report(self):
+        'return dict with wall and cpu time of the request and its phases and the HDF5 reads per file'
+        r = lambda t: round(t, 6) if t is not None else None
+        return {'request':self.name, 'wall':r(self.wall), 'cpu':r(self.cpu),
+                'phases':OrderedDict([(k, {'wall':r(w), 'cpu':r(c), 'count':n})
+                                      for k, (w, c, n) in self.phases.iteritems()]),
+                'io':self.io}
+
+
+
+def count(filename, counter, value):
+    'add value to counter of filename in the current request and the metrics'
+    hdf5.add(value, counter)
+    r = current()
+    if r is not None:
+        r.count(filename, counter, value)
+
+
+def count_open(filename):
+    'count opening HDF5 file filename'
+    count(filename, 'files_opened', 1)
+
+
+def count_read(filename, table, rows, kept = None):
+    '''count reading rows of table (a pytables Table) in filename, kept is
+       the number of rows left after cuts'''
+    count(filename, 'rows_scanned', rows)
+    if kept is not None:
+        count(filename, 'rows_kept', kept)
+    count(filename, 'bytes_read', rows * table.rowsize)
+    chunkrows = table.chunkshape[0] if table.chunkshape else 0
+    if chunkrows and rows:
+        count(filename, 'chunks_read', (rows + chunkrows - 1) // chunkrows)
+
+
+
+class phase(object):
+    'context adding its time to phase name of the current request'
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.request = current()
+        if self.request is not None:
+            self.nested = [0, 0]  # time of nested phases
+            self.request.stack.append(self)
+            self.start = _now()
+        return self
+
+    def __exit__(self, *args):
+        r = self.request
+        if r is None:
+            return
+        wall, cpu = _now()
+        wall, cpu = wall - self.start[0], cpu - self.start[1]
+        r.stack.pop()
+        if r.stack:
+            r.stack[-1].nested[0] += wall
+            r.stack[-1].nested[1] += cpu
+        r.add(self.name, wall - self.nested[0], cpu - self.nested[1])
+
+
+
+class waiting(object):
+    'context entering ctx (e.g. a lock), the wait is timed as phase name'
+
+    def __init__(self, ctx, name = 'queue'):
+        self.ctx = ctx
+        self.name = name
+
+    def __enter__(self):
+        with phase(self.name):
+            return self.ctx.__enter__()
+
+    def __exit__(self, *args):
+        return self.ctx.__exit__(*args)
@@ -16,7 +16,7 @@
 #    You should have received a copy of the GNU General Public License
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
-import pytz, json, time, re, os
+import pytz, json, time, re, os, hashlib
 import dateutil.parser as dp
 import datetime as dt
 from datetime import timedelta
@@ -24,6 +24,12 @@ import safeeval
 from math import  floor, log10
 import numpy as np
 import subprocess
+from collections import OrderedDict
+from threading import Lock, Thread
+
+# PyTables is not thread safe, only one thread of the process uses it at a
+# time (reading plot data, scanning the catalog), drawing is done concurrently
+hdf5_lock = Lock()
 
 class AttrDict(dict):
     __getattr__ = dict.__getitem__
@@ -166,6 +172,52 @@ def hashargs(*args, **kwargs):
     return hash(json.dumps((args, kwargs), separators = (',', ':'), sort_keys = True))
 
 
+def digest(*args, **kwargs):
+    'stable hash of the arguments, same across processes and platforms'
+    return hashlib.sha1(json.dumps((args, kwargs), separators = (',', ':'), sort_keys = True)).hexdigest()
+
+
+class LRU(object):
+    '''thread safe least recently used cache, holding items up to a total
+       size of maxsize, the size of an item is given by sizeof'''
+
+    def __init__(self, maxsize = 100, sizeof = lambda value: 1):
+        self.maxsize = maxsize
+        self.sizeof = sizeof
+        self.size = 0
+        self.items = OrderedDict()  # key --> (value, size)
+        self.lock = Lock()
+
+    def get(self, key, default = None):
+        with self.lock:
+            try:
+                item = self.items.pop(key)
+            except KeyError:
+                return default
+            self.items[key] = item  # most recently used is last
+            return item[0]
+
+    def put(self, key, value):
+        'add value, return the number of evicted items'
+        size = self.sizeof(value)
+        evicted = 0
+        with self.lock:
+            if key in self.items:
+                self.size -= self.items.pop(key)[1]
+            self.items[key] = value, size
+            self.size += size
+            while self.size > self.maxsize and len(self.items) > 1:
+                self.size -= self.items.popitem(last = False)[1][1]
+                evicted += 1
+        return evicted
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+
 def noop(*args, **kwargs):
     pass
 
@@ -178,13 +230,17 @@ def getStatCpu():
                 cpu = map(int, line.split()[1:])
                 return cpu
 
+def getCpuUsageBetween(c1, c2):
+    'cpu usage between the samples c1 and c2 returned by getStatCpu'
+    t = sum(c2) - sum(c1)
+    d = map(lambda x: float(x[1] - x[0]) / t if t else 0.0, zip(c1, c2))
+    return dict(zip(['user', 'nice', 'system', 'idle', 'iowait', 'irq', 'softirq'], d))
+
 def getCpuUsage():
     c1 = getStatCpu()
     time.sleep(1)
     c2 = getStatCpu()
-    t = sum(c2) - sum(c1)
-    d = map(lambda x: float(x[1] - x[0]) / t, zip(c1, c2))
-    return dict(zip(['user', 'nice', 'system', 'idle', 'iowait', 'irq', 'softirq'], d))
+    return getCpuUsageBetween(c1, c2)
 
 
 def getCpuLoad():
@@ -195,6 +251,28 @@ def getCpuLoad():
     else:
         return 0
 
+class LoadSampler(object):
+    '''samples the cpu load (like getCpuLoad) every interval seconds in a
+       background thread, reading the load attribute never blocks'''
+
+    def __init__(self, interval = 1):
+        self.interval = interval
+        self.load = 0
+        if os.name == 'posix':
+            t = Thread(target = self._run)
+            t.daemon = True
+            t.start()
+
+    def _run(self):
+        c1 = getStatCpu()
+        while True:
+            time.sleep(self.interval)
+            c2 = getStatCpu()
+            usage = getCpuUsageBetween(c1, c2)
+            del usage['idle']
+            self.load = sum(usage.values())
+            c1 = c2
+
 def getRunning(name):
     if os.name == 'posix':
         p = subprocess.Popen(['ps', 'auxr'], stdout = subprocess.PIPE)
@@ -24,6 +24,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
         scrollOffset = -40,
         templatePlot,
         xhr,
+        previewXhr,
         tablesAndVars = null;
 
     /** ajax default settings */
@@ -757,6 +758,9 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
             try {
                 xhr.abort();
             } catch (e) {}
+            try {
+                previewXhr.abort();
+            } catch (e) {}
 
             transformMinMaxFields();
 
@@ -777,145 +781,165 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
             // scroll to plot section
             $('nav a[href="#output"]').click();
 
-            // perform ajax request to get the plot (created on server)
-            xhr = $.ajax({
-                data : query,
+            // request a quick preview from a sample of the data along with the
+            // plot, it is shown until the plot is ready
+            var plotDone = false;
+            previewXhr = $.ajax({
+                data : query.replace(/a=plot/, 'a=preview'),
                 success : function(data) {
-                    if (data.errors) {
-                        var errors = data.errors,
-                            errorBox = $('<div class="errorbox">'),
-                            errorList = $('<ul>');
-
-                        if (errors.global.length > 0) {
-                            errorBox.html('<h3>An error appeared:</h3>');
-                            $.each(errors.global, function(_, msg) {
-                                errorList.append('<li>' + msg + '</li>');
-                            });
-                            errorBox.append(errorList);
-                        }
-
-                        if (errors.diagrams) {
-                            $.each(errors.diagrams, function(dataset, dsErrors) {
-                                if (dsErrors.length < 1)
-                                    return;
-
-                                var dataset = parseInt(dataset) + 1,
-                                    heading = $('<h3>Error in the ' + dataset + '. Dataset:</h3>');
+                    if (plotDone || data.final || data.errors || !data.png)
+                        return;
+                    result.find('#previewImage').remove();
+                    $('<img>').attr('src', data.png).attr('alt', 'preview')
+                        .attr('id', 'previewImage').prependTo(result);
+                }
+            });
+            requestPlot();
 
+            // perform ajax request to get the plot (created on server)
+            function requestPlot() {
+                xhr = $.ajax({
+                    data : query,
+                    complete : function() {
+                        plotDone = true;
+                    },
+                    success : function(data) {
+                        if (data.errors) {
+                            var errors = data.errors,
+                                errorBox = $('<div class="errorbox">'),
                                 errorList = $('<ul>');
-                                $.each(dsErrors, function(_, msg) {
+
+                            if (errors.global.length > 0) {
+                                errorBox.html('<h3>An error appeared:</h3>');
+                                $.each(errors.global, function(_, msg) {
                                     errorList.append('<li>' + msg + '</li>');
                                 });
-                                errorBox.append(heading).append(errorList);
-                            });
+                                errorBox.append(errorList);
+                            }
+
+                            if (errors.diagrams) {
+                                $.each(errors.diagrams, function(dataset, dsErrors) {
+                                    if (dsErrors.length < 1)
+                                        return;
+
+                                    var dataset = parseInt(dataset) + 1,
+                                        heading = $('<h3>Error in the ' + dataset + '. Dataset:</h3>');
+
+                                    errorList = $('<ul>');
+                                    $.each(dsErrors, function(_, msg) {
+                                        errorList.append('<li>' + msg + '</li>');
+                                    });
+                                    errorBox.append(heading).append(errorList);
+                                });
+                            }
+
+                            $('#result').empty();
+                            $('#error').html(errorBox);
+                            // scroll to plot section
+                            $('nav a[href="#output"]').click();
+                            return;
                         }
 
+                        var saveButton, p, container, 
+                            left, right, 
+                            list, el,
+                            img = data.png,
+                            jsonSettings,
+                            plotUrl;
+
+                        result.empty();
+
+                        /* add query string to prevent browser
+                         * from showing cached image */
+                        $('<img>').attr('src', img + '?t=' + new Date().getTime())
+                            .attr('alt', query).attr('id', 'plotImage').appendTo(result);
+
+                        /* container for saveButton and image links */
+                        container = $('<fieldset class="actions">').appendTo(result);
+                        $('<legend>Diagram</legend>').appendTo(container);
+                        left = $('<div class="left">').appendTo(container);
+                        left.append('Save Diagram as:');
+                        right = $('<div class="right">').appendTo(container);
+                        list = $('<ul id="downloadButtons">').appendTo(left);
+                        el = $('<li>').appendTo(list);
+
+                        // links to pdf, png and svg
+                        $('<a>').attr('href', data.pdf)
+                            .addClass('btn')
+                            .attr('target', '_blank')
+                            .text(' PDF')
+                            .prepend('<i class="fa fa-file-pdf-o"></i>')
+                            .appendTo(el);
+                        el = $('<li>').appendTo(list);
+                        $('<a>').attr('href', data.svg)
+                            .addClass('btn')
+                            .attr('target', '_blank')
+                            .text(' SVG')
+                            .prepend('<i class="fa fa-file-text-o"></i>')
+                            .appendTo(el);
+                        el = $('<li>').appendTo(list);
+                        $('<a>').attr('href', data.png)
+                            .addClass('btn')
+                            .attr('target', '_blank')
+                            .text(' PNG')
+                            .prepend('<i class="fa fa-file-image-o"></i>')
+                            .appendTo(el);
+
+                        // save plot button
+                        saveButton = $('<button>').attr('type', 'button')
+                            .addClass('btn')
+                            .attr('title', 'Add to saved Diagrams')
+                            .attr('id', 'savePlotButton')
+                            .text(' Add to saved Diagrams')
+                            .prepend('<i class="fa fa-save"></i>');
+                    
+                        saveButton.click(function () {
+                            addPlotToSaved(settings);
+                            $(this).hide(speed);
+                            savePlots();
+                            checkSavedPlotsAvail();
+                            $('nav a[href="#saved"]').click();
+                        }).appendTo(right);
+
+                        // $('<img>').attr('src', 'img/disk.png').prependTo(saveButton);
+
+                        // plot settings
+                        container.append('<h2>Settings of these Diagrams</h2>');
+                        container.append('<p>To import this Diagram into another Session, store the following Settings and load it into <a class="scrollto" href="#loadsettings">The other Session</a>.</p>');
+                        jsonSettings = JSON.stringify(settings);
+                        p = $('<p>').appendTo(container);
+                        $('<textarea id="plotsettings">').text(jsonSettings).appendTo(p);
+
+                        // plot url
+                        container.append('<h2>Include this Diagram into a Website</h2>');
+                        container.append('<p>The following HTML-Code can be used to include the Diagram into a Website.</p>');
+                        // strip stuff like /index.html from current url and append plot url
+                        var currentUrl = window.location.href;
+                        plotUrl = currentUrl.substr(0, currentUrl.lastIndexOf('/')) + '/plot?' + query.replace(/a=plot/, 'a=png');
+
+                        p = $('<p>').appendTo(container);
+                        $('<textarea id="ploturl">').text('<img src="' + plotUrl + '" />').appendTo(p);
+
+                        // store settings in cookie, with the image urls only
+                        $.extend(settings, { png: data.png, svg: data.svg, pdf: data.pdf });
+
+                        // append plot image urls to
+                        settings['url'] = plotUrl;
+
+                        // scroll to plot section
+                        $('nav a[href="#output"]').click();
+                    },
+                    error : function(xhr, text, error) {
+                        var errorbox = $('<div class="errorbox">');
+                        errorbox.html('<p>An undefined Error appeared. Check the input Settings and try it again.</p>');
+
                         $('#result').empty();
-                        $('#error').html(errorBox);
+                        $('#error').html(errorbox);
                         // scroll to plot section
                         $('nav a[href="#output"]').click();
-                        return;
                     }
-
-                    var saveButton, p, container, 
-                        left, right, 
-                        list, el,
-                        img = data.png,
-                        jsonSettings,
-                        plotUrl;
-
-                    result.empty();
-
-                    /* add query string to prevent browser
-                     * from showing cached image */
-                    $('<img>').attr('src', img + '?t=' + new Date().getTime())
-                        .attr('alt', query).attr('id', 'plotImage').appendTo(result);
-
-                    /* container for saveButton and image links */
-                    container = $('<fieldset class="actions">').appendTo(result);
-                    $('<legend>Diagram</legend>').appendTo(container);
-                    left = $('<div class="left">').appendTo(container);
-                    left.append('Save Diagram as:');
-                    right = $('<div class="right">').appendTo(container);
-                    list = $('<ul id="downloadButtons">').appendTo(left);
-                    el = $('<li>').appendTo(list);
-
-                    // links to pdf, png and svg
-                    $('<a>').attr('href', data.pdf)
-                        .addClass('btn')
-                        .attr('target', '_blank')
-                        .text(' PDF')
-                        .prepend('<i class="fa fa-file-pdf-o"></i>')
-                        .appendTo(el);
-                    el = $('<li>').appendTo(list);
-                    $('<a>').attr('href', data.svg)
-                        .addClass('btn')
-                        .attr('target', '_blank')
-                        .text(' SVG')
-                        .prepend('<i class="fa fa-file-text-o"></i>')
-                        .appendTo(el);
-                    el = $('<li>').appendTo(list);
-                    $('<a>').attr('href', data.png)
-                        .addClass('btn')
-                        .attr('target', '_blank')
-                        .text(' PNG')
-                        .prepend('<i class="fa fa-file-image-o"></i>')
-                        .appendTo(el);
-
-                    // save plot button
-                    saveButton = $('<button>').attr('type', 'button')
-                        .addClass('btn')
-                        .attr('title', 'Add to saved Diagrams')
-                        .attr('id', 'savePlotButton')
-                        .text(' Add to saved Diagrams')
-                        .prepend('<i class="fa fa-save"></i>');
-                    
-                    saveButton.click(function () {
-                        addPlotToSaved(settings);
-                        $(this).hide(speed);
-                        savePlots();
-                        checkSavedPlotsAvail();
-                        $('nav a[href="#saved"]').click();
-                    }).appendTo(right);
-
-                    // $('<img>').attr('src', 'img/disk.png').prependTo(saveButton);
-
-                    // plot settings
-                    container.append('<h2>Settings of these Diagrams</h2>');
-                    container.append('<p>To import this Diagram into another Session, store the following Settings and load it into <a class="scrollto" href="#loadsettings">The other Session</a>.</p>');
-                    jsonSettings = JSON.stringify(settings);
-                    p = $('<p>').appendTo(container);
-                    $('<textarea id="plotsettings">').text(jsonSettings).appendTo(p);
-
-                    // plot url
-                    container.append('<h2>Include this Diagram into a Website</h2>');
-                    container.append('<p>The following HTML-Code can be used to include the Diagram into a Website.</p>');
-                    // strip stuff like /index.html from current url and append plot url
-                    var currentUrl = window.location.href;
-                    plotUrl = currentUrl.substr(0, currentUrl.lastIndexOf('/')) + '/plot?' + query.replace(/a=plot/, 'a=png');
-
-                    p = $('<p>').appendTo(container);
-                    $('<textarea id="ploturl">').text('<img src="' + plotUrl + '" />').appendTo(p);
-
-                    // store settings in cookie
-                    $.extend(settings, data);
-
-                    // append plot image urls to
-                    settings['url'] = plotUrl;
-
-                    // scroll to plot section
-                    $('nav a[href="#output"]').click();
-                },
-                error : function(xhr, text, error) {
-                    var errorbox = $('<div class="errorbox">');
-                    errorbox.html('<p>An undefined Error appeared. Check the input Settings and try it again.</p>');
-
-                    $('#result').empty();
-                    $('#error').html(errorbox);
-                    // scroll to plot section
-                    $('nav a[href="#output"]').click();
-                }
-            });
+                });
+            }
 
             return false;
         });
@@ -1,20 +1,357 @@
 #!/usr/bin/env python
 
-import os
-from tornado.wsgi import WSGIContainer
+import os, json, logging, signal, errno, time
+from concurrent.futures import ThreadPoolExecutor
+from tornado import gen
+from tornado.web import Application, RequestHandler
 from tornado.httpserver import HTTPServer
 from tornado.ioloop import IOLoop
-from ctplot.wsgi import application
+from tornado.netutil import bind_sockets
+from tornado.process import cpu_count
+from ctplot import wsgi, metrics, dataexport
+from ctplot.wsgi import get_config, content_type, cc_cache, cc_nocache
+from ctplot.i18n import _
+
+log = logging.getLogger('webserver')
+
+# long running plot creation is done by these threads,
+# static content, sessions and the table list are served on the IOLoop
+executor = ThreadPoolExecutor(int(os.environ.get('CTPLOT_THREADS', 4)))
+
+# plots currently being created, requests with the same canonical settings share one job
+_pending = {}
+
+metrics.Gauge('ctplot_pending_plots', 'number of plots queued for or being created by the executor', func = lambda: len(_pending))
+
+def run_plot(settings, config):
+    '''return future of the plot images and errors, cached plots are returned
+       at once, otherwise raises ServerBusy if there are already maxqueue (if
+       set) plots pending or the cpu load is too high'''
+    urls = wsgi.cached_images(settings, config)
+    if urls is not None:
+        return gen.maybe_future([urls, None, None])
+
+    key = wsgi.plot_name(settings, config)
+    if key not in _pending:
+        maxqueue = config['maxqueue']
+        if (maxqueue and len(_pending) >= maxqueue) or wsgi.overloaded(config):
+            raise wsgi.ServerBusy()
+        future = _pending[key] = executor.submit(wsgi.plot_images, settings, config)
+        IOLoop.current().add_future(future, lambda f: _pending.pop(key, None))
+    return _pending[key]
+
+
+def plot_file(path, config):
+    'return future of the plot image filename, only missing images are created in the executor'
+    name = os.path.join(config['plotdir'], os.path.basename(path))
+    if os.path.isfile(name):
+        return gen.maybe_future(name)
+    return executor.submit(wsgi.plot_file, path, config)
+
+
+
+class BaseHandler(RequestHandler):
+    active = 0  # number of requests in progress
+    action = 'static'  # metrics label
+
+    def initialize(self, config):
+        self.config = config
+        BaseHandler.active += 1
+        self.metrics = metrics.request(self.action)
+        self.metrics.start()
+
+    def on_finish(self):
+        BaseHandler.active -= 1
+        self.metrics.stop()
+
+    def send(self, data, ctype = content_type(), cache = False):
+        self.set_header(*ctype)
+        self.set_header(*(cc_cache if cache else cc_nocache))
+        self.metrics.bytes += len(data)
+        self.finish(data)
+
+    def send_json(self, data):
+        self.send(json.dumps(data))
+
+    def send_busy(self):
+        self.set_status(503)
+        self.set_header('Retry-After', str(int(self.config['retry_after'])))
+        self.send(_('server busy, try again later'))
+
+    def send_file(self, name):
+        with open(name, 'rb') as f:
+            self.send(f.read(), content_type(name), True)
+
+
+
+class StaticHandler(BaseHandler):
+    def get(self, path):
+        status, ctype, body = wsgi.get_static(path)
+        self.set_status(int(status[:3]))
+        self.send(''.join(body), ctype, status.startswith('200'))
+
+
+
+class PlotFileHandler(BaseHandler):
+    action = 'plots'
+
+    @gen.coroutine
+    def get(self, path):
+        name = yield plot_file(path, self.config)
+        self.send_file(name)
+
+
+
+class ActionHandler(BaseHandler):
+    'same actions as wsgi.handle_action'
+
+    @gen.coroutine
+    def post(self):
+        fields = dict([(k, v[0]) for k, v in self.request.arguments.iteritems()])
+        action = fields.get('a')
+        self.metrics.action = action if action in wsgi.actions else 'unknown'
+
+        if action in ['plot', 'png', 'svg', 'pdf']:
+            settings = wsgi.get_settings(fields)
+            try:
+                images, errors, report = yield run_plot(settings, self.config)
+            except wsgi.ServerBusy:
+                self.send_busy()
+                return
+
+            if errors:
+                self.send_json({ 'errors': errors })
+
+            elif action == 'plot':
+                self.send_json(dict(images, timing = report) if report else images)
+
+            else:
+                name = yield plot_file(images[action], self.config)
+                self.send_file(name)
+
+        elif action == 'preview':
+            settings = wsgi.get_settings(fields)
+            try:
+                if wsgi.overloaded(self.config):
+                    raise wsgi.ServerBusy()
+                images, errors = yield executor.submit(wsgi.preview_images, settings, self.config)
+            except wsgi.ServerBusy:
+                self.send_busy()
+                return
+            self.send_json({ 'errors': errors } if errors else images)
+
+        elif action == 'batch':
+            fields_list, errors = wsgi.batch_fields(fields.get('settings'), self.config)
+            if errors:
+                self.send_json({ 'errors': errors })
+                return
+            try:
+                if wsgi.overloaded(self.config):
+                    raise wsgi.ServerBusy()
+                urls = yield executor.submit(wsgi.batch_images, fields_list, self.config)
+            except wsgi.ServerBusy:
+                self.send_busy()
+                return
+            self.send_json(urls)
+
+        elif action == 'data':
+            settings = wsgi.get_settings(fields)
+            fmt = fields.get('format', 'json')
+            if fmt not in dataexport.formats:
+                self.send_json({ 'errors': wsgi.format_errors(fmt) })
+                return
+            try:
+                if wsgi.overloaded(self.config):
+                    raise wsgi.ServerBusy()
+                p, errors = yield executor.submit(wsgi.compute_data, settings, self.config)
+            except wsgi.ServerBusy:
+                self.send_busy()
+                return
+
+            if errors:
+                self.send_json({ 'errors': errors })
+            else:
+                # serializing (and fitting) is done by the executor, chunk by chunk
+                ctype, body = yield executor.submit(dataexport.export, p, fmt)
+                body = iter(body)
+                self.set_header('Content-Type', ctype)
+                self.set_header(*cc_nocache)
+                self.set_header('Content-Disposition', 'attachment; filename=data.' + fmt)
+                while True:
+                    chunk = yield executor.submit(next, body, None)
+                    if chunk is None:
+                        break
+                    self.metrics.bytes += len(chunk)
+                    self.write(chunk)
+                    yield self.flush()
+                self.finish()
+
+        elif action == 'tile':
+            try:
+                if wsgi.overloaded(self.config):
+                    raise wsgi.ServerBusy()
+                t, errors = yield executor.submit(wsgi.tile_data, fields, self.config)
+            except wsgi.ServerBusy:
+                self.send_busy()
+                return
+            self.send_json({ 'errors': errors } if errors else t)
+
+        elif action == 'list':
+            if wsgi.catalog_current():
+                self.send_json(wsgi.get_tables(self.config))
+            else:  # the HDF5 files are scanned by the executor
+                tables = yield executor.submit(wsgi.get_tables, self.config)
+                self.send_json(tables)
+
+        elif action == 'refresh':
+            message = yield executor.submit(wsgi.refresh_catalog, self.config)
+            self.send_json(message)
+
+        elif action == 'save':
+            id = fields.get('id')
+            wsgi.save_session(id, fields.get('data'), self.config)
+            self.send_json('saved {}'.format(id.strip()))
+
+        elif action == 'load':
+            id = fields.get('id')
+            data = wsgi.load_session(id, self.config)
+            if data is None:
+                self.send_json('no data for {}'.format(id.strip()))
+            else:
+                self.send(data)
+
+        elif action == 'newid':
+            self.send(wsgi.new_session_id(self.config))
+
+        else:
+            raise ValueError('unknown action {}'.format(action))
+
+    get = post
+
+
+
+class MetricsHandler(RequestHandler):
+    def get(self):
+        self.set_header('Content-Type', metrics.content_type)
+        self.set_header(*cc_nocache)
+        self.finish(metrics.exposition())
+
+
+
+def make_app(config = None):
+    config = config or get_config()
+    kwargs = dict(config = config)
+    return Application([
+        (r'/metrics', MetricsHandler),
+        (r'/plots/(.*)', PlotFileHandler, kwargs),
+        (r'/(?:plot|webplot\.py)', ActionHandler, kwargs),
+        (r'(/.*)', StaticHandler, kwargs),
+    ])
+
+
+# seconds to wait for running requests when stopping a worker
+grace_period = 60
+
+def serve(sockets, config = None):
+    '''serve requests on sockets until SIGTERM or SIGINT, then stop accepting
+       connections and exit after running requests are done'''
+    server = HTTPServer(make_app(config))
+    server.add_sockets(sockets)
+    loop = IOLoop.current()
+
+    def shutdown():
+        log.info('worker %d stopping', os.getpid())
+        server.stop()
+        deadline = time.time() + grace_period
+
+        def wait():
+            if (BaseHandler.active or _pending) and time.time() < deadline:
+                loop.call_later(0.5, wait)
+            else:
+                loop.stop()
+        wait()
+
+    def on_signal(signum, frame):
+        loop.add_callback_from_signal(shutdown)
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    loop.start()
+    metrics.flush()  # keep the counts of this worker
+
+
+def prefork(sockets, workers, config = None):
+    '''run workers processes sharing sockets, workers that die are replaced,
+       SIGHUP gracefully replaces all workers, SIGTERM/SIGINT stops them'''
+    children = set()
+    retired = set()
+    state = {'running': True, 'restart': False}
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            try:
+                serve(sockets, config)
+            finally:
+                os._exit(0)
+        log.info('started worker %d', pid)
+        children.add(pid)
+
+    def on_stop(signum, frame):
+        state['running'] = False
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    def on_restart(signum, frame):
+        state['restart'] = True
+
+    for i in xrange(workers):
+        spawn()
+
+    signal.signal(signal.SIGTERM, on_stop)
+    signal.signal(signal.SIGINT, on_stop)
+    signal.signal(signal.SIGHUP, on_restart)
+
+    while children:
+        if state['restart'] and state['running']:
+            state['restart'] = False
+            log.info('restarting workers')
+            old = children.copy()
+            for i in xrange(workers):
+                spawn()
+            for pid in old:
+                retired.add(pid)
+                os.kill(pid, signal.SIGTERM)
+
+        try:
+            pid, status = os.wait()
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+
+        children.discard(pid)
+        if pid in retired:
+            retired.discard(pid)
+        elif state['running']:
+            log.warning('worker %d exited with status %d, replacing it', pid, status)
+            time.sleep(1)
+            spawn()
 
 
 def main():
     address = os.environ['CTPLOT_ADDRESS'] if 'CTPLOT_ADDRESS' in os.environ else ''
     port = int(os.environ['CTPLOT_PORT']) if 'CTPLOT_PORT' in os.environ else 8080
+    workers = int(os.environ.get('CTPLOT_WORKERS', 1)) or cpu_count()
     print 'listening on %s:%d' % (address, port)
 
-    http_server = HTTPServer(WSGIContainer(application))
-    http_server.listen(port, address=address)
-    IOLoop.instance().start()
+    sockets = bind_sockets(port, address = address)
+    if workers > 1:
+        print 'running %d workers' % workers
+        prefork(sockets, workers)
+    else:
+        serve(sockets)
 
 if __name__ == '__main__':
     main()
@@ -1,22 +1,32 @@
 #!/usr/bin/env python
 # coding: utf8
 
-import os, json, random, string, logging
+import os, re, json, random, string, logging
 from numbers import Number
 from os.path import join, abspath, basename
 from mimetypes import guess_type
 from time import  time
 from cgi import FieldStorage
 from threading import Lock
+from multiprocessing.pool import ThreadPool
 from pkg_resources import resource_string, resource_exists, resource_isdir, resource_listdir
 from itertools import product
+from locket import lock_file
 
 import matplotlib
 matplotlib.use('Agg')  # headless backend
 
 import plot
 import validation
-from utils import hashargs
+from catalog import Catalog
+import plotcache
+import dataexport
+import tiles
+import metrics
+import timing
+from timing import phase
+from canonical import normalize, normalize_number
+from utils import LoadSampler
 from i18n import _
 
 logging.basicConfig(level = logging.DEBUG, format = '%(filename)s:%(funcName)s:%(lineno)d:%(message)s')
@@ -39,7 +49,9 @@ def get_config():
     _config = {'cachedir':join(basedir, 'cache'),
                'datadir':join(basedir, 'data'),
                'plotdir':join(basedir, 'plots'),
-               'sessiondir':join(basedir, 'sessions')}
+               'sessiondir':join(basedir, 'sessions'),
+               'metricsdir':join(basedir, 'metrics'),
+               'resultdir':''}
 
     for k in _config.keys():
         ek = prefix + k.upper()
@@ -48,8 +60,17 @@ def get_config():
 
     _config['debug'] = True if (prefix + 'debug').upper() in env else False
 
+    # numeric settings
+    for k, v in [('catalog_interval', 300), ('resultcache_mb', 256), ('mapcache_mb', 512),
+                 ('maxqueue', 20), ('maxload', 0), ('retry_after', 10)]:
+        ek = prefix + k.upper()
+        _config[k] = float(env[ek]) if ek in env else v
+
     log.debug('config: {}'.format(_config))
 
+    if _config['metricsdir']:
+        metrics.start(_config['metricsdir'])
+
     return _config
 
 def getpath(environ):
@@ -61,10 +82,26 @@ def getpath(environ):
 # see http://webpython.codepoint.net/wsgi_application_interface
 def application(environ, start_response):
     path = getpath(environ)
-    if path == '/webplot.py' or path.startswith('/plot'):
-        return dynamic_content(environ, start_response)
-    else:
-        return static_content(environ, start_response)
+    if path == '/metrics':
+        return serve_metrics(start_response)
+
+    with metrics.request('static') as m:
+        environ['ctplot.metrics'] = m
+        if path == '/webplot.py' or path.startswith('/plot'):
+            body = dynamic_content(environ, start_response)
+        else:
+            body = static_content(environ, start_response)
+        if isinstance(body, list):
+            m.bytes = sum(map(len, body))
+        else:  # streamed
+            body = _counted(body)
+        return body
+
+
+def _counted(body):
+    for chunk in body:
+        metrics.bytes_served.add(len(chunk))
+        yield chunk
 
 # http://www.mobify.com/blog/beginners-guide-to-http-cache-headers/
 # http://www.mnot.net/cache_docs/
@@ -93,6 +130,14 @@ def static_content(environ, start_response):
         start_response('301 Redirect', [content_type(), ('Location', environ['REQUEST_URI'] + '/')])
         return []
 
+    status, ctype, body = get_static(path)
+    start_response(status, [ctype, cc_cache] if status.startswith('200') else [ctype])
+    return body
+
+
+def get_static(path):
+    '''return status, content type header and body of the static resource
+       at path (relative to the web root)'''
     if path == '/':
         path = 'web/index.html'  # map / to index.html
     else:
@@ -102,19 +147,15 @@ def static_content(environ, start_response):
         scripts = {}
         for s in resource_listdir('ctplot', 'web/js'):
             scripts[s] = '\n// {}\n\n'.format(s) + resource_string('ctplot', 'web/js/' + s)
-        start_response('200 OK', [content_type('combined.js'), cc_cache])
-        return [scripts[k] for k in sorted(scripts.keys())]
+        return '200 OK', content_type('combined.js'), [scripts[k] for k in sorted(scripts.keys())]
 
     if not resource_exists('ctplot', path):  # 404
-        start_response('404 Not Found', [content_type()])
-        return ['404\n', '{} not found!'.format(path)]
+        return '404 Not Found', content_type(), ['404\n', '{} not found!'.format(path)]
 
     elif resource_isdir('ctplot', path):  # 403
-        start_response('403 Forbidden', [content_type()])
-        return ['403 Forbidden']
+        return '403 Forbidden', content_type(), ['403 Forbidden']
     else:
-        start_response('200 OK', [content_type(path), cc_cache])
-        return resource_string('ctplot', path)
+        return '200 OK', content_type(path), [resource_string('ctplot', path)]
 
 
 
@@ -123,14 +164,28 @@ def dynamic_content(environ, start_response):
     config = get_config()
 
     if path.startswith('/plots'):
+        environ['ctplot.metrics'].action = 'plots'
         return serve_plot(path, start_response, config)
     else:
         return handle_action(environ, start_response, config)
 
 
 
+def plot_file(path, config):
+    '''return filename of the plot image at path, svg and pdf are
+       created on first request from the persisted figure'''
+    name = join(config['plotdir'], basename(path))
+
+    stem, ext = os.path.splitext(name)
+    if not os.path.isfile(name) and os.path.isfile(stem + '.fig'):
+        with timing.request('export'):
+            plot.export(stem, ext[1:])
+
+    return name
+
+
 def serve_plot(path, start_response, config):
-    with open(join(config['plotdir'], basename(path))) as f:
+    with open(plot_file(path, config)) as f:
         start_response('200 OK', [content_type(path), cc_cache])
         return [f.read()]
 
@@ -144,11 +199,60 @@ def serve_plain(data, start_response):
     start_response('200 OK', [content_type(), cc_nocache])
     return [data]
 
-available_tables = None
 
-def validate_settings(settings):
-    global available_tables
+def serve_metrics(start_response):
+    get_config()  # share metrics with the other processes
+    start_response('200 OK', [('Content-Type', metrics.content_type), cc_nocache])
+    return [metrics.exposition()]
+
+
+def serve_data(p, fmt, start_response):
+    ctype, body = dataexport.export(p, fmt)
+    start_response('200 OK', [('Content-Type', ctype), cc_nocache,
+                              ('Content-Disposition', 'attachment; filename=data.' + fmt)])
+    return body
+
+
+def serve_busy(start_response, config):
+    start_response('503 Service Unavailable', [content_type(), cc_nocache, ('Retry-After', str(int(config['retry_after'])))])
+    return [_('server busy, try again later')]
+
+_catalog = None
+_catalog_lock = Lock()
+
+def get_catalog(config):
+    '''return the table catalog shared by all processes, it is refreshed by a
+       background thread every catalog_interval seconds'''
+    global _catalog
+    with _catalog_lock:  # one thread creates it, the others wait
+        if not _catalog:
+            catalog = Catalog(config['datadir'], join(config['cachedir'], 'catalog.json'))
+            catalog.update()
+            if config['catalog_interval'] > 0:
+                catalog.watch(config['catalog_interval'])
+            _catalog = catalog
+            return _catalog
+    _catalog.update()
+    return _catalog
+
+
+def catalog_current():
+    'True if get_catalog() only has to read the catalog file, not scan the HDF5 files'
+    return _catalog is not None and os.path.isfile(_catalog.filename)
+
+
+def refresh_catalog(config):
+    'rescan changed HDF5 files now, return a status message'
+    n = get_catalog(config).refresh()
+    return 'rescanned {} files'.format(n)
+
+
+def get_tables(config):
+    'return the available tables'
+    return get_catalog(config).tables
 
+
+def validate_settings(settings):
     errors = { 'global': [], 'diagrams': {} }
     valid = True
 
@@ -165,8 +269,8 @@ def validate_settings(settings):
             errors['global'].append(_('no plots detected'))
             return [False, errors]
 
-    if not available_tables or time() - available_tables[0] > 86400:
-        available_tables = time(), plot.available_tables(get_config()['datadir'])
+    with phase('catalog'):
+        catalog = get_catalog(get_config())
 
     log.debug('settings to validate: {}'.format(settings))
 
@@ -241,16 +345,15 @@ def validate_settings(settings):
 
         # get permitted expression variables
         permitted_vars = None
-        if 's' + n in settings:
-            for filename, dataset in available_tables[1].iteritems():
-                if filename == settings['s' + n]:
-                    permitted_vars = {}
-                    # init dummy vars to 1
-                    for cn in dataset.colnames:
-                        permitted_vars[cn] = 1
-                    if ('rw' + n) in settings and settings['rw' + n]:
-                        for cn in ['rate', 'count', 'weight']:
-                            permitted_vars[cn] = 1
+        dataset = catalog.get(settings['s' + n]) if 's' + n in settings else None
+        if dataset:
+            permitted_vars = {}
+            # init dummy vars to 1
+            for cn in dataset.colnames:
+                permitted_vars[cn] = 1
+            if ('rw' + n) in settings and settings['rw' + n]:
+                for cn in ['rate', 'count', 'weight']:
+                    permitted_vars[cn] = 1
 
         # x/y/z adjustment function
         for ax in 'xyz':
@@ -281,6 +384,10 @@ def validate_settings(settings):
         v.add('rs' + n, validation.FloatRange(0, 1, exclude_min=True,
             allow_empty=True), title=_('push'))
 
+        # sampled fraction of the rows
+        v.add('sf' + n, validation.FloatRange(0, 1, exclude_min=True,
+            allow_empty=True), title=_('sample'))
+
         # weight
         v.add('rc' + n,
             validation.Expression(transform=False, args=permitted_vars),
@@ -314,7 +421,7 @@ def validate_settings(settings):
 
         # statistics box validation
         if diagram_type in ['h1', 'h2']:
-            v.add('sb' + n, validation.Regexp('^[nuomspewkxca]*$'),
+            v.add('sb' + n, validation.Regexp('^[nuomspedwkxca]*$'),
                 title=_('statistics box'))
 
         # outline validation
@@ -379,97 +486,476 @@ def validate_settings(settings):
     return [valid, errors]
 
 
-plot_lock = Lock()
+class ServerBusy(Exception):
+    pass
+
+_jobs = [0]  # number of render jobs running or waiting for a file lock
+_jobs_lock = Lock()
+_load = None
+
+metrics.Gauge('ctplot_render_jobs', 'number of render jobs running or waiting for a file lock', func = lambda: _jobs[0])
+
+def overloaded(config):
+    'True if the cpu load exceeds maxload (if set)'
+    global _load
+    if not config['maxload']:
+        return False
+    if _load is None:
+        _load = LoadSampler()
+    return _load.load > config['maxload']
+
+
+class render_job(object):
+    '''context of n render jobs, raises ServerBusy if there would be more
+       than maxqueue jobs (if set) or the server is overloaded'''
+    def __init__(self, config, n = 1):
+        self.config = config
+        self.n = n
+
+    def __enter__(self):
+        with _jobs_lock:
+            maxqueue = self.config['maxqueue']
+            if (maxqueue and _jobs[0] + self.n > maxqueue) or overloaded(self.config):
+                log.warning('rejecting %d render jobs, %d queued, cpu load %s', self.n, _jobs[0], _load and _load.load)
+                raise ServerBusy()
+            _jobs[0] += self.n
+
+    def __exit__(self, *args):
+        with _jobs_lock:
+            _jobs[0] -= self.n
+
+
+def get_settings(fields):
+    'extract the plot settings from a dict of form fields'
+    settings = {}
+    for k, v in fields.iteritems():
+        if k[0] in 'xyzcmsorntwhfglp' or k[:10] == 'experiment':
+            settings[k] = v.strip().decode('utf8', errors = 'ignore')
+    return settings
+
+
+def plot_name(settings, config):
+    'return the filename (w/o extension) of the plot created from settings'
+    return plotcache.entry(normalize(settings), config['datadir'], config['plotdir'])[0]
+
+
+def cached_images(settings, config):
+    'return dict format --> url of the images of the cached plot of settings, None if it is not cached'
+    if config['debug'] or not config['cachedir']:
+        return None
+    name, meta = plotcache.entry(normalize(settings), config['datadir'], config['plotdir'])
+    images = plotcache.lookup(name, meta)
+    if images is None:
+        return None
+    metrics.cache.inc('plot', 'hit')
+    return dict([(k, 'plots/' + basename(v)) for k, v in images.items()])
+
 
 def make_plot(settings, config):
-    basename = 'plot{}'.format(hashargs(settings))
-    name = os.path.join(config['plotdir'], basename).replace('\\', '/')
+    # plots are cached and created from the canonical settings,
+    # the submitted settings are validated to report errors per form field
+    canonical = normalize(settings)
+    name, meta = plotcache.entry(canonical, config['datadir'], config['plotdir'])
+    use_cache = not config['debug'] and config['cachedir']
 
     # try to get plot from cache
-    if not config['debug'] and config['cachedir'] and os.path.isfile(name + '.png'):
-        return [dict([(e, name + '.' + e) for e in ['png', 'svg', 'pdf']]), None]
-    else:
-        # lock long running plot creation
-        with plot_lock:
+    with phase('cache'):
+        images = plotcache.lookup(name, meta) if use_cache else None
+    metrics.cache.inc('plot', 'hit' if images else 'miss')
+    if images:
+        return [images, None]
+
+    # the file lock keeps other threads and processes from creating the same plot
+    with render_job(config), timing.waiting(lock_file(name + '.lock')):
+        with phase('cache'):
+            images = plotcache.lookup(name, meta) if use_cache else None
+        if images:
+            return [images, None]
+
+        with phase('validation'):
+            valid, errors = validate_settings(settings)
+
+        if not valid:
+            return [None, errors]
+
+        p = plot.Plot(config, **canonical)
+        images = p.save(name, ('png',), ('svg', 'pdf'))
+        with phase('cache'):
+            plotcache.store(name, meta, images)
+        return [images, None]
+
+
+def plot_images(settings, config):
+    '''create the plot, return dict format --> url of the images, the
+       validation errors and, in debug mode, the timing of the request
+       phases (None otherwise)'''
+    with timing.request('plot') as t:
+        try:
+            images, errors = make_plot(settings, config)
+        except ServerBusy:
+            raise
+        except Exception as e:
+            log.exception(e)
+            errors = { 'global': [_('unknown error')] }
+
+    report = t.report() if config['debug'] else None
+    if errors:
+        return [None, errors, report]
+    return [dict([(k, 'plots/' + basename(v)) for k, v in images.items()]), None, report]
+
+
+# previews are rendered from about preview_rows rows of each table
+preview_rows = 100000
+preview_dpi = 40
+
+def preview_settings(canonical, config):
+    'return the settings of the preview of the plot of canonical settings'
+    catalog = get_catalog(config)
+    settings = dict(canonical)
+    for k, v in canonical.iteritems():
+        n = k[1:]
+        if re.match('^s\\d+$', k) and 'rw' + n not in canonical:  # averaged data is not sampled
+            specs = catalog.get(v)
+            if specs and specs.rows > preview_rows:
+                fraction = min(float(preview_rows) / specs.rows, float(canonical.get('sf' + n, 1)))
+                settings['sf' + n] = normalize_number(fraction)
+    return settings
+
+
+def preview_images(settings, config):
+    '''return dict format --> url of a quick, low resolution preview of the
+       plot and the validation errors, if the plot already exists, its
+       images are returned with final set'''
+    with timing.request('preview'):
+        canonical = normalize(settings)
+        use_cache = not config['debug'] and config['cachedir']
+
+        name, meta = plotcache.entry(canonical, config['datadir'], config['plotdir'])
+        with phase('cache'):
+            images = plotcache.lookup(name, meta) if use_cache else None
+        if images:
+            return [dict([(k, 'plots/' + basename(v)) for k, v in images.items()] + [('final', True)]), None]
+
+        # same key as the plot, but another prefix
+        name, meta = plotcache.entry(canonical, config['datadir'], config['plotdir'], 'preview')
+        with phase('cache'):
+            images = plotcache.lookup(name, meta) if use_cache else None
+        metrics.cache.inc('preview', 'hit' if images else 'miss')
+
+        if not images:
+            with render_job(config), timing.waiting(lock_file(name + '.lock')):
+                with phase('cache'):
+                    images = plotcache.lookup(name, meta) if use_cache else None
+                if not images:
+                    with phase('validation'):
+                        valid, errors = validate_settings(settings)
+                    if not valid:
+                        return [None, errors]
+
+                    p = plot.Plot(config, **preview_settings(canonical, config))
+                    images = p.save(name, ('png',), dpi = preview_dpi)
+                    with phase('cache'):
+                        plotcache.store(name, meta, images)
+
+    return [dict([(k, 'plots/' + basename(v)) for k, v in images.items()]), None]
+
+
+def format_errors(fmt):
+    'return the validation errors of the unknown data format fmt'
+    return { 'global': [_('unknown data format {}, use one of {}').format(fmt, ', '.join(sorted(dataexport.formats)))] }
+
+
+def compute_data(settings, config):
+    '''return the computed plot.Plot of settings, without drawing it,
+       and the validation errors'''
+    with timing.request('data'):
+        with phase('validation'):
             valid, errors = validate_settings(settings)
+        if not valid:
+            return [None, errors]
 
-            if not valid:
-                return [None, errors]
+        with render_job(config):
+            p = plot.Plot(config, **normalize(settings))
+            p.compute()
+        return [p, None]
 
-            p = plot.Plot(config, **settings)
-            return [p.save(name), None]
+
+def tile_data(fields, config):
+    '''return the min/max/mean tile of the time series requested by fields
+       (see tiles.fields, level and tile) and the validation errors'''
+    with timing.request('tile'):
+        settings = tiles.settings(fields)
+        with phase('validation'):
+            valid, errors = validate_settings(settings)
+        if not valid:
+            return [None, errors]
+
+        try:
+            level, index = int(fields.get('level', 0)), int(fields.get('tile', 0))
+        except (TypeError, ValueError):
+            level, index = -1, 0
+        if not 0 <= level <= tiles.maxlevel or not 0 <= index < 2 ** level:
+            return [None, { 'global': [_('no tile {} at level {}').format(fields.get('tile', 0), fields.get('level', 0))] }]
+
+        p = plot.Plot(config, **normalize(settings))
+        with phase('cache'):
+            t = tiles.load(p, level, index, config)
+        metrics.cache.inc('tile', 'hit' if t else 'miss')
+        if t is None:
+            with render_job(config):
+                p.compute()
+                try:
+                    t = tiles.tile(p, level, index)
+                except ValueError as e:
+                    return [None, { 'global': [str(e)] }]
+            with phase('cache'):
+                tiles.store(p, level, index, t, config)
+        return [t, None]
+
+
+# threads drawing and saving the plots of all batches
+batch_threads = int(os.environ.get('CTPLOT_THREADS', 4))
+
+_batch_pool = None
+_batch_pool_lock = Lock()
+
+def batch_pool():
+    'return the thread pool drawing the plots of all batches of the process'
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is None:
+            _batch_pool = ThreadPool(batch_threads)
+        return _batch_pool
+
+
+def batch_fields(text, config):
+    '''return the list of dicts of form fields of a batch from the JSON text
+       and the errors, the values are converted to strings as the form sends
+       them: null and false are left out, true is on'''
+    try:
+        batch = json.loads(text or '')
+    except ValueError:
+        batch = None
+    if not isinstance(batch, list) or not all([isinstance(f, dict) for f in batch]):
+        return None, { 'global': [_('settings must be a list of objects holding form fields')] }
+    if not batch:
+        return None, { 'global': [_('no plots detected')] }
+    maxqueue = config['maxqueue']
+    if maxqueue and len(batch) > maxqueue:
+        return None, { 'global': [_('at most {} plots per batch').format(maxqueue)] }
+
+    fields_list = []
+    for fields in batch:
+        f = {}
+        for k, v in fields.iteritems():
+            if v is None or v is False:
+                continue
+            if v is True:
+                v = 'on'
+            elif isinstance(v, float):
+                v = str(int(v)) if v.is_integer() else repr(v)
+            elif isinstance(v, (int, long)):
+                v = str(v)
+            elif isinstance(v, unicode):
+                v = v.encode('utf8')
+            else:
+                return None, { 'global': [_('invalid value of {}').format(k)] }
+            f[k] = v
+        fields_list.append(f)
+    return fields_list, None
+
+
+def batch_images(fields_list, config):
+    '''create several plots from a list of dicts of form fields (see
+       batch_fields), the tables used by several plots are read only once,
+       the plots are drawn in parallel by the batch pool, return list of
+       [urls, errors] per plot, each plot to create counts as render job'''
+    with timing.request('batch'):
+        use_cache = not config['debug'] and config['cachedir']
+        results = [None] * len(fields_list)
+        todo = []  # index, name, meta, canonical settings
+
+        for n, fields in enumerate(fields_list):
+            settings = get_settings(fields)
+            canonical = normalize(settings)
+            name, meta = plotcache.entry(canonical, config['datadir'], config['plotdir'])
+            with phase('cache'):
+                images = plotcache.lookup(name, meta) if use_cache else None
+            metrics.cache.inc('plot', 'hit' if images else 'miss')
+            if images:
+                results[n] = [images, None]
+                continue
+
+            with phase('validation'):
+                valid, errors = validate_settings(settings)
+            if valid:
+                todo.append((n, name, meta, canonical))
+            else:
+                results[n] = [None, errors]
+
+        if todo:
+            # file locks are taken in order, so batches do not deadlock each other
+            locks = [lock_file(name + '.lock') for name in sorted(set([x[1] for x in todo]))]
+            with render_job(config, len(locks)):
+                with phase('queue'):
+                    for l in locks: l.acquire()
+                try:
+                    plots = {}
+                    for n, name, meta, canonical in todo:
+                        with phase('cache'):
+                            images = plotcache.lookup(name, meta) if use_cache else None
+                        if images:
+                            results[n] = [images, None]
+                        elif name not in plots:
+                            plots[name] = plot.Plot(config, **canonical)
+
+                    metas = dict([(name, meta) for n, name, meta, canonical in todo])
+
+                    def save(name):
+                        with timing.request('batch_save'):
+                            images = plots[name].save(name, ('png',), ('svg', 'pdf'))
+                            with phase('cache'):
+                                plotcache.store(name, metas[name], images)
+                        return images
+
+                    try:
+                        plot.compute_all(plots.values())
+                        saved = {}
+                        if plots:  # drawn in parallel, each plot has its own figure
+                            with phase('drawing'):
+                                saved = dict(zip(plots.keys(), batch_pool().map(save, plots.keys())))
+                        for n, name, meta, canonical in todo:
+                            if results[n] is None:
+                                results[n] = [saved[name], None]
+                    except Exception as e:
+                        log.exception(e)
+                        for n, name, meta, canonical in todo:
+                            if results[n] is None:
+                                results[n] = [None, { 'global': [_('unknown error')] }]
+                finally:
+                    for l in locks: l.release()
+
+    urls = []
+    for images, errors in results:
+        if errors:
+            urls.append({ 'errors': errors })
+        else:
+            urls.append(dict([(k, 'plots/' + basename(v)) for k, v in images.items()]))
+    return urls
 
 
 def randomChars(n):
     return ''.join(random.choice(string.ascii_lowercase + string.ascii_uppercase + string.digits) for _ in range(n))
 
+
+def session_file(id, config):
+    id = id.strip()
+    if len(id) < 8: raise RuntimeError('session id must have at least 8 digits')
+    return os.path.join(config['sessiondir'], '{}.session'.format(id))
+
+
+def save_session(id, data, config):
+    with open(session_file(id, config), 'w') as f:
+        f.write(data.strip().replace('},{', '},\n{'))
+
+
+def load_session(id, config):
+    'return the saved session data, None if there is none'
+    name = session_file(id, config)
+    try:
+        with open(name) as f:
+            return f.read()
+    except:
+        return None
+
+
+def new_session_id(config):
+    id = randomChars(16)
+    while os.path.isfile(os.path.join(config['sessiondir'], '{}.session'.format(id))):
+        id = randomChars(16)
+    return id
+
+
+actions = ['plot', 'png', 'svg', 'pdf', 'preview', 'batch', 'data', 'tile', 'list', 'refresh', 'save', 'load', 'newid']
+
 def handle_action(environ, start_response, config):
-    global available_tables
     fields = FieldStorage(fp = environ['wsgi.input'], environ = environ)
     action = fields.getfirst('a')
-    datadir = config['datadir']
-    sessiondir = config['sessiondir']
+    environ['ctplot.metrics'].action = action if action in actions else 'unknown'
 
     if action in ['plot', 'png', 'svg', 'pdf']:
-
-        settings = {}
-        for k in fields.keys():
-            if k[0] in 'xyzcmsorntwhfglp' or k[:10] == 'experiment':
-                settings[k] = fields.getfirst(k).strip().decode('utf8', errors = 'ignore')
-
+        settings = get_settings(dict([(k, fields.getfirst(k)) for k in fields.keys()]))
         try:
-            images, errors = make_plot(settings, config)
-        except Exception as e:
-            log.exception(e)
-            errors = { 'global': [_('unknown error')] }
+            images, errors, report = plot_images(settings, config)
+        except ServerBusy:
+            return serve_busy(start_response, config)
 
         if errors:
             return serve_json({ 'errors': errors }, start_response)
 
-        for k, v in images.items():
-            images[k] = 'plots/' + basename(v)
-
         if action == 'plot':
-            return serve_json(images, start_response)
+            return serve_json(dict(images, timing = report) if report else images, start_response)
 
         elif action in ['png', 'svg', 'pdf']:
             return serve_plot(images[action], start_response, config)
 
+    elif action == 'preview':
+        settings = get_settings(dict([(k, fields.getfirst(k)) for k in fields.keys()]))
+        try:
+            images, errors = preview_images(settings, config)
+        except ServerBusy:
+            return serve_busy(start_response, config)
+        return serve_json({ 'errors': errors } if errors else images, start_response)
 
+    elif action == 'batch':
+        try:
+            fields_list, errors = batch_fields(fields.getfirst('settings'), config)
+            if errors:
+                return serve_json({ 'errors': errors }, start_response)
+            return serve_json(batch_images(fields_list, config), start_response)
+        except ServerBusy:
+            return serve_busy(start_response, config)
+
+    elif action == 'data':
+        settings = get_settings(dict([(k, fields.getfirst(k)) for k in fields.keys()]))
+        fmt = fields.getfirst('format', 'json')
+        if fmt not in dataexport.formats:
+            return serve_json({ 'errors': format_errors(fmt) }, start_response)
+        try:
+            p, errors = compute_data(settings, config)
+        except ServerBusy:
+            return serve_busy(start_response, config)
+        if errors:
+            return serve_json({ 'errors': errors }, start_response)
+        return serve_data(p, fmt, start_response)
+
+    elif action == 'tile':
+        try:
+            t, errors = tile_data(dict([(k, fields.getfirst(k)) for k in fields.keys()]), config)
+        except ServerBusy:
+            return serve_busy(start_response, config)
+        return serve_json({ 'errors': errors } if errors else t, start_response)
 
     elif action == 'list':
-        if not available_tables or time() - available_tables[0] > 86400:
-            available_tables = time(), plot.available_tables(datadir)
-        return serve_json(available_tables[1], start_response)
+        return serve_json(get_tables(config), start_response)
+
+    elif action == 'refresh':
+        return serve_json(refresh_catalog(config), start_response)
 
     elif action == 'save':
-        id = fields.getfirst('id').strip()
-        if len(id) < 8: raise RuntimeError('session id must have at least 8 digits')
-        data = fields.getfirst('data').strip()
-        with open(os.path.join(sessiondir, '{}.session'.format(id)), 'w') as f:
-            f.write(data.replace('},{', '},\n{'))
-        return serve_json('saved {}'.format(id), start_response)
+        id = fields.getfirst('id')
+        save_session(id, fields.getfirst('data'), config)
+        return serve_json('saved {}'.format(id.strip()), start_response)
 
     elif action == 'load':
-        id = fields.getfirst('id').strip()
-        if len(id) < 8: raise RuntimeError('session id must have at least 8 digits')
-        try:
-            with open(os.path.join(sessiondir, '{}.session'.format(id))) as f:
-                return serve_plain(f.read(), start_response)
-        except:
-            return serve_json('no data for {}'.format(id), start_response)
+        id = fields.getfirst('id')
+        data = load_session(id, config)
+        if data is None:
+            return serve_json('no data for {}'.format(id.strip()), start_response)
+        return serve_plain(data, start_response)
 
     elif action == 'newid':
-        id = randomChars(16)
-        while os.path.isfile(os.path.join(sessiondir, '{}.session'.format(id))):
-            id = randomChars(16)
-        return serve_plain(id, start_response)
+        return serve_plain(new_session_id(config), start_response)
 
     else:
         raise ValueError('unknown action {}'.format(action))
-
-
-
-
-
-
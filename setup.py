@@ -60,13 +60,14 @@ setup(
     long_description = readme('README.md'),
     install_requires = required_libs,
     extra_require = {
-                        'server': ['tornado']
+                        'server': ['tornado', 'futures']
     },
     entry_points = {'console_scripts':[
                         'rawdata=ctplot.rawdata:main',
                         'mergedata=ctplot.merge:main',
                         'ctplot=ctplot.plot:main',
-                        'ctserver=ctplot.webserver:main'
+                        'ctserver=ctplot.webserver:main',
+                        'ctbench=ctplot.bench:main'
                    ]},
     package_data = {
                     'ctplot':['web/*.*', 'web/*/*.*', 'web/*/*/*.*']
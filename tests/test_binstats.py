@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+#    the vectorized statistics give the results of the loops they replaced
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import unittest, warnings
+import numpy as np
+from itertools import product
+from ctplot import binstats
+
+
+# the loops of Plot._bin_profile, stats_fields1d and stats_fields2d before binstats
+
+def profile_loop(x, y, edges):
+    count, yy, yerr = [], [], []
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # mean of empty bins
+        for l, u in zip(edges[:-1], edges[1:]):
+            bindata = y[(l <= x) & (x < u)]
+            count.append(len(bindata))
+            yy.append(np.mean(bindata))
+            yerr.append(np.std(bindata))
+    return np.array(count), np.array(yy), np.array(yerr)
+
+
+def moments_loop(centers, contents):
+    stats = {}
+    stats['N'] = N = np.sum(contents)
+    stats['mean'] = mean = np.sum(centers * contents) / N
+    stats['std'] = std = np.sqrt(np.sum((centers - mean) ** 2 * contents) / N)
+    stats['skew'] = np.sum(((centers - mean) / std) ** 3 * contents) / N
+    stats['kurtos'] = kurtosis = np.sum(((centers - mean) / std) ** 4 * contents) / N
+    stats['excess'] = kurtosis - 3
+    return stats
+
+
+def moments2d_loop(contents, xcenters, ycenters):
+    stats = {}
+    stats['N'] = N = contents.sum()
+    stats['mean'] = mean = np.array([ (contents.sum(axis = 0) * xcenters).sum(),
+                     (contents.sum(axis = 1) * ycenters).sum()]) / N
+    stats['std'] = np.sqrt(np.array([(contents.sum(axis = 0) * (xcenters - mean[0]) ** 2).sum(),
+                              (contents.sum(axis = 1) * (ycenters - mean[1]) ** 2).sum()]) / N)
+    cov = 0
+    for k, l in product(xrange(contents.shape[1]), xrange(contents.shape[0])):
+        cov += contents[l, k] * (xcenters[k] - mean[0]) * (ycenters[l] - mean[1])
+    stats['cov'] = cov / N
+    return stats
+
+
+class BinstatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.random = np.random.RandomState(0)
+
+    def assertStats(self, stats, expected):
+        self.assertEqual(sorted(stats.keys()), sorted(expected.keys()))
+        for k in expected:
+            np.testing.assert_allclose(stats[k], expected[k], rtol = 1e-10, atol = 1e-12, err_msg = k)
+
+    def test_profile(self):
+        x, y = self.random.uniform(0, 10, 10000), self.random.normal(size = 10000)
+        for edges in [np.linspace(0, 10, 21), np.array([0, 0.5, 3, 3.01, 9.5])]:
+            x[:len(edges)] = edges  # on the edges, x equal to the last edge is outside
+            expected = profile_loop(x, y, edges)
+            for a, b in zip(binstats.profile(x, y, edges), expected):
+                np.testing.assert_allclose(a, b, rtol = 1e-10, atol = 1e-12)
+
+    def test_profile_empty_and_nan(self):
+        x = np.array([0.5, 0.6, np.nan, 2.5, 4.0])
+        y = np.array([1.0, 3.0, 5.0, 7.0, 9.0])
+        edges = np.linspace(0, 4, 5)
+        count, mean, std = binstats.profile(x, y, edges)
+        np.testing.assert_array_equal(count, [2, 0, 1, 0])
+        for a, b in zip((count, mean, std), profile_loop(x, y, edges)):
+            np.testing.assert_allclose(a, b)  # nan in empty bins
+
+    def test_profile_weights(self):
+        x, y = self.random.uniform(0, 1, 1000), self.random.normal(size = 1000)
+        edges = np.linspace(0, 1, 11)
+        counts, mean, std = binstats.profile(np.repeat(x, 3), np.repeat(y, 3), edges)
+        wcounts, wmean, wstd = binstats.profile(x, y, edges, np.ones(len(x)) * 3)
+        np.testing.assert_array_equal(wcounts * 3, counts)
+        np.testing.assert_allclose(wmean, mean, rtol = 1e-10)
+        np.testing.assert_allclose(wstd, std, rtol = 1e-10)
+
+    def test_moments(self):
+        centers = np.linspace(-2.95, 2.95, 60)
+        contents = np.histogram(self.random.normal(size = 10000), np.linspace(-3, 3, 61))[0].astype(float)
+        self.assertStats(binstats.moments(centers, contents), moments_loop(centers, contents))
+
+    def test_moments2d(self):
+        x, y = self.random.normal(size = 10000), self.random.normal(size = 10000)
+        y += 0.5 * x
+        xedges, yedges = np.linspace(-3, 3, 31), np.linspace(-4, 4, 21)
+        contents = np.histogram2d(y, x, [yedges, xedges])[0]  # indexed [y, x]
+        xcenters, ycenters = (xedges[1:] + xedges[:-1]) / 2, (yedges[1:] + yedges[:-1]) / 2
+        self.assertStats(binstats.moments2d(contents, xcenters, ycenters), moments2d_loop(contents, xcenters, ycenters))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#    the threaded histograms count exactly as np.histogram and np.histogram2d
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import unittest
+import numpy as np
+from ctplot import histogram
+
+
+def reference(x, edges):
+    'counts of np.histogram, nan and inf are not counted'
+    x = np.asarray(x, dtype = float)
+    return np.histogram(x[np.isfinite(x)], edges)[0]
+
+
+def reference2d(x, y, xedges, yedges):
+    x, y = np.asarray(x, dtype = float), np.asarray(y, dtype = float)
+    ok = np.isfinite(x) & np.isfinite(y)
+    return np.histogram2d(x[ok], y[ok], [xedges, yedges])[0]
+
+
+class HistogramTest(unittest.TestCase):
+
+    def setUp(self):
+        self.random = np.random.RandomState(0)
+
+    def check(self, x, edges):
+        np.testing.assert_array_equal(histogram.histogram(x, edges), reference(x, edges))
+
+    def test_random(self):
+        self.check(self.random.normal(size = 10000), np.linspace(-3, 3, 61))
+
+    def test_values_on_edges(self):
+        for edges in [np.linspace(0, 1, 11), np.linspace(-3.3, 7.1, 53), np.linspace(0.1, 0.7, 7)]:
+            self.check(edges, edges)
+            self.check(np.repeat(edges, 3), edges)
+
+    def test_last_edge(self):
+        edges = np.linspace(0, 1, 11)
+        counts = histogram.histogram([1.0] * 5, edges)
+        self.assertEqual(counts[-1], 5)
+        self.assertEqual(counts.sum(), 5)
+        self.check([0.0, 1.0, np.nextafter(1.0, 2), np.nextafter(0.0, -1)], edges)
+
+    def test_nan_and_inf(self):
+        x = np.array([np.nan, np.inf, -np.inf, 0.5, 0.0, 1.0, np.nan])
+        self.check(x, np.linspace(0, 1, 5))
+        self.assertEqual(histogram.histogram(x, np.linspace(0, 1, 5)).sum(), 3)
+
+    def test_tiny_widths(self):
+        for edges in [np.linspace(1e-9, 2e-9, 101), 1 + np.arange(11) * 1e-12, 1e6 + np.linspace(0, 1e-3, 101)]:
+            x = np.concatenate([edges, self.random.uniform(edges[0], edges[-1], 1000)])
+            self.check(x, edges)
+
+    def test_unequal_bins(self):
+        edges = np.array([0, 0.1, 0.5, 0.51, 2])
+        self.assertFalse(histogram.is_uniform(edges))
+        self.check(np.concatenate([edges, self.random.uniform(-0.5, 2.5, 1000)]), edges)
+
+    def test_uniform(self):
+        self.assertTrue(histogram.is_uniform(np.linspace(-3.3, 7.1, 53)))
+        self.assertFalse(histogram.is_uniform(np.array([0, 1, 2.001])))
+
+    def test_chunks(self):
+        x = self.random.normal(size = histogram.chunksize * 2 + 123)
+        x[::1000] = np.nan
+        edges = np.linspace(-3, 3, 61)
+        x[1::1000] = edges[self.random.randint(0, len(edges), len(x[1::1000]))]
+        self.check(x, edges)
+
+    def test_threads(self):
+        chunksize, threads = histogram.chunksize, histogram.threads
+        histogram.chunksize, histogram.threads = 1000, 4
+        try:
+            x = self.random.normal(size = 10007)
+            self.check(x, np.linspace(-3, 3, 61))
+            self.check(x, np.array([-3, -1, 0, 0.1, 2, 3]))
+            y = self.random.normal(size = len(x))
+            np.testing.assert_array_equal(histogram.histogram2d(x, y, np.linspace(-3, 3, 13), np.linspace(-2, 2, 9)),
+                                          reference2d(x, y, np.linspace(-3, 3, 13), np.linspace(-2, 2, 9)))
+        finally:
+            histogram.chunksize, histogram.threads = chunksize, threads
+
+
+
+class Histogram2dTest(unittest.TestCase):
+
+    def setUp(self):
+        self.random = np.random.RandomState(0)
+
+    def check(self, x, y, xedges, yedges):
+        np.testing.assert_array_equal(histogram.histogram2d(x, y, xedges, yedges), reference2d(x, y, xedges, yedges))
+
+    def test_random(self):
+        self.check(self.random.normal(size = 10000), self.random.normal(size = 10000), np.linspace(-3, 3, 31), np.linspace(-2, 2, 21))
+
+    def test_edges(self):
+        xedges, yedges = np.linspace(0, 1, 11), np.array([0, 0.1, 0.5, 0.51, 2])
+        x, y = [a.ravel() for a in np.meshgrid(xedges, yedges)]
+        self.check(x, y, xedges, yedges)
+        counts = histogram.histogram2d([1.0], [2.0], xedges, yedges)
+        self.assertEqual(counts[-1, -1], 1)
+
+    def test_nan_and_inf(self):
+        x = np.array([np.nan, 0.5, np.inf, 0.5, 0.25])
+        y = np.array([0.5, np.nan, 0.5, -np.inf, 0.75])
+        self.check(x, y, np.linspace(0, 1, 5), np.linspace(0, 1, 5))
+        self.assertEqual(histogram.histogram2d(x, y, np.linspace(0, 1, 5), np.linspace(0, 1, 5)).sum(), 1)
+
+    def test_chunks(self):
+        n = histogram.chunksize + 77
+        self.check(self.random.normal(size = n), self.random.normal(size = n), np.linspace(-3, 3, 31), np.array([-2, -1, 0, 0.5, 2]))
+
+
+
+if __name__ == '__main__':
+    unittest.main()
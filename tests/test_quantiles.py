@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+#    accuracy of the quantile sketches
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+import unittest
+import numpy as np
+from ctplot.quantiles import Sketch, binned
+
+q = np.linspace(0, 1, 21)
+
+
+def rank_error(sketch, v, qq = np.linspace(0.01, 0.99, 99)):
+    'largest difference between qq and the fraction of v below the quantiles of sketch'
+    v = np.sort(v)
+    return np.max(np.abs(np.searchsorted(v, sketch.quantile(qq), side = 'right') / float(len(v)) - qq))
+
+
+class SketchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.random = np.random.RandomState(0)
+
+    def test_exact(self):
+        v = self.random.normal(size = 150)  # below the capacity k
+        s = Sketch(200).update(v)
+        self.assertEqual(len(s), 150)
+        np.testing.assert_allclose(s.quantile(q), np.percentile(v, q * 100))
+        self.assertAlmostEqual(s.quantile(0.5), np.median(v))
+
+    def test_single_and_empty(self):
+        self.assertTrue(np.isnan(Sketch().quantile(0.5)))
+        self.assertEqual(Sketch().update([3.0]).quantile(0.9), 3.0)
+
+    def test_not_finite(self):
+        s = Sketch().update([np.nan, 1.0, np.inf, 2.0, -np.inf, 3.0])
+        self.assertEqual(len(s), 3)
+        np.testing.assert_allclose(s.quantile(q), np.percentile([1.0, 2.0, 3.0], q * 100))
+
+    def test_rank_error(self):
+        for v in [self.random.normal(size = 100000), self.random.exponential(size = 100000), np.arange(100000.)]:
+            s = Sketch(200).update(v)
+            self.assertEqual(len(s), len(v))
+            self.assertLess(s.nbytes, 3 * 200 * 8)
+            self.assertLess(rank_error(s, v), 0.01)
+
+    def test_same_data_same_result(self):
+        v = self.random.normal(size = 50000)
+        np.testing.assert_array_equal(Sketch().update(v).quantile(q), Sketch().update(v).quantile(q))
+
+    def test_merge_exact(self):
+        a, b = self.random.normal(size = 60), self.random.normal(size = 70)
+        s = Sketch(200).update(a).merge(Sketch(200).update(b))
+        self.assertEqual(len(s), 130)
+        np.testing.assert_allclose(s.quantile(q), np.percentile(np.concatenate([a, b]), q * 100))
+
+    def test_merge(self):
+        parts = [self.random.normal(loc, size = 30000) for loc in (0, 1, 5)]
+        s = Sketch(200)
+        for p in parts:
+            s.merge(Sketch(200).update(p))
+        v = np.concatenate(parts)
+        self.assertEqual(len(s), len(v))
+        self.assertLess(rank_error(s, v), 0.01)
+
+    def test_binned(self):
+        x, y = self.random.uniform(0, 1, 500), self.random.normal(size = 500)  # exact, below k per bin
+        edges = np.linspace(0, 1, 6)
+        for j, s in enumerate(binned(x, y, edges)):
+            inside = y[(edges[j] <= x) & (x < edges[j + 1])]
+            self.assertEqual(len(s), len(inside))
+            np.testing.assert_allclose(s.quantile(q), np.percentile(inside, q * 100))
+        self.assertEqual(sum([len(s) for s in binned([1.0], [1.0], edges)]), 0)  # last edge is outside
+
+
+
+if __name__ == '__main__':
+    unittest.main()